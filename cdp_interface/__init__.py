@@ -1,33 +1,85 @@
-from cdp_interface.impala import Impala
+from cdp_interface.impala import Impala, ImpalaConnectionPool, FETCH_BATCH_SIZE
 from cdp_interface.hdfs import FileSystemHDFS
+from cdp_interface.schema_cache import SchemaCache, CACHE_PATH, CACHE_TTL
 from cdp_interface.upload_data import DataUpload
+from cdp_interface.local_backend import LocalFileSystem, LocalWarehouse
 
 class CDPInterface():
     def __init__(self, env, credentials):
+        """
+        With "backend": "local" in the environment, Impala and HDFS are replaced by DuckDB over a local folder
+        of Parquet files (see cdp_interface.local_backend) and the credentials are not used.
+        """
         self.env = env
         self.credentials = credentials
+        cache_path = CACHE_PATH
+        if env.get("backend", "impala") == "local":
+            self.hdfs = LocalFileSystem(env)
+            self.impala_pool = LocalWarehouse(env, self.hdfs)
+            # the metadata cache belongs with the local metastore it describes
+            cache_path = self.hdfs.root / "schema_cache.json"
+        else:
+            self.impala_pool = ImpalaConnectionPool(env)
+            self.hdfs = FileSystemHDFS(env, credentials)
+        self.schema_cache = SchemaCache(env["schema"], cache_path, ttl=float(env.get("schema_cache_ttl", CACHE_TTL)))
 
-    def select(self, query):
-        impala = Impala(self.env)
-        return impala.select(query)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def impala(self):
+        return Impala(self.env, self.impala_pool, self.schema_cache)
+
+    def parquet_options(self):
+        options = {}
+        if self.env.get("parquet_version"): options["version"] = self.env["parquet_version"]
+        if self.env.get("parquet_compression"): options["compression"] = self.env["parquet_compression"]
+        if self.env.get("parquet_compression_level"): options["compression_level"] = int(self.env["parquet_compression_level"])
+        if self.env.get("parquet_row_group_size"): options["row_group_size"] = int(self.env["parquet_row_group_size"])
+        if self.env.get("parquet_partitioned"): options["partitioned"] = self.env["parquet_partitioned"].lower() == "true"
+        return options
+
+    def close(self):
+        self.impala_pool.close()
+        self.hdfs.close()
+
+    def select(self, query, schema=None):
+        impala = self.impala()
+        return impala.select(query, schema)
+
+    def select_chunks(self, query, schema=None, batch_size=FETCH_BATCH_SIZE):
+        impala = self.impala()
+        return impala.select_chunks(query, schema, batch_size)
 
     def execute(self, query):
-        impala = Impala(self.env)
+        impala = self.impala()
         return impala.execute(query)
     
     def list_files(self, path):
-        hdfs = FileSystemHDFS(self.env, self.credentials)
-        return hdfs.list_files(path)
+        return self.hdfs.list_files(path)
     
     def download_file(self, file_path, destination_path):
-        hdfs = FileSystemHDFS(self.env, self.credentials)
-        return hdfs.download_file(file_path, destination_path)
+        return self.hdfs.download_file(file_path, destination_path)
     
     def delete_file(self, file_path):
-        hdfs = FileSystemHDFS(self.env, self.credentials)
-        return hdfs.delete_file(file_path)
+        return self.hdfs.delete_file(file_path)
+    
+    def delete_dir(self, path):
+        return self.hdfs.delete_dir(path)
+    
+    def upload_data(self, data, table_name, file_name, direct=None, schema=None, checkpoint=None):
+        """
+        direct=True skips the temp table and appends the files straight into the table (see DataUpload.upload_data_direct).
+        Defaults to the direct_load key of the environment file.
+        checkpoint (pipeline.journal) records the finished steps so an interrupted load can be resumed.
+        """
+        if direct is None: direct = self.env.get("direct_load", "false").lower() == "true"
+        uploader = DataUpload(self.hdfs, self.impala(), self.parquet_options(), schema)
+        if direct: return uploader.upload_data_direct(data, table_name, file_name, checkpoint)
+        return uploader.upload_data(data, table_name, file_name, checkpoint)
     
-    def upload_data(self, data, table_name, file_name):
-        uploader = DataUpload(FileSystemHDFS(self.env, self.credentials), Impala(self.env))
-        return uploader.upload_data(data, table_name, file_name)
-    
\ No newline at end of file
+    def upload_batch(self, data, table_name, batch_name, file_column=None, schema=None, checkpoint=None):
+        uploader = DataUpload(self.hdfs, self.impala(), self.parquet_options(), schema)
+        return uploader.upload_batch(data, table_name, batch_name, file_column, checkpoint)
\ No newline at end of file
@@ -1,46 +1,273 @@
+from contextlib import contextmanager
 from impala.dbapi import connect
-from impala.util import as_pandas
 import pandas as pd
 import pathlib
+import pyarrow as pa
+import re
+import threading
+import time
+
+from instrumentation import get_logger, timed, count
+
+log = get_logger("impala")
+
+SESSION_OPTIONS = ["SET SYNC_DDL=1"]
+FETCH_BATCH_SIZE = 10000
+
+ARROW_TYPES = {
+    "string": pa.string(),
+    "varchar": pa.string(),
+    "char": pa.string(),
+    "boolean": pa.bool_(),
+    "tinyint": pa.int8(),
+    "smallint": pa.int16(),
+    "int": pa.int32(),
+    "bigint": pa.int64(),
+    "float": pa.float32(),
+    "double": pa.float64(),
+    "real": pa.float64(),
+    # Impala's default precision and scale for a DECIMAL without them
+    "decimal": pa.decimal128(9, 0),
+    "timestamp": pa.timestamp("ns"),
+    "date": pa.date32()
+}
+
+
+def arrow_type(impala_type):
+    """
+    Arrow type of an Impala column type, e.g. "DOUBLE", "varchar(20)" or "decimal(10,2)". Arrow types pass through.
+    """
+    if isinstance(impala_type, pa.DataType): return impala_type
+    impala_type = impala_type.lower().strip()
+    decimal = re.match(r"decimal\s*\(\s*(\d+)\s*,\s*(\d+)\s*\)", impala_type)
+    if decimal: return pa.decimal128(int(decimal.group(1)), int(decimal.group(2)))
+    return ARROW_TYPES.get(re.sub(r"\(.*\)", "", impala_type), pa.string())
+
+
+def description_type(column):
+    """
+    Type of a cursor description entry. impyla reports decimals as a bare DECIMAL, with the precision and scale
+    in the precision / scale fields of the entry.
+    """
+    name, type_code, display_size, internal_size, precision, scale = column[:6]
+    if type_code.lower() == "decimal" and precision is not None: return pa.decimal128(int(precision), int(scale or 0))
+    return type_code
+
+
+def result_schema(description, schema=None):
+    """
+    Arrow schema of a result set: the types reported by the cursor, overridden by the declared schema
+    (a pyarrow Schema or {column: Impala or Arrow type}) for the columns it names.
+    """
+    if isinstance(schema, pa.Schema): schema = {x.name: x.type for x in schema}
+    schema = schema or {}
+    return pa.schema([
+        (x[0], arrow_type(schema.get(x[0], description_type(x)))) for x in description
+    ])
+
+
+def statement_kind(query):
+    """
+    First keywords of a statement (SELECT, CREATE TABLE, REFRESH, ...), to group timings without logging whole queries.
+    """
+    words = query.split()
+    if words[:1] in (["CREATE"], ["DROP"], ["ALTER"], ["INSERT"]): return " ".join(words[:2]).upper()
+    return " ".join(words[:1]).upper()
+
+
+def fetch_batches(cursor, arrow_schema, batch_size=FETCH_BATCH_SIZE):
+    """
+    Yields the remaining rows of the cursor as RecordBatches, converting column by column.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows: return
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(zip(*rows), arrow_schema)],
+            schema=arrow_schema
+        )
+
+
+def open_session(env):
+    """
+    Opens a connection and a cursor (an HS2 session) with the session options already set.
+    """
+    conn = connect(
+        host = env["impala_host"],
+        port = env["port"],
+        auth_mechanism = "GSSAPI",
+        use_ssl = True
+    )
+    cursor = conn.cursor()
+    for option in SESSION_OPTIONS: cursor.execute(option)
+    return conn, cursor
+
+
+def close_session(conn, cursor):
+    for x in (cursor, conn):
+        try:
+            x.close()
+        except Exception as ex:
+            log.error(ex)
+
+
+class ImpalaConnectionPool:
+    """
+    Keeps authenticated Impala sessions open between statements.
+    Every pooled session gets its options set once when it is opened. Sessions idle for longer than the
+    idle timeout are closed instead of reused, the rest are pinged before being handed out.
+    Size and idle timeout come from impala_pool_size / impala_pool_idle_timeout in the environment file.
+    """
+    DEFAULT_SIZE = 4
+    DEFAULT_IDLE_TIMEOUT = 300
 
-class Impala:
     def __init__(self, env):
         self.env = env
-        
-    def select(self, query): 
+        self.size = int(env.get("impala_pool_size", self.DEFAULT_SIZE))
+        self.idle_timeout = float(env.get("impala_pool_idle_timeout", self.DEFAULT_IDLE_TIMEOUT))
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+
+    @contextmanager
+    def cursor(self):
+        self._slots.acquire()
         try:
-            query = self.replace_variables(query)
+            conn, cursor = self.checkout()
+            finished = False
+            try:
+                yield cursor
+                finished = True
+            finally:
+                # a session left by an error or an abandoned generator (GeneratorExit) may still hold a result set
+                if finished: self.checkin(conn, cursor)
+                else: close_session(conn, cursor)
+        finally:
+            self._slots.release()
 
-            conn = self.conn()
-            cursor = conn.cursor()
-            cursor.execute("SET SYNC_DDL=1")
-            cursor.execute(query)
-            return as_pandas(cursor)
+
+    def checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle: break
+                conn, cursor, last_used = self._idle.pop()
+
+            if time.monotonic() - last_used > self.idle_timeout:
+                close_session(conn, cursor)
+                continue
+            try:
+                cursor.ping()
+                return conn, cursor
+            except Exception:
+                close_session(conn, cursor)
+
+        return open_session(self.env)
+
+
+    def checkin(self, conn, cursor):
+        with self._lock:
+            self._idle.append((conn, cursor, time.monotonic()))
+
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, cursor, last_used in idle: close_session(conn, cursor)
+
+
+class Impala:
+    def __init__(self, env, pool=None, schema_cache=None):
+        self.env = env
+        self.pool = pool
+        self.schema_cache = schema_cache
+        
+    def select(self, query, schema=None):
+        """
+        Result of the query as a DataFrame built from typed Arrow columns.
+        With a declared schema the columns come back in those types (strings as the pandas string dtype),
+        so there is no need to recast them afterwards.
+        A failed query returns an empty DataFrame; rows that can't be converted to their column types raise,
+        they would otherwise look like an empty result.
+        """
+        try:
+            table = self.select_arrow(query, schema)
+            if schema is None: return table.to_pandas()
+            return table.to_pandas(types_mapper={pa.string(): pd.StringDtype()}.get)
+        except pa.ArrowException:
+            raise
         except Exception as ex:
-            print(ex)
+            log.error(ex)
             return pd.DataFrame()
 
+    def select_arrow(self, query, schema=None, batch_size=FETCH_BATCH_SIZE):
+        query = self.replace_variables(query)
+
+        with timed("impala.select", statement=statement_kind(query)), self.cursor() as cursor:
+            cursor.execute(query)
+            if not cursor.description: return pa.table({})
+            arrow_schema = result_schema(cursor.description, schema)
+            table = pa.Table.from_batches(fetch_batches(cursor, arrow_schema, batch_size), schema=arrow_schema)
+        count("rows_fetched", table.num_rows)
+        return table
+
+    def select_batches(self, query, schema=None, batch_size=FETCH_BATCH_SIZE):
+        """
+        Runs the query and yields pyarrow RecordBatches of up to batch_size rows, so large results never have to be
+        held as Python rows or in one piece. The session stays checked out until the iterator is exhausted or closed.
+        """
+        query = self.replace_variables(query)
+
+        with self.cursor() as cursor:
+            cursor.execute(query)
+            if not cursor.description: return
+            arrow_schema = result_schema(cursor.description, schema)
+            yield from fetch_batches(cursor, arrow_schema, batch_size)
+
+    def select_chunks(self, query, schema=None, batch_size=FETCH_BATCH_SIZE):
+        """
+        Same as select_batches, one DataFrame per batch.
+        """
+        for batch in self.select_batches(query, schema, batch_size):
+            if schema is None: yield batch.to_pandas()
+            else: yield batch.to_pandas(types_mapper={pa.string(): pd.StringDtype()}.get)
+
     def execute(self, query):
         try:
             query = self.replace_variables(query)
             
-            conn = self.conn()
-            cursor = conn.cursor()
-            cursor.execute("SET SYNC_DDL=1")
-            cursor.execute(query)
+            with timed("impala.execute", statement=statement_kind(query)), self.cursor() as cursor:
+                cursor.execute(query)
             return True
         except Exception as ex:
-            print(ex)
+            log.error(ex)
             return False
         
+    def cached(self, key, load):
+        """
+        Metastore lookups go through the schema cache when the instance has one.
+        """
+        if self.schema_cache is None: return load()
+        return self.schema_cache.get(key, load)
+    
+    def invalidate_table(self, table_name):
+        if self.schema_cache is not None: self.schema_cache.invalidate(table_name)
+        
     def table_list(self):
+        return self.cached("tables", self.load_table_list)
+    
+    def load_table_list(self):
         try:
             return self.select("SHOW TABLES IN @schema")["name"].tolist()
         except Exception as ex:
-            print(ex)
+            log.error(ex)
             return pd.DataFrame()
         
     def column_list(self, table_name):
+        columns = self.cached(f"columns:{table_name}", lambda: self.load_column_list(table_name))
+        return [tuple(x) for x in columns]
+    
+    def load_column_list(self, table_name):
         result = self.select(f"DESCRIBE @schema.{table_name}")
         
         if result.empty: return []
@@ -49,13 +276,37 @@ class Impala:
             zip( result["name"].to_list(), result["type"].to_list() )
         )
     
+    def table_details(self, table_name):
+        """
+        HDFS location and partition columns of a table, read from DESCRIBE FORMATTED.
+        """
+        return self.cached(f"details:{table_name}", lambda: self.load_table_details(table_name))
+    
+    def load_table_details(self, table_name):
+        result = self.select(f"DESCRIBE FORMATTED @schema.{table_name}")
+        if result.empty: return None
+        
+        details = {"location": None, "partition_columns": []}
+        section = None
+        for name, value in zip(result["name"].fillna("").str.strip(), result["type"].fillna("").str.strip()):
+            if name.startswith("#"):
+                if name != "# col_name": section = name
+                continue
+            if name == "Location:": details["location"] = value
+            elif section == "# Partition Information" and name: details["partition_columns"].append(name)
+        
+        if details["location"] is None: return None
+        return details
+    
     def add_column(self, table_name, column_name, column_type):
         query = pathlib.Path("cdp_interface/sql_queries/impala_add_column.sql").read_text()
         query = query.replace("@table_name", table_name)
         query = query.replace("@column_name", column_name)
         query = query.replace("@column_type", column_type)
         
-        return self.execute(query)
+        result = self.execute(query)
+        self.invalidate_table(table_name)
+        return result
          
     def refresh_table(self, table_name):
         return self.execute(f"REFRESH @schema.{table_name}")
@@ -64,11 +315,29 @@ class Impala:
         return self.execute(f"COMPUTE STATS @schema.{table_name}")
     
     def drop_table(self, table_name):
-        return self.execute(f"DROP TABLE @schema.{table_name}")
+        result = self.execute(f"DROP TABLE @schema.{table_name}")
+        self.invalidate_table(table_name)
+        return result
     
     
     #######################################################
 
+    
+    @contextmanager
+    def cursor(self):
+        """
+        Pooled session when the Impala instance has a pool, otherwise a one-off session that is closed afterwards.
+        """
+        if self.pool is not None:
+            with self.pool.cursor() as cursor:
+                yield cursor
+            return
+        
+        conn, cursor = open_session(self.env)
+        try:
+            yield cursor
+        finally:
+            close_session(conn, cursor)
         
     def conn(self):
         return connect(
@@ -81,5 +350,5 @@ class Impala:
     def replace_variables(self, query):
         for key, item in self.env.items():
             variable = f"@{key}"
-            query = query.replace(variable, item)
+            query = query.replace(variable, str(item))
         return query
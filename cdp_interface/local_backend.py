@@ -0,0 +1,541 @@
+"""
+Local stand-in for the cluster: Impala statements run on DuckDB over a folder of Parquet files that plays HDFS.
+
+LocalFileSystem has the FileSystemHDFS methods and LocalWarehouse takes the place of ImpalaConnectionPool, so the
+regular Impala and DataUpload classes (variable substitution, SQL files, Arrow fetches, schema cache) run unchanged
+on top of them. Every table is a folder of Parquet files at its LOCATION, like an Impala table; the table
+definitions are kept in metastore.json in the root folder. Select with the "backend": "local" environment key
+(environments/local.json).
+
+What is emulated, and what is not:
+- CREATE TABLE ... [PARTITIONED BY (...)] STORED AS PARQUET LOCATION, DROP TABLE (drops the data too, like the
+  purge-on-drop tables created by Impala on the cluster), ALTER TABLE ADD PARTITION / RECOVER PARTITIONS /
+  ADD COLUMNS, INSERT INTO/OVERWRITE [PARTITION (columns)] ... SELECT, REFRESH, SHOW TABLES, DESCRIBE [FORMATTED].
+- Files become visible on CREATE, REFRESH, INSERT and partition changes, and only in registered partitions.
+- Other statements (SELECT, WITH, ...) go to DuckDB with Impala string literals and `identifiers` translated.
+  Impala functions without a DuckDB equivalent fail like any other bad query.
+- Parquet columns are matched by name, not by position as Impala does by default.
+"""
+import contextlib
+import json
+import pathlib
+import re
+import shutil
+import threading
+import uuid
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cdp_interface.impala import ARROW_TYPES, arrow_type
+from cdp_interface.upload_data import partition_path_value
+from instrumentation import timed, count
+
+LOCAL_ROOT = "local_cluster"
+METASTORE_FILE = "metastore.json"
+
+DUCKDB_TYPES = {
+    "string": "VARCHAR",
+    "varchar": "VARCHAR",
+    "char": "VARCHAR",
+    "int": "INTEGER",
+    "real": "DOUBLE"
+}
+
+# Impala type names reported in the cursor description, as impyla does
+IMPALA_TYPES = {}
+for name, data_type in ARROW_TYPES.items(): IMPALA_TYPES.setdefault(data_type, name.upper())
+
+STRING_LITERAL = r'"(?:[^"\\]|\\.)*"' + "|" + r"'(?:[^'\\]|\\.)*'"
+TABLE_NAME = r"`?(\w+)`?(?:\.`?(\w+)`?)?"
+
+
+def duckdb_type(impala_type):
+    impala_type = impala_type.lower().strip()
+    return DUCKDB_TYPES.get(re.sub(r"\(.*\)", "", impala_type), impala_type.upper())
+
+
+def impala_type_name(data_type):
+    if pa.types.is_decimal(data_type): return "DECIMAL"
+    if pa.types.is_timestamp(data_type): return "TIMESTAMP"
+    return IMPALA_TYPES.get(data_type, "STRING")
+
+
+def description_entry(field):
+    """
+    Cursor description entry of a result column. Like impyla, decimals are a bare DECIMAL with their precision
+    and scale in the entry.
+    """
+    if pa.types.is_decimal(field.type): return (field.name, "DECIMAL", None, None, field.type.precision, field.type.scale, None)
+    return (field.name, impala_type_name(field.type), None, None, None, None, None)
+
+
+def unquote(literal):
+    """
+    Value of an Impala string literal ("..." or '...' with backslash escapes).
+    """
+    if literal[:1] not in ("'", '"'): return literal
+    return re.sub(r"\\(.)", r"\1", literal[1:-1])
+
+
+def translate_sql(query):
+    """
+    Impala SQL to DuckDB SQL: "double quoted" and 'single quoted' strings with backslash escapes become standard
+    single quoted strings, `backticks` become "quoted identifiers". Everything else is passed through.
+    """
+    def replace(match):
+        token = match.group(0)
+        if token.startswith("`"): return '"' + token[1:-1] + '"'
+        return "'" + unquote(token).replace("'", "''") + "'"
+
+    return re.sub(STRING_LITERAL + r"|`[^`]*`", replace, query)
+
+
+def parenthesized(text, start=0):
+    """
+    Text inside the first parenthesis found from start, up to its matching closing parenthesis.
+    """
+    begin = text.index("(", start)
+    depth = 0
+    for index in range(begin, len(text)):
+        depth += {"(": 1, ")": -1}.get(text[index], 0)
+        if depth == 0: return text[begin + 1:index]
+    raise Exception(f"unbalanced parentheses: {text[begin:begin + 80]}")
+
+
+def column_definitions(text):
+    """
+    [name, type] of a column list like "a STRING, b DECIMAL(10,2) COMMENT '...'", types in lower case.
+    """
+    parts = re.split(r",(?![^()]*\))", text)
+    return [[x.split()[0].strip("`"), x.split()[1].lower()] for x in parts if x.strip()]
+
+
+def partition_spec(spec):
+    """
+    {column: value} of a PARTITION (col="value", ...) clause.
+    """
+    pairs = re.findall(r"(\w+)\s*=\s*(" + STRING_LITERAL + r"|[^,\s)]+)", spec)
+    return {column.lower(): unquote(value) for column, value in pairs}
+
+
+def fetch_arrow(result):
+    # to_arrow_table replaced fetch_arrow_table in newer DuckDB versions
+    if hasattr(result, "to_arrow_table"): return result.to_arrow_table()
+    return result.fetch_arrow_table()
+
+
+class LocalFileSystem:
+    """
+    Stand-in for FileSystemHDFS over a local folder. Relative paths are resolved from hdfs_root_folder, like the
+    WebHDFS client does, absolute paths (table locations) from the root folder.
+    """
+
+    def __init__(self, environment, root=None):
+        self.environment = environment
+        self.root = pathlib.Path(root or environment.get("local_root", LOCAL_ROOT))
+        self.home = environment["hdfs_root_folder"]
+
+    def local_path(self, path):
+        path = str(path)
+        if not path.startswith("/"): path = f"{self.home.rstrip('/')}/{path}"
+        return self.root / path.lstrip("/")
+
+    def hdfs_path(self, local_path):
+        return "/" + pathlib.Path(local_path).relative_to(self.root).as_posix()
+
+    def close(self):
+        pass
+
+    def create_dir(self, fs, path):
+        self.local_path(path).mkdir(parents=True, exist_ok=True)
+        return True
+
+    def list_files(self, folder_path="."):
+        return sorted(x.name for x in self.local_path(folder_path).iterdir())
+
+    @timed("hdfs.download_file")
+    def download_file(self, file_path, destination_folder, n_threads=0):
+        source = self.local_path(file_path)
+        destination = pathlib.Path(destination_folder)
+        if not destination.exists(): destination.mkdir()
+        destination = destination / source.name
+
+        if source.is_dir(): shutil.copytree(source, destination, dirs_exist_ok=True)
+        else: shutil.copy(source, destination)
+        return str(destination)
+
+    @timed("hdfs.upload_file")
+    def upload_file(self, file_path, destination_path, n_threads=0):
+        count("hdfs_bytes_uploaded", pathlib.Path(file_path).stat().st_size)
+        self.create_dir(None, destination_path)
+        destination = self.local_path(destination_path) / pathlib.Path(file_path).name
+        shutil.copy(file_path, destination)
+        return self.hdfs_path(destination)
+
+    @timed("hdfs.upload_files")
+    def upload_files(self, file_paths, destination_path, n_threads=0):
+        self.create_dir(None, destination_path)
+        file_paths = [str(x) for x in file_paths]
+        count("hdfs_bytes_uploaded", sum(pathlib.Path(x).stat().st_size for x in file_paths))
+
+        destination_folder = self.local_path(destination_path)
+        for file_path in file_paths: shutil.copy(file_path, destination_folder)
+        return [self.hdfs_path(destination_folder / pathlib.Path(x).name) for x in file_paths]
+
+    @timed("hdfs.delete")
+    def delete_file(self, file_path):
+        path = self.local_path(file_path)
+        if path.is_dir(): shutil.rmtree(path)
+        elif path.exists(): path.unlink()
+        return True
+
+    def delete_dir(self, path):
+        return self.delete_file(path)
+
+    @timed("hdfs.clear_dir")
+    def clear_dir(self, path):
+        self.delete_file(path)
+        self.create_dir(None, path)
+        return True
+
+
+class LocalCursor:
+    """
+    The part of the impyla cursor that Impala uses: execute, description, fetchmany, ping and close.
+    """
+
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+        self.connection = warehouse.connection.cursor()
+        self.description = None
+        self._result = None
+        self._offset = 0
+
+    def execute(self, query):
+        self._result = self.warehouse.run(self.connection, query)
+        self._offset = 0
+        self.description = None
+        if self._result is None: return
+
+        # columns of types Impala doesn't have come back as strings
+        self._result = pa.table({
+            x.name: column if x.type in IMPALA_TYPES or pa.types.is_decimal(x.type) or pa.types.is_timestamp(x.type)
+            else column.cast(pa.string())
+            for x, column in zip(self._result.schema, self._result.columns)
+        })
+        self.description = [description_entry(x) for x in self._result.schema]
+
+    def fetchmany(self, size):
+        if self._result is None: return []
+        rows = self._result.slice(self._offset, size)
+        self._offset += rows.num_rows
+        return list(zip(*[x.to_pylist() for x in rows.columns]))
+
+    def fetchall(self):
+        return self.fetchmany(self._result.num_rows if self._result is not None else 0)
+
+    def ping(self):
+        return True
+
+    def close(self):
+        self.connection.close()
+
+
+class LocalWarehouse:
+    """
+    Stand-in for ImpalaConnectionPool: hands out LocalCursors over one in-memory DuckDB database where every
+    table of the metastore is a view over its Parquet files.
+    """
+
+    def __init__(self, env, file_system):
+        self.env = env
+        self.fs = file_system
+        self.schema = env["schema"].lower()
+        self.metastore_path = self.fs.root / METASTORE_FILE
+        self.connection = duckdb.connect()
+        self._lock = threading.RLock()
+        self.tables = self.read_metastore()
+        for key in self.tables: self.refresh(key)
+
+
+    @contextlib.contextmanager
+    def cursor(self):
+        cursor = LocalCursor(self)
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def read_metastore(self):
+        if not self.metastore_path.exists(): return {}
+        return json.loads(self.metastore_path.read_text())
+
+
+    def save_metastore(self):
+        self.metastore_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.metastore_path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(self.tables, indent=4))
+        temp_path.replace(self.metastore_path)
+
+
+    def table_key(self, first, second=None):
+        return f"{first}.{second}".lower() if second else f"{self.schema}.{first.lower()}"
+
+
+    def table(self, key):
+        if key not in self.tables: raise Exception(f"AnalysisException: Could not resolve table reference: '{key}'")
+        return self.tables[key]
+
+
+    def run(self, connection, query):
+        """
+        Runs one statement. Returns the result as an Arrow table, or None for statements without a result set.
+        """
+        query = query.strip().rstrip(";").strip()
+        statement = " ".join(query.split()[:2]).upper()
+
+        if statement.split()[0] in ("SET", "USE") or statement == "COMPUTE STATS": return None
+        if statement.startswith("CREATE TABLE"): return self.create_table(query)
+        if statement.startswith("DROP TABLE"): return self.drop_table(query)
+        if statement.startswith("ALTER TABLE"): return self.alter_table(query)
+        if statement.startswith("INSERT "): return self.insert(connection, query)
+        if statement.startswith(("REFRESH ", "INVALIDATE METADATA")): return self.refresh_statement(query)
+        if statement.startswith("SHOW TABLES"): return self.show_tables(query)
+        if statement.startswith("DESCRIBE "): return self.describe(query)
+        return fetch_arrow(connection.execute(translate_sql(query)))
+
+
+    def create_table(self, query):
+        match = re.match(r"CREATE\s+(?:EXTERNAL\s+)?TABLE\s+(IF\s+NOT\s+EXISTS\s+)?" + TABLE_NAME + r"\s*\(", query, flags=re.I)
+        if not match: raise Exception(f"statement not supported by the local backend: {query[:80]}")
+        key = self.table_key(match.group(2), match.group(3))
+
+        with self._lock:
+            if key in self.tables:
+                if match.group(1): return None
+                raise Exception(f"AnalysisException: Table already exists: {key}")
+
+            partitioned = re.search(r"PARTITIONED\s+BY\s*\(", query, flags=re.I)
+            partition_columns = column_definitions(parenthesized(query, partitioned.start())) if partitioned else []
+            columns = column_definitions(parenthesized(query, match.end() - 1))
+
+            location = re.search(r"LOCATION\s+(" + STRING_LITERAL + ")", query, flags=re.I)
+            location = unquote(location.group(1)) if location else f"{self.fs.home.rstrip('/')}/{key.split('.')[1]}"
+            location = "/" + re.sub(r"/+", "/", location).strip("/")
+
+            self.tables[key] = {
+                "columns": columns,
+                "partition_columns": partition_columns,
+                "location": location,
+                "partitions": []
+            }
+            self.fs.local_path(location).mkdir(parents=True, exist_ok=True)
+            self.save_metastore()
+            self.refresh(key)
+        return None
+
+
+    def drop_table(self, query):
+        match = re.match(r"DROP\s+TABLE\s+(IF\s+EXISTS\s+)?" + TABLE_NAME, query, flags=re.I)
+        key = self.table_key(match.group(2), match.group(3))
+
+        with self._lock:
+            if key not in self.tables:
+                if match.group(1): return None
+                self.table(key)
+            table = self.tables.pop(key)
+            self.connection.execute(f"DROP VIEW IF EXISTS {key}")
+            shutil.rmtree(self.fs.local_path(table["location"]), ignore_errors=True)
+            self.save_metastore()
+        return None
+
+
+    def alter_table(self, query):
+        match = re.match(r"ALTER\s+TABLE\s+" + TABLE_NAME + r"\s+(.*)$", query, flags=re.I | re.S)
+        key = self.table_key(match.group(1), match.group(2))
+        action = match.group(3)
+
+        with self._lock:
+            table = self.table(key)
+            if re.match(r"ADD\s+(IF\s+NOT\s+EXISTS\s+)?PARTITION", action, flags=re.I):
+                specs = re.findall(r"PARTITION\s*\(((?:" + STRING_LITERAL + r"|[^)\"'])*)\)", action, flags=re.I)
+                for spec in specs: self.add_partition(table, partition_spec(spec))
+            elif re.match(r"RECOVER\s+PARTITIONS", action, flags=re.I):
+                self.recover_partitions(table)
+            elif re.match(r"ADD\s+COLUMNS", action, flags=re.I):
+                table["columns"] += column_definitions(parenthesized(action))
+            else:
+                raise Exception(f"statement not supported by the local backend: {query[:80]}")
+            self.save_metastore()
+            self.refresh(key)
+        return None
+
+
+    def add_partition(self, table, values):
+        folder = "/".join(f"{name}={partition_path_value(values.get(name.lower()))}" for name, _ in table["partition_columns"])
+        self.fs.local_path(f"{table['location']}/{folder}").mkdir(parents=True, exist_ok=True)
+        if folder not in table["partitions"]: table["partitions"].append(folder)
+
+
+    def recover_partitions(self, table):
+        depth = len(table["partition_columns"])
+        location = self.fs.local_path(table["location"])
+        for folder in sorted(location.glob("/".join(["*"] * depth))):
+            if not folder.is_dir(): continue
+            relative = folder.relative_to(location).as_posix()
+            names = [x.split("=")[0] for x in relative.split("/")]
+            if names == [name for name, _ in table["partition_columns"]] and relative not in table["partitions"]:
+                table["partitions"].append(relative)
+
+
+    def insert(self, connection, query):
+        match = re.match(
+            r"INSERT\s+(INTO|OVERWRITE)\s+(?:TABLE\s+)?" + TABLE_NAME + r"\s*(?:\(([^)]*)\))?\s*"
+            r"(?:PARTITION\s*\(([^)]*)\))?\s*((?:SELECT|WITH|VALUES)\b.*)$",
+            query, flags=re.I | re.S
+        )
+        if not match: raise Exception(f"statement not supported by the local backend: {query[:80]}")
+        key = self.table_key(match.group(2), match.group(3))
+        table = self.table(key)
+        # dynamic partition clause only: the partition columns come last in the select list
+        partition_names = [x.strip().strip("`") for x in match.group(5).split(",")] if match.group(5) else []
+        if any("=" in x for x in partition_names): raise Exception("static partition values are not supported by the local backend")
+
+        result = fetch_arrow(connection.execute(translate_sql(match.group(6))))
+        names = [x.strip().strip("`") for x in match.group(4).split(",")] + partition_names if match.group(4) else None
+        all_columns = table["columns"] + table["partition_columns"]
+        names = names or [name for name, _ in all_columns][:result.num_columns]
+        if len(names) != result.num_columns:
+            raise Exception(f"AnalysisException: {len(names)} target columns, {result.num_columns} select list expressions")
+
+        result = result.rename_columns(names)
+        data = pa.table({
+            name: result[name].cast(arrow_type(column_type)) if name in names else pa.nulls(result.num_rows, arrow_type(column_type))
+            for name, column_type in all_columns
+        })
+
+        with self._lock:
+            location = self.fs.local_path(table["location"])
+            if match.group(1).upper() == "OVERWRITE":
+                shutil.rmtree(location, ignore_errors=True)
+                table["partitions"] = []
+            self.write_files(table, data)
+            self.save_metastore()
+            self.refresh(key)
+        count("rows_inserted", data.num_rows)
+        return None
+
+
+    def write_files(self, table, data):
+        """
+        Writes the rows into the table location, one new file per partition folder.
+        """
+        location = self.fs.local_path(table["location"])
+        base_name = uuid.uuid4().hex
+        partition_columns = [name for name, _ in table["partition_columns"]]
+        if not partition_columns:
+            location.mkdir(parents=True, exist_ok=True)
+            pq.write_table(data, location / f"{base_name}.parq")
+            return
+
+        data_schema = pa.schema([x for x in data.schema if x.name not in partition_columns])
+        frame = data.to_pandas()
+        for index, (values, partition) in enumerate(frame.groupby(partition_columns, sort=False, dropna=False)):
+            values = values if isinstance(values, tuple) else (values,)
+            self.add_partition(table, {name.lower(): None if pd.isna(x) else x for name, x in zip(partition_columns, values)})
+            folder = "/".join(f"{name}={partition_path_value(x)}" for name, x in zip(partition_columns, values))
+            partition = pa.Table.from_pandas(partition.drop(columns=partition_columns), schema=data_schema, preserve_index=False)
+            pq.write_table(partition, location / folder / f"{base_name}_{index}.parq")
+
+
+    def refresh_statement(self, query):
+        match = re.match(r"(?:REFRESH|INVALIDATE\s+METADATA)\s+" + TABLE_NAME, query, flags=re.I)
+        with self._lock:
+            if match is None:
+                for key in self.tables: self.refresh(key)
+                return None
+            key = self.table_key(match.group(1), match.group(2))
+            self.table(key)
+            self.refresh(key)
+        return None
+
+
+    def data_files(self, table):
+        """
+        Parquet files Impala would read: files in the table folder (or in its registered partitions),
+        skipping hidden and staging files that start with "." or "_".
+        """
+        location = self.fs.local_path(table["location"])
+        folders = [location / x for x in table["partitions"]] if table["partition_columns"] else [location]
+        return sorted(
+            str(x) for folder in folders if folder.is_dir()
+            for x in folder.iterdir() if x.is_file() and not x.name.startswith((".", "_"))
+        )
+
+
+    def refresh(self, key):
+        """
+        Recreates the view of a table over its current files, the local equivalent of REFRESH.
+        """
+        table = self.tables[key]
+        columns = table["columns"] + table["partition_columns"]
+        files = self.data_files(table)
+        present = set()
+        if files:
+            file_list = "[" + ", ".join("'" + x.replace("'", "''") + "'" for x in files) + "]"
+            source = f"read_parquet({file_list}, hive_partitioning = {bool(table['partition_columns'])}, union_by_name = true, hive_types_autocast = false)"
+            present = {x[0].lower() for x in self.connection.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()}
+
+        select_list = ", ".join(
+            f"CAST({name if name.lower() in present else 'NULL'} AS {duckdb_type(column_type)}) AS {name}"
+            for name, column_type in columns
+        )
+        body = f"SELECT {select_list} FROM {source}" if files else f"SELECT {select_list} WHERE false"
+        self.connection.execute(f"CREATE SCHEMA IF NOT EXISTS {key.split('.')[0]}")
+        self.connection.execute(f"CREATE OR REPLACE VIEW {key} AS {body}")
+
+
+    def show_tables(self, query):
+        match = re.search(r"\bIN\s+`?(\w+)`?", query, flags=re.I)
+        schema = (match.group(1) if match else self.schema).lower()
+        names = sorted(key.split(".")[1] for key in self.tables if key.split(".")[0] == schema)
+        return pa.table({"name": pa.array(names, type=pa.string())})
+
+
+    def describe(self, query):
+        match = re.match(r"DESCRIBE\s+(FORMATTED\s+|EXTENDED\s+)?" + TABLE_NAME, query, flags=re.I)
+        key = self.table_key(match.group(2), match.group(3))
+        table = self.table(key)
+        columns = table["columns"] + table["partition_columns"]
+
+        if not match.group(1):
+            rows = [(name, column_type, "") for name, column_type in columns]
+        else:
+            rows = [("# col_name", "data_type", "comment"), ("", None, None)]
+            rows += [(name, column_type, None) for name, column_type in table["columns"]]
+            if table["partition_columns"]:
+                rows += [("", None, None), ("# Partition Information", None, None), ("# col_name", "data_type", "comment"), ("", None, None)]
+                rows += [(name, column_type, None) for name, column_type in table["partition_columns"]]
+            rows += [
+                ("", None, None),
+                ("# Detailed Table Information", None, None),
+                ("Database:", key.split(".")[0], None),
+                ("Location:", table["location"], None),
+                ("Table Type:", "EXTERNAL_TABLE", None),
+                ("", None, None),
+                ("# Storage Information", None, None),
+                ("InputFormat:", "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat", None)
+            ]
+
+        return pa.table({
+            name: pa.array([x[index] for x in rows], type=pa.string())
+            for index, name in enumerate(["name", "type", "comment"])
+        })
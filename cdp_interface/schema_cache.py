@@ -0,0 +1,78 @@
+import json
+import pathlib
+import threading
+import time
+
+CACHE_PATH = "cdp_interface/cache/schema_cache.json"
+CACHE_TTL = 24 * 60 * 60
+
+
+class SchemaCache:
+    """
+    Metastore answers (table list, column lists, table details) of one Impala schema, kept in memory and in
+    a JSON file shared by later runs. Entries are reused for ttl seconds and dropped explicitly when a table
+    changes (add_column, drop_table). Failed or empty answers are never stored.
+    """
+
+    def __init__(self, schema, path=CACHE_PATH, ttl=CACHE_TTL):
+        self.schema = schema
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._entries = None
+
+
+    def entries(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self.read_file().get(self.schema, {})
+            return self._entries
+
+
+    def read_file(self):
+        if not self.path.exists(): return {}
+        try:
+            return json.loads(self.path.read_text())
+        except ValueError:
+            return {}
+
+
+    def save(self):
+        with self._lock:
+            all_entries = self.read_file()
+            all_entries[self.schema] = self.entries()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(all_entries, indent=4))
+
+
+    def get(self, key, load):
+        """
+        Cached value of key, or load() when it is missing or older than ttl.
+        """
+        with self._lock:
+            entry = self.entries().get(key)
+            if entry is not None and time.time() - entry["stored_at"] < self.ttl: return entry["value"]
+
+        value = load()
+        if isinstance(value, (list, dict)) and value: self.store(key, value)
+        return value
+
+
+    def store(self, key, value):
+        with self._lock:
+            self.entries()[key] = {"value": value, "stored_at": time.time()}
+            self.save()
+
+
+    def invalidate(self, table_name=None):
+        """
+        Forgets one table (its columns, details and the table list) or, without table_name, the whole schema.
+        """
+        with self._lock:
+            entries = self.entries()
+            if table_name is None:
+                entries.clear()
+            else:
+                for key in ("tables", f"columns:{table_name}", f"details:{table_name}"):
+                    entries.pop(key, None)
+            self.save()
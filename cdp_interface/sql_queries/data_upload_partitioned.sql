@@ -0,0 +1,10 @@
+INSERT INTO @schema.@table_name(
+    @column_definition
+)
+PARTITION (@partition_columns)
+
+SELECT
+    @column_definition,
+    @partition_columns
+FROM 
+    @schema.@temp_table_name
\ No newline at end of file
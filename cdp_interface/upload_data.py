@@ -1,94 +1,463 @@
 import pathlib
+import pandas as pd
 import pyarrow.parquet as pq
 import pyarrow as pa
 import os
+import re
+import shutil
+import uuid
+
+from urllib.parse import urlparse
+from instrumentation import get_logger, timed, count
+
+log = get_logger("upload")
+
+
+class UploadCheckpoint:
+    """
+    Steps of one load that are finished. This one only lives as long as the load; pipeline.journal keeps
+    them in the run journal so a load interrupted by a crash resumes at the step that didn't finish.
+    load_id names the files a direct load writes, so a retried load overwrites them instead of adding copies.
+    restarted is set when the checkpoint replaced an unfinished load of other data under the same name, whose
+    temp table and staging files have to go before this load starts.
+    """
+
+    def __init__(self):
+        self.steps = set()
+        self.load_id = uuid.uuid4().hex
+        self.restarted = False
+
+    def completed(self, step):
+        return step in self.steps
+
+    def done(self, step):
+        self.steps.add(step)
+
+    def finish(self):
+        pass
+
+    def reset(self):
+        self.steps = set()
+
 
 class DataUpload:
     
     PARQUET_FOLDER_PATH = "cdp_interface/exported_parquet_files"
+    PARTITION_COLUMNS = ["plant_location", "date_inserted"]
+    DICTIONARY_COLUMNS = ["species", "plant_location", "product_form", "fob_or_dlv"]
+    PARQUET_OPTIONS = {
+        "version": "2.6",
+        "compression": "snappy",
+        "compression_level": None,
+        "row_group_size": None,
+        "partitioned": False
+    }
 
-    def __init__(self, file_system, database):
+    def __init__(self, file_system, database, parquet_options=None, schema=None):
+        """
+        parquet_options overrides PARQUET_OPTIONS: Parquet format version, codec (snappy, zstd, ...) and level,
+        rows per row group, and partitioned to write plant_location/date_inserted partition folders for the
+        staging temp table. Partition pruning on the main table comes from the main table itself being partitioned
+        (see main_table_data_upload), the staging layout only changes how the temp table is read.
+        schema is the TableSchema of the target table (competitor_data.schemas). When given, the data is cast
+        with it, the Parquet files use its Arrow schema and the temp table DDL is generated from it
+        instead of read from temp_table.sql.
+        """
         self.fs = file_system
         self.db = database
+        self.schema = schema
+        self.parquet_options = {**self.PARQUET_OPTIONS, **(parquet_options or {})}
+        # temp tables created by this instance, with the columns of the DDL that created them
+        self.temp_table_columns = {}
 
 
-    def upload_data(self, data, table_name, file_name):
-        print(f"uploading data to {table_name}")
-        file_path = self.export_data_to_parquet_file(data, table_name, file_name)
-        if file_path is None: return False
+    def upload_data(self, data, table_name, file_name, checkpoint=None):
+        """
+        Export -> HDFS -> temp table -> INSERT -> REFRESH -> drop temp table.
+        Steps the checkpoint has as finished are skipped, so a load that failed after its INSERT resumes at
+        the REFRESH without inserting the rows twice; data can be None when the export is already done.
+        """
+        log.info(f"uploading data to {table_name}")
+        checkpoint = checkpoint or UploadCheckpoint()
+        file_path = self.exported_path(table_name, file_name)
+        if checkpoint.restarted and not self.discard_leftovers(table_name, file_name, file_path): return False
+        
+        if not self.exported(checkpoint, file_path):
+            if data is None: return False
+            if self.schema is not None: data = self.schema.cast(data)
+            if self.export_data_to_parquet_file(data, table_name, file_name) is None: return False
+            checkpoint.done("export")
 
-        if not self.upload_parquet_file_to_hdfs(file_path, table_name, file_name): return False
-        print("upload_parquet_file_to_hdfs done.")
+        if not self.run_steps(checkpoint, [
+            ("hdfs", lambda: self.upload_parquet_file_to_hdfs(file_path, table_name, file_name), "upload_parquet_file_to_hdfs done."),
+            ("temp_table", lambda: self.create_temp_table_from_parquet_file(table_name, file_name), "temp table created from parquet file."),
+            ("insert", lambda: self.main_table_data_upload(table_name, file_name), "data uploaded to main table."),
+            ("refresh", lambda: self.main_table_refresh_metadata(table_name), "main table refreshed."),
+            ("drop", lambda: self.drop_temp_table(table_name, file_name), "temp table dropped.")
+        ]): return False
         
-        if not self.create_temp_table_from_parquet_file(table_name, file_name): return False
-        print("temp table created from parquet file.")
+        if file_path.exists(): self.delete_temp_parquet_file(file_path)
+        checkpoint.finish()
+        if data is not None: count("rows_loaded", data.shape[0])
 
-        if not self.main_table_data_upload(table_name, file_name): return False
-        print("data uploaded to main table.")
+        return True
 
-        if not self.main_table_refresh_metadata(table_name): return False
-        print("main table refreshed.")
 
-        if not self.drop_temp_table(table_name, file_name): return False
-        print("temp table dropped.")
-        
-        self.delete_temp_parquet_file(file_path)
+    def exported_path(self, table_name, file_name):
+        """
+        Local Parquet file (or partition folder tree) written by export_data_to_parquet_file for a load.
+        """
+        if self.parquet_options["partitioned"]: return pathlib.Path(self.PARQUET_FOLDER_PATH) / f"{table_name}_{file_name}"
+        return pathlib.Path(self.PARQUET_FOLDER_PATH) / f"{table_name}_{file_name}.parquet"
+
+
+    def discard_leftovers(self, table_name, file_name, file_path):
+        """
+        Drops the temp table, HDFS staging folder and exported files an interrupted load left under this name.
+        """
+        temp_table_name = f"{table_name}_{file_name}"
+        log.info(f"discarding what an interrupted load left as {temp_table_name}")
+        try:
+            if not self.db.execute(f"DROP TABLE IF EXISTS @schema.{temp_table_name}"): return False
+            self.db.invalidate_table(temp_table_name)
+            self.temp_table_columns.pop(temp_table_name, None)
+            if not self.fs.delete_dir(temp_table_name): return False
+            if pathlib.Path(file_path).exists(): self.delete_temp_parquet_file(file_path)
+            return True
+        except Exception as ex:
+            log.error(ex)
+            return False
+
+
+    def exported(self, checkpoint, file_path):
+        # the local files are only needed until they are on HDFS
+        return checkpoint.completed("export") and (checkpoint.completed("hdfs") or pathlib.Path(file_path).exists())
+
 
+    def run_steps(self, checkpoint, steps):
+        """
+        Runs (name, step, message) steps in order, skipping the ones the checkpoint has as finished
+        and recording the others. Stops at the first step that returns False.
+        """
+        for name, step, message in steps:
+            if checkpoint.completed(name):
+                log.info(f"{name}: finished by an earlier attempt, skipped.")
+                continue
+            if not step(): return False
+            checkpoint.done(name)
+            log.info(message)
         return True
 
 
-    def export_data_to_parquet_file(self, data, table_name, file_name):
-        print("export_data_to_parquet_file")
+    def upload_data_direct(self, data, table_name, file_name, checkpoint=None):
+        """
+        Appends data without a temp table: the Parquet files are written straight into the table's HDFS location
+        (one folder per partition for partitioned tables), then one ADD PARTITION and one REFRESH make them visible.
+        Only for append only tables; the data must have the table's columns (see validate_schema).
+        The file names come from the checkpoint's load_id, so retrying an interrupted load replaces its files.
+        """
+        log.info(f"uploading data directly to {table_name}")
+        checkpoint = checkpoint or UploadCheckpoint()
+        table = self.table_info(table_name)
+        if table is None: return False
+
+        if self.schema is not None: data = self.schema.cast(data)
+        data = self.validate_schema(data, table_name)
+        if data is None: return False
+
+        local_folder = pathlib.Path(self.PARQUET_FOLDER_PATH) / f"{table_name}_{file_name}"
         try:
-            pathlib.Path(self.PARQUET_FOLDER_PATH).mkdir(exist_ok=True)
+            if not self.run_steps(checkpoint, [
+                ("files", lambda: self.upload_direct_files(data, table, local_folder, file_name, checkpoint.load_id), "parquet files uploaded to table location."),
+                ("partitions", lambda: not table["partition_columns"] or self.add_partitions(table_name, table, data), "partitions added."),
+                ("refresh", lambda: self.main_table_refresh_metadata(table_name), "main table refreshed.")
+            ]): return False
+            checkpoint.finish()
+            count("rows_loaded", data.shape[0])
+            return True
+        finally:
+            if local_folder.exists(): self.delete_temp_parquet_file(local_folder)
+
+
+    def upload_direct_files(self, data, table, local_folder, file_name, load_id):
+        file_paths = self.export_direct_files(data, table, local_folder, f"{file_name}_{load_id[:8]}")
+        if file_paths is None: return False
+
+        table_path = urlparse(table["location"]).path
+        for partition_folder, file_path in file_paths:
+            destination = table_path if partition_folder is None else f"{table_path}/{partition_folder}"
+            if not self.fs.upload_files([file_path], destination): return False
+        return True
+
+
+    def table_info(self, table_name):
+        """
+        Column list and DESCRIBE FORMATTED details of a table, served by the schema cache of the Impala instance.
+        """
+        columns = self.db.column_list(table_name)
+        details = self.db.table_details(table_name)
+        if not columns or details is None:
+            log.error(f"could not read the definition of {table_name}")
+            return None
+        return {"columns": columns, **details}
+
+
+    def validate_schema(self, data, table_name):
+        """
+        Checks the data against the cached column list of the table and returns it with its columns in table order,
+        since Impala reads the Parquet files by position. Columns are matched by name (case insensitive, like Impala).
+        Returns None when a table column is missing from the data, the data has extra columns, or a column's
+        values cannot be stored in the table column's type.
+        """
+        columns = self.table_info(table_name)["columns"]
+        data_columns = {str(x).lower(): x for x in data.columns}
+        missing = [name for name, column_type in columns if name.lower() not in data_columns]
+        extra = sorted(set(data_columns) - {name.lower() for name, column_type in columns})
+        if missing or extra:
+            log.error(f"data does not match the columns of {table_name}: missing {missing}, extra {extra}")
+            return None
+        data = data[[data_columns[name.lower()] for name, column_type in columns]]
+
+        for (name, column_type), data_column in zip(columns, data.columns):
+            column_type = column_type.lower()
+            dtype = data[data_column].dtype
+            if column_type in ("double", "float") or column_type.startswith("decimal"):
+                valid = pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+            elif column_type in ("tinyint", "smallint", "int", "bigint"):
+                valid = pd.api.types.is_integer_dtype(dtype)
+            elif column_type == "boolean":
+                valid = pd.api.types.is_bool_dtype(dtype)
+            else:
+                valid = not pd.api.types.is_numeric_dtype(dtype)
+            if not valid:
+                log.error(f"column {data_column} ({dtype}) does not match {table_name}.{name} ({column_type})")
+                return None
+
+        return data.set_axis([x[0] for x in columns], axis=1)
+
+
+    @timed("upload.parquet_export")
+    def export_direct_files(self, data, table, local_folder, base_name):
+        """
+        Writes one Parquet file per partition (or one file for an unpartitioned table), named after base_name.
+        Returns a list of (partition folder or None, local file path).
+        """
+        try:
+            local_folder.mkdir(parents=True, exist_ok=True)
+            partition_columns = table["partition_columns"]
+
+            if not partition_columns:
+                file_path = local_folder / f"{base_name}.parquet"
+                parquet_table = pa.Table.from_pandas(data, preserve_index=False)
+                pq.write_table(parquet_table, where=file_path, **self.parquet_write_options(data.columns))
+                return [(None, file_path)]
+
+            file_paths = []
+            for index, (values, partition) in enumerate(data.groupby(partition_columns, sort=False, dropna=False)):
+                values = values if isinstance(values, tuple) else (values,)
+                partition_folder = "/".join(f"{col}={partition_path_value(x)}" for col, x in zip(partition_columns, values))
+                partition = partition.drop(columns=partition_columns)
+
+                file_path = local_folder / f"{base_name}_{index}.parquet"
+                parquet_table = pa.Table.from_pandas(partition, preserve_index=False)
+                pq.write_table(parquet_table, where=file_path, **self.parquet_write_options(partition.columns))
+                file_paths.append((partition_folder, file_path))
+            return file_paths
+        except Exception as ex:
+            log.error(ex)
+            return None
+
+
+    @timed("upload.add_partitions")
+    def add_partitions(self, table_name, table, data):
+        partition_columns = table["partition_columns"]
+        partitions = data[partition_columns].drop_duplicates().itertuples(index=False, name=None)
+        partition_specs = " ".join(
+            "PARTITION (" + ", ".join(f'{col}="{partition_sql_value(x)}"' for col, x in zip(partition_columns, values)) + ")"
+            for values in partitions
+        )
+        return self.db.execute(f"ALTER TABLE @schema.{table_name} ADD IF NOT EXISTS {partition_specs}")
+
+
+    def upload_batch(self, data, table_name, batch_name, file_column=None, checkpoint=None):
+        """
+        Uploads many files with a single temp table, INSERT and REFRESH.
+        data is either a dict {file_name: DataFrame} or one DataFrame with the file name in file_column.
+        Every file is written as its own Parquet file into one staging folder that backs the temp table.
+        The staging folder is kept until the load finishes, so with a checkpoint a failed batch resumes at the
+        step that failed (data can be empty when the export is already done).
+        Returns {file_name: True/False}.
+        """
+        log.info(f"uploading batch {batch_name} to {table_name}")
+        checkpoint = checkpoint or UploadCheckpoint()
+        if isinstance(data, pd.DataFrame):
+            data = {file_name: df.drop(columns=file_column) for file_name, df in data.groupby(file_column, sort=False)}
+
+        staging_name = f"{table_name}_{batch_name}"
+        staging_folder = pathlib.Path(self.PARQUET_FOLDER_PATH) / staging_name
+        
+        results = {file_name: True for file_name in data}
+        if not self.exported(checkpoint, staging_folder):
+            for file_name, df in data.items():
+                if self.schema is not None: df = self.schema.cast(df)
+                file_path = self.export_data_to_parquet_file(df, table_name, file_name, folder=staging_folder)
+                results[file_name] = file_path is not None
             
-            new_file_path = pathlib.Path(self.PARQUET_FOLDER_PATH) / f"{table_name}_{file_name}.parquet"
-            parquet_table = pa.Table.from_pandas(data, preserve_index=False)
-            pq.write_table(parquet_table, where=new_file_path, version="1.0")
+            if not any(results.values()): return results
+            checkpoint.done("export")
+        
+        uploaded = self.upload_batch_files(staging_folder, table_name, batch_name, checkpoint)
+        
+        if not uploaded:
+            results = {file_name: False for file_name in results}
+        else:
+            shutil.rmtree(staging_folder, ignore_errors=True)
+            checkpoint.finish()
+            count("rows_loaded", sum(df.shape[0] for file_name, df in data.items() if results[file_name]))
+        
+        return results
+    
+    
+    def upload_batch_files(self, staging_folder, table_name, batch_name, checkpoint=None):
+        log.debug("upload_parquet_files_to_hdfs")
+        return self.run_steps(checkpoint or UploadCheckpoint(), [
+            ("hdfs", lambda: self.upload_folder_to_hdfs(staging_folder, f"{table_name}_{batch_name}"), "upload_parquet_files_to_hdfs done."),
+            ("temp_table", lambda: self.create_temp_table_from_parquet_file(table_name, batch_name), "temp table created from parquet files."),
+            ("insert", lambda: self.main_table_data_upload(table_name, batch_name), "data uploaded to main table."),
+            ("refresh", lambda: self.main_table_refresh_metadata(table_name), "main table refreshed."),
+            ("drop", lambda: self.drop_temp_table(table_name, batch_name), "temp table dropped.")
+        ])
+
+
+    def parquet_write_options(self, columns):
+        options = self.parquet_options
+        return {
+            "version": options["version"],
+            "compression": options["compression"],
+            "compression_level": options["compression_level"],
+            "row_group_size": options["row_group_size"],
+            # Impala reads v1 data pages only
+            "data_page_version": "1.0",
+            "use_dictionary": [x for x in self.DICTIONARY_COLUMNS if x in columns]
+        }
+
+
+    @timed("upload.parquet_export")
+    def export_data_to_parquet_file(self, data, table_name, file_name, folder=None):
+        """
+        Writes a single Parquet file, or with the partitioned option a plant_location=/date_inserted= 
+        folder tree. Without folder, the partition tree gets its own folder named after the table and file.
+        """
+        log.debug("export_data_to_parquet_file")
+        try:
+            arrow_schema = None if self.schema is None else self.schema.arrow_schema()
+            parquet_table = pa.Table.from_pandas(data, schema=arrow_schema, preserve_index=False)
+            
+            if self.parquet_options["partitioned"]:
+                root_path = pathlib.Path(folder or pathlib.Path(self.PARQUET_FOLDER_PATH) / f"{table_name}_{file_name}")
+                write_options = self.parquet_write_options([x for x in data.columns if x not in self.PARTITION_COLUMNS])
+                row_group_size = write_options.pop("row_group_size")
+                if row_group_size: write_options["max_rows_per_group"] = row_group_size
+                pq.write_to_dataset(
+                    parquet_table,
+                    root_path=root_path,
+                    partition_cols=self.PARTITION_COLUMNS,
+                    basename_template=f"{table_name}_{file_name}_{{i}}.parquet",
+                    **write_options
+                )
+                return root_path
+            
+            folder = pathlib.Path(folder or self.PARQUET_FOLDER_PATH)
+            folder.mkdir(parents=True, exist_ok=True)
+            
+            new_file_path = folder / f"{table_name}_{file_name}.parquet"
+            pq.write_table(parquet_table, where=new_file_path, **self.parquet_write_options(data.columns))
             
             return new_file_path
         except Exception as ex:
-            print(ex)
+            log.error(ex)
             return None
 
 
+    @timed("upload.hdfs")
     def upload_parquet_file_to_hdfs(self, file_path, table_name, file_name):
-        print("upload_parquet_file_to_hdfs")
+        log.debug("upload_parquet_file_to_hdfs")
         hdfs_path = f"{table_name}_{file_name}"
+        if pathlib.Path(file_path).is_dir(): return self.upload_folder_to_hdfs(file_path, hdfs_path)
         return self.fs.upload_file(file_path, hdfs_path)
 
 
+    @timed("upload.hdfs_folder")
+    def upload_folder_to_hdfs(self, folder, hdfs_path):
+        """
+        Uploads every file under folder keeping its sub folders (partition folders), one bulk upload per sub folder.
+        """
+        folder = pathlib.Path(folder)
+        files_by_folder = {}
+        for file_path in sorted(folder.rglob("*.parquet")):
+            relative_folder = file_path.parent.relative_to(folder).as_posix()
+            files_by_folder.setdefault(relative_folder, []).append(file_path)
+        
+        for relative_folder, file_paths in files_by_folder.items():
+            destination = hdfs_path if relative_folder == "." else f"{hdfs_path}/{relative_folder}"
+            if not self.fs.upload_files(file_paths, destination): return False
+        return True
+
+
+    @timed("upload.create_temp_table")
     def create_temp_table_from_parquet_file(self, table_name, file_name):
-        print("create_temp_table_from_parquet_file")
+        log.debug("create_temp_table_from_parquet_file")
         try:
             temp_table = f"{table_name}_{file_name}"
-            query = pathlib.Path("cdp_interface/sql_queries/temp_table.sql").read_text()
+            if self.schema is not None:
+                partition_columns = self.PARTITION_COLUMNS if self.parquet_options["partitioned"] else None
+                query = self.schema.ddl(partition_columns=partition_columns)
+            elif self.parquet_options["partitioned"]:
+                query = pathlib.Path("cdp_interface/sql_queries/temp_table_partitioned.sql").read_text()
+            else:
+                query = pathlib.Path("cdp_interface/sql_queries/temp_table.sql").read_text()
             query = query.replace("@temp_table", temp_table)
 
             if not self.db.execute(query): return False
+            self.temp_table_columns[temp_table] = ddl_columns(query)
+            if self.parquet_options["partitioned"]:
+                if not self.db.execute(f"ALTER TABLE @schema.{temp_table} RECOVER PARTITIONS"): return False
             if not self.db.refresh_table(temp_table): return False
             return True
         except Exception as ex:
-            print(ex)
+            log.error(ex)
             return False
 
 
-    def column_definition(self, table_name):
-        table_columns = self.db.column_list(table_name)
+    def column_definition(self, table_name, exclude=()):
+        # temp tables always have the columns of their DDL, no need to DESCRIBE them
+        table_columns = self.temp_table_columns.get(table_name) or self.db.column_list(table_name)
         if not table_columns: return False
         
-        result = ",".join(str(f" {x[0]}") for x in table_columns)
+        result = ",".join(str(f" {x[0]}") for x in table_columns if x[0] not in exclude)
         return result
 
 
+    @timed("upload.insert")
     def main_table_data_upload(self, table_name, file_name):
+        """
+        INSERT ... SELECT from the temp table. A partitioned main table gets a dynamic partition INSERT
+        (PARTITION (plant_location, date_inserted)), so the rows land in one folder per partition and
+        queries filtering on the partition columns only read those folders.
+        """
         try:
             temp_table_name = f"{table_name}_{file_name}"
+            details = self.db.table_details(table_name)
+            partition_columns = details["partition_columns"] if details else []
             
-            column_def = self.column_definition(temp_table_name)
+            column_def = self.column_definition(temp_table_name, exclude=partition_columns)
             if not column_def: return False
 
-            query = pathlib.Path("cdp_interface/sql_queries/data_upload.sql").read_text()
+            if partition_columns:
+                query = pathlib.Path("cdp_interface/sql_queries/data_upload_partitioned.sql").read_text()
+                query = query.replace("@partition_columns", ", ".join(partition_columns))
+            else:
+                query = pathlib.Path("cdp_interface/sql_queries/data_upload.sql").read_text()
             
             query = query.replace("@table_name", table_name)
             query = query.replace("@temp_table_name", temp_table_name)
@@ -98,39 +467,63 @@ class DataUpload:
 
             return True
         except Exception as ex:
-            print(ex)
+            log.error(ex)
             return False
 
 
+    @timed("upload.refresh")
     def main_table_refresh_metadata(self, table_name):
-        print("main_table_refresh_metadata")
+        log.debug("main_table_refresh_metadata")
         try:
             if not self.db.refresh_table(table_name): return False
             ##if not self.db.compute_stats(table_name): return False
             return True
         except Exception as ex:
-            print(ex)
+            log.error(ex)
             return False
 
 
+    @timed("upload.drop_temp_table")
     def drop_temp_table(self, table_name, file_name):
-        print("drop_temp_table")
+        log.debug("drop_temp_table")
         """
         Drops the temp table that was created.
         """
         try:
             temp_table_name = f"{table_name}_{file_name}"
             self.db.drop_table(temp_table_name)
+            self.temp_table_columns.pop(temp_table_name, None)
             return True
         except Exception as ex:
-            print(ex)
+            log.error(ex)
             return False
         
     def delete_temp_parquet_file(self, file_path):
-        print("deleting_temp_parquet_file")
+        log.debug("deleting_temp_parquet_file")
         try:
-            os.remove(file_path)
+            if pathlib.Path(file_path).is_dir(): shutil.rmtree(file_path)
+            else: os.remove(file_path)
             return True
         except Exception as error:
-            print(error)
-            return False
\ No newline at end of file
+            log.error(error)
+            return False
+
+
+def ddl_columns(query):
+    """
+    (name, type) of the columns declared in a CREATE TABLE statement, partition columns included, in DESCRIBE order.
+    """
+    return re.findall(r"^\s+(\w+)\s+(\w+(?:\([^)]*\))?),?\s*$", query, flags=re.MULTILINE)
+
+
+# characters Hive escapes in partition folder names
+PARTITION_PATH_CHARACTERS = set('"#%\'*/:=?\\{[]^')
+
+
+def partition_path_value(value):
+    if value is None or value != value: return "__HIVE_DEFAULT_PARTITION__"
+    return "".join(f"%{ord(x):02X}" if x in PARTITION_PATH_CHARACTERS or ord(x) < 32 else x for x in str(value))
+
+
+def partition_sql_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
@@ -1,4 +1,7 @@
 import competitor_data.purina_file as purina
+import competitor_data.registry as registry
+from competitor_data.result_cache import ResultCache
+from pipeline.manifest import content_hash
 
 def get_purina_price_list(file_path):
     return purina.read_file(file_path)
@@ -7,4 +10,17 @@ def get_purina_location(file_path):
     return purina.plant_location(file_path)
 
 def get_purina_effective_date(file_path):
-    return purina.effective_date(file_path)
\ No newline at end of file
+    return purina.effective_date(file_path)
+
+def get_purina_data(file_path):
+    return purina.read_price_list(file_path)
+
+def detect_format(file_path):
+    return registry.detect_format(file_path)
+
+def get_competitor_data(file_path, cache=None):
+    parser = registry.detect_format(file_path)
+    if parser is None: return None
+    if cache is None: return parser.extract(file_path)
+    with open(file_path, "rb") as pdf:
+        return cache.extract(parser, pdf, content_hash(pdf))
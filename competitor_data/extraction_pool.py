@@ -0,0 +1,150 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import io
+import os
+import threading
+
+from instrumentation import get_logger, tabula_log_file
+
+log = get_logger("extraction_pool")
+
+DEFAULT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+def start_worker(stderr_file=None):
+    """
+    Runs once in every worker process: starts the JVM tabula runs in (through jpype) with tabula's jar and the
+    file encoding tabula would set, so the first extraction of the worker doesn't pay the JVM start-up.
+    tabula finds the JVM running and reuses it for every file the worker handles.
+    Without jpype (or Java) tabula falls back to one java subprocess per call and there is nothing to warm up.
+    The in-process JVM prints its warnings (pdfbox, fonts) straight to the worker's stderr, not through the
+    tabula logger, so with a stderr_file the worker's stderr (fd 2) is redirected to it first.
+    """
+    if stderr_file:
+        try:
+            with open(stderr_file, "ab", buffering=0) as f: os.dup2(f.fileno(), 2)
+        except OSError as error:
+            log.warning(f"extraction worker stderr not redirected to {stderr_file}: {error}")
+
+    try:
+        import jpype
+        from tabula.backend import jar_path
+
+        if jpype.isJVMStarted(): return
+        jpype.addClassPath(jar_path())
+        jpype.startJVM("-Dfile.encoding=UTF8", convertStrings=False)
+    except Exception as error:
+        # an initializer that raises breaks the whole pool, tabula starts java itself on the first call instead
+        log.warning(f"JVM not started in extraction worker: {error}")
+
+
+def picklable_source(source):
+    """
+    File-like sources (downloads spooled to SharePointFunctions.open_file buffers) can't be sent to a worker
+    process, they are read into bytes first. Paths and bytes are sent as they are.
+    """
+    if not hasattr(source, "read"): return source
+    source.seek(0)
+    content = source.read()
+    source.seek(0)
+    return content
+
+
+def run_extraction(func, source):
+    if isinstance(source, bytes): source = io.BytesIO(source)
+    return func(source)
+
+
+class ExtractionPool:
+    """
+    Long-lived pool of warm tabula worker processes shared by a whole batch.
+    Workers that crash (JVM abort, out of memory) take the pool down with them, so the pool is rebuilt
+    and the file retried once before giving up on it.
+    Workers send their stderr to the tabula log file configured when the pool starts (see configure_logging).
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_restarts=3):
+        self.max_workers = max_workers
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self._executor = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=start_worker, initargs=(tabula_log_file(),))
+                self._generation += 1
+            return self._executor, self._generation
+
+
+    def restart(self, generation):
+        """
+        Replaces a broken executor. Several threads can see the same broken pool, only the first one rebuilds it.
+        """
+        with self._lock:
+            if generation != self._generation: return
+            if self.restarts >= self.max_restarts:
+                raise RuntimeError(f"extraction pool restarted {self.restarts} times, giving up")
+
+            log.warning("extraction worker crashed, restarting pool")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self.restarts += 1
+        self.start()
+
+
+    def extract(self, func, source):
+        """
+        Runs func(source) in a worker and returns its result.
+        source can be a file path, bytes or a file-like object (sent to the worker as bytes).
+        """
+        source = picklable_source(source)
+        for attempt in range(2):
+            executor, generation = self.start()
+            try:
+                return executor.submit(run_extraction, func, source).result()
+            except BrokenProcessPool:
+                if attempt == 1: raise
+                self.restart(generation)
+
+
+    def extract_all(self, func, sources):
+        """
+        Extracts a list of files concurrently. Returns a list of (source, result, error) tuples in input order,
+        with the sources as they were passed in.
+        """
+        executor, generation = self.start()
+        futures = [executor.submit(run_extraction, func, picklable_source(x)) for x in sources]
+
+        results = []
+        for source, future in zip(sources, futures):
+            try:
+                results.append((source, future.result(), None))
+            except BrokenProcessPool:
+                try:
+                    self.restart(generation)
+                    results.append((source, self.extract(func, source), None))
+                except Exception as error:
+                    results.append((source, None, error))
+            except Exception as error:
+                results.append((source, None, error))
+        return results
+
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -1,38 +1,42 @@
+from contextlib import contextmanager
 import datetime
+import io
 import pandas as pd
+import pathlib
+import shutil
 import tabula
+import tempfile
 import re
 
+from competitor_data.schemas import COMP_PRICE_GRID
+from instrumentation import get_logger
+
+log = get_logger("purina")
+
+TABLE_AREA = [89, 10, 800, 650]
+LOCATION_AREA = [0, 500, 40, 700]
+DATE_AREA = [54, 10, 82, 254]
+# version of the extraction in the result cache, bump it when read_price_list returns something different
+PARSER_VERSION = "1"
+
+# columns printed in the PDF table, species/location/date are added afterwards
+PDF_COLUMNS = COMP_PRICE_GRID.names[:COMP_PRICE_GRID.names.index("best_net_list_price") + 1]
+
+
 def default_columns(df):
-    return df[[
-        "product_number",
-        "formula_code",
-        "product_name",
-        "ref_col",
-        "unit_weight",
-        "product_form",
-        "fob_or_dlv",
-        "price_change",
-        "single_unit_list_price",
-        "full_pallet_list_price",
-        "pkg_bulk_discount",
-        "best_net_list_price",
-        "species",
-        "plant_location",
-        "date_inserted",
-        "source"
-    ]]
+    return df[COMP_PRICE_GRID.names + ["source"]]
 
 def source_columns(df):
     df["source"] = "pdf"
     return df
 
 def find_unit_weight(df):
-    for index, row in df.iterrows():
-        if not re.search("LB", row["unit_weight"]):
-            search_result = re.findall("\d*\s*LB", str(row["product_name"]))
-            if len(search_result) > 0:
-                df.at[index, "unit_weight"] = search_result[0]
+    """
+    Rows whose unit weight has no "LB" take the first "<number> LB" found in the product name, if any.
+    """
+    missing_weight = ~df["unit_weight"].str.contains("LB", regex=False, na=False)
+    weight_in_name = df["product_name"].astype(str).str.extract(r"(\d*\s*LB)", expand=False)
+    df.loc[missing_weight & weight_in_name.notna(), "unit_weight"] = weight_in_name
     return df
 
 
@@ -42,28 +46,46 @@ def correct_negative_value(value):
     else: return float(value)
 
 
+def correct_negative_values(values):
+    """
+    Column-wise version of correct_negative_value: "12.50-" becomes -12.5.
+    """
+    text = values.astype(str)
+    negative = text.str.endswith("-", na=False)
+    magnitude = text.where(~negative, text.str.replace("-", "", regex=False)).astype("float64")
+    return magnitude.where(~negative, -magnitude)
+
+
 def correct_negative_value_in_price_list(df):
     for col in df.columns[7:12]:
-        df[col] = df[col].apply(correct_negative_value)
+        df[col] = correct_negative_values(df[col])
 
     return df
 
 
-def effective_date(file_path):
+def parse_effective_date(effective_date_table):
     effective_date = None
-    effective_date_table = tabula.read_pdf(file_path, pages=1, area=[54,10,82,254])
-    results = re.findall("[0-9][0-9]/[0-9][0-9]/[0-9][0-9]",str(effective_date_table[0])) 
+    results = re.findall("[0-9][0-9]/[0-9][0-9]/[0-9][0-9]",str(effective_date_table)) 
     if len(results) > 0: 
         effective_date = datetime.datetime.strptime(results[0], "%m/%d/%y").date()
     return effective_date.strftime("%Y-%m-%d")
 
 
-def plant_location(file_path):
-    location_table = tabula.read_pdf(file_path, pages=1, area=[0,500,40,700])
-    location = str(location_table[0]).split("\n")[0].strip().replace(",", "").upper()
+def parse_plant_location(location_table):
+    location = str(location_table).split("\n")[0].strip().replace(",", "").upper()
     return location
 
 
+def effective_date(file_path):
+    effective_date_table = tabula.read_pdf(file_path, pages=1, area=DATE_AREA)
+    return parse_effective_date(effective_date_table[0])
+
+
+def plant_location(file_path):
+    location_table = tabula.read_pdf(file_path, pages=1, area=LOCATION_AREA)
+    return parse_plant_location(location_table[0])
+
+
 def add_effective_date(df, file_path):
     df["date_inserted"] = effective_date(file_path)
     return df
@@ -75,34 +97,22 @@ def add_plant_location(df, file_path):
     
     
 def add_species_column(df):
-    species = None
-    df["species"] = None
-    for index, row in df.iterrows():
-        if re.match("\d", row[0]) is None:
-            species = str(row[0]).replace(",", "").upper()
-            df = df.drop(index, axis=0)
-        else:
-            df.loc[index, "species"] = species
+    """
+    Species come as header rows (first column without a leading digit) above their products.
+    The header text is forward filled into a species column and the header rows are dropped.
+    """
+    first_column = df.iloc[:, 0].astype(str)
+    is_species_row = ~first_column.str.match(r"\d", na=False)
+    
+    species = first_column.str.replace(",", "", regex=False).str.upper().where(is_species_row).ffill()
+    df["species"] = species.astype(object).where(species.notna(), None)
     
-    df = df.reset_index(drop=True)
+    df = df[~is_species_row].reset_index(drop=True)
     return df
 
 
 def set_column_names(df):
-    df.columns = [
-        "product_number",
-        "formula_code",
-        "product_name",
-        "ref_col",
-        "unit_weight",
-        "product_form",
-        "fob_or_dlv",
-        "price_change",
-        "single_unit_list_price",
-        "full_pallet_list_price",
-        "pkg_bulk_discount",
-        "best_net_list_price"
-    ]
+    df.columns = PDF_COLUMNS
     return df
 
 
@@ -116,36 +126,157 @@ def valid_table(df):
     return True
 
 
-def raw_price_list(table_list):
+def table_rejection_reason(df, columns):
+    if not valid_table(df): 
+        if not isinstance(df, pd.DataFrame): return "not a table"
+        return f"only {df.shape[1]} columns"
+    if columns is not None and df.shape[1] != len(columns): 
+        return f"{df.shape[1]} columns, expected {len(columns)}"
+    return None
+
+
+def assemble_price_list(table_list):
     """
-    Returns a single DataFrame with all valid price list tables merged.
+    Merges the valid price list tables with a single concat.
+    Every table has to have the same number of columns as the first valid one. Tables whose header text
+    differs are aligned to it by position instead of by name.
+    Returns {"price_list": DataFrame, "diagnostics": one dict per table with rows, columns, kept and reason}.
     """
-    price_list = pd.DataFrame()
+    tables = []
+    diagnostics = []
+    columns = None
     
-    for tbl in table_list: 
-        if valid_table(tbl): 
-            price_list = pd.concat([price_list, tbl], ignore_index=True)
+    for index, tbl in enumerate(table_list or []):
+        reason = table_rejection_reason(tbl, columns)
+        is_table = isinstance(tbl, pd.DataFrame)
+        diagnostics.append({
+            "table": index,
+            "rows": tbl.shape[0] if is_table else 0,
+            "columns": tbl.shape[1] if is_table else 0,
+            "kept": reason is None,
+            "reason": reason
+        })
+        if reason is not None: continue
         
-    return price_list
+        if columns is None: columns = tbl.columns
+        elif not tbl.columns.equals(columns): tbl = tbl.set_axis(columns, axis=1)
+        tables.append(tbl)
+    
+    if not tables: price_list = pd.DataFrame()
+    else: price_list = pd.concat(tables, ignore_index=True)
+    
+    return {
+        "price_list": price_list,
+        "diagnostics": diagnostics
+    }
+
+
+def raw_price_list(table_list):
+    """
+    Returns a single DataFrame with all valid price list tables merged.
+    """
+    return assemble_price_list(table_list)["price_list"]
 
 
 def find_tables_in_pdf(file_path):
     try:
-        table_list = tabula.read_pdf(file_path, pages="all", area=[89,10,800,650], lattice=True)
+        table_list = tabula.read_pdf(file_path, pages="all", area=TABLE_AREA, lattice=True)
         return table_list
     except Exception as error:
         return False
 
 
-def read_file(file_path):
-    table_list = find_tables_in_pdf(file_path)
-    price_list = raw_price_list(table_list)
+@contextmanager
+def local_pdf(source):
+    """
+    tabula reads from disk. Paths are used as they are, bytes and file objects are written once to a 
+    temporary file that is deleted when the extraction is done.
+    """
+    if isinstance(source, (str, pathlib.PurePath)):
+        yield source
+        return
+    
+    if isinstance(source, bytes): source = io.BytesIO(source)
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+        source.seek(0)
+        shutil.copyfileobj(source, pdf_file)
+        pdf_file.flush()
+        yield pdf_file.name
+
+
+def find_header_in_pdf(file_path):
+    """
+    Reads the plant location and effective date boxes of the first page in a single tabula call.
+    Passing both areas at once turns off tabula's table guessing, so each area comes back as its own table.
+    """
+    location_table, effective_date_table = tabula.read_pdf(
+        file_path, 
+        pages=1, 
+        area=[LOCATION_AREA, DATE_AREA], 
+        guess=False, 
+        multiple_tables=True
+    )
+    return {
+        "location": parse_plant_location(location_table),
+        "effective_date": parse_effective_date(effective_date_table)
+    }
+
+
+def extract_pdf(file_path):
+    """
+    Extracts everything needed from a price list PDF: the lattice price tables plus the location and date header.
+    The tables need lattice mode and the header needs stream mode, so this is two tabula calls instead of the 
+    five that read_file, plant_location and effective_date used to make between them.
+    file_path can also be the PDF content as bytes or a file object.
+    Returns None if the PDF can't be read.
+    """
+    try:
+        with local_pdf(file_path) as pdf_path:
+            header = find_header_in_pdf(pdf_path)
+            table_list = tabula.read_pdf(pdf_path, pages="all", area=TABLE_AREA, lattice=True)
+    except Exception as error:
+        log.error(error)
+        return None
+    
+    return {
+        "tables": table_list,
+        "location": header["location"],
+        "effective_date": header["effective_date"]
+    }
+
+
+def build_price_list(price_list, location, effective_date):
     price_list = set_column_names(price_list)
     price_list = add_species_column(price_list)
-    price_list = add_plant_location(price_list, file_path)
-    price_list = add_effective_date(price_list, file_path)
+    price_list["plant_location"] = location
+    price_list["date_inserted"] = effective_date
     price_list = correct_negative_value_in_price_list(price_list)
     price_list = find_unit_weight(price_list)
     price_list = source_columns(price_list)
     price_list = default_columns(price_list)
-    return price_list
\ No newline at end of file
+    return price_list
+
+
+def read_price_list(file_path):
+    """
+    Single pass version of read_file + plant_location + effective_date.
+    Returns a dict with the price list, location, effective date and the per table diagnostics 
+    from assemble_price_list, or None if the PDF can't be read.
+    """
+    extraction = extract_pdf(file_path)
+    if extraction is None: return None
+    
+    assembled = assemble_price_list(extraction["tables"])
+    
+    return {
+        "price_list": build_price_list(assembled["price_list"], extraction["location"], extraction["effective_date"]),
+        "location": extraction["location"],
+        "effective_date": extraction["effective_date"],
+        "diagnostics": assembled["diagnostics"]
+    }
+
+
+def read_file(file_path):
+    result = read_price_list(file_path)
+    if result is None: return False
+    return result["price_list"]
\ No newline at end of file
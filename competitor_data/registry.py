@@ -0,0 +1,131 @@
+import importlib
+import importlib.util
+import io
+import pypdf
+
+import competitor_data.purina_file as purina
+from competitor_data.schemas import COMP_PRICE_GRID, COMP_PRICE_HORIZONTAL_FILES
+from instrumentation import get_logger
+
+log = get_logger("registry")
+
+
+class ParserFormat:
+    """
+    One competitor price list layout.
+    matches(fingerprint) is a cheap check on the first page (see pdf_fingerprint) that decides if the format applies.
+    extract(source) parses a PDF path, bytes or file object and returns a dict with price_list, location,
+    effective_date and diagnostics (None if the PDF can't be read); it runs in the extraction worker processes,
+    so it has to be a module level function.
+    reconcile tells if the rows are checked against the table before loading (comp_price_grid) or loaded as they are.
+    version identifies the extraction logic in the result cache (competitor_data.result_cache): bump it when
+    the parser changes what it returns for the same PDF.
+    """
+
+    def __init__(self, name, matches, extract, schema, reconcile=False, version="1"):
+        self.name = name
+        self.matches = matches
+        self.extract = extract
+        self.schema = schema
+        self.reconcile = reconcile
+        self.version = version
+
+
+FORMATS = []
+
+
+def register_format(parser_format):
+    """
+    Adds a format to the registry. Formats are tried in registration order, the first match wins.
+    """
+    FORMATS.append(parser_format)
+    return parser_format
+
+
+def get_format(name):
+    return next((x for x in FORMATS if x.name == name), None)
+
+
+def pdf_fingerprint(source):
+    """
+    Page count, orientation and text of the first page, read with pypdf.
+    No rendering and no table detection, so it costs milliseconds instead of a tabula pass.
+    source is a path, bytes or a file object (left positioned at the start).
+    """
+    if isinstance(source, bytes): source = io.BytesIO(source)
+    if hasattr(source, "seek"): source.seek(0)
+    try:
+        reader = pypdf.PdfReader(source)
+        page = reader.pages[0]
+        width, height = float(page.mediabox.width), float(page.mediabox.height)
+        if page.rotation % 180 == 90: width, height = height, width
+        text = page.extract_text() or ""
+        return {
+            "pages": len(reader.pages),
+            "landscape": width > height,
+            "text": " ".join(text.upper().split())
+        }
+    finally:
+        if hasattr(source, "seek"): source.seek(0)
+
+
+def detect_format(source):
+    """
+    First registered format whose fingerprint check matches the PDF, or None.
+    """
+    try:
+        fingerprint = pdf_fingerprint(source)
+    except Exception as error:
+        log.error(error)
+        return None
+
+    return next((x for x in FORMATS if x.matches(fingerprint)), None)
+
+
+def read_purina_horizontal(source):
+    """
+    Purina horizontal price lists, parsed by competitor_data.purina_file_horizontal.read_file.
+    """
+    pfh = importlib.import_module("competitor_data.purina_file_horizontal")
+    with purina.local_pdf(source) as pdf_path:
+        price_list = pfh.read_file(str(pdf_path))
+    if price_list is None or price_list is False: return None
+    # species is only printed on some horizontal files
+    if "species" not in price_list.columns: price_list = price_list.assign(species=None)
+
+    return {
+        "price_list": price_list,
+        "location": price_list["plant_location"].iloc[0] if price_list.shape[0] > 0 else None,
+        "effective_date": price_list["date_inserted"].iloc[0] if price_list.shape[0] > 0 else None,
+        "diagnostics": []
+    }
+
+
+def is_purina(fingerprint):
+    return "PURINA" in fingerprint["text"]
+
+
+def is_purina_horizontal(fingerprint):
+    return is_purina(fingerprint) and ("STOCKING STATUS" in fingerprint["text"] or fingerprint["landscape"])
+
+
+# the horizontal parser module is not part of this tree yet: until it is, horizontal files are left undetected
+# (unknown format) instead of failing at parse
+HORIZONTAL_AVAILABLE = importlib.util.find_spec("competitor_data.purina_file_horizontal") is not None
+
+if HORIZONTAL_AVAILABLE:
+    register_format(ParserFormat(
+        "purina_horizontal",
+        is_purina_horizontal,
+        read_purina_horizontal,
+        COMP_PRICE_HORIZONTAL_FILES
+    ))
+
+register_format(ParserFormat(
+    "purina_vertical",
+    lambda x: is_purina(x) and not is_purina_horizontal(x),
+    purina.read_price_list,
+    COMP_PRICE_GRID,
+    reconcile=True,
+    version=purina.PARSER_VERSION
+))
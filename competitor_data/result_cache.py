@@ -0,0 +1,123 @@
+import json
+import pathlib
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from instrumentation import get_logger, count
+
+log = get_logger("result_cache")
+
+CACHE_FOLDER = "competitor_data/cache/results"
+MAX_SIZE = 500 * 1024 * 1024
+MAX_AGE = 30 * 24 * 60 * 60
+METADATA_KEY = b"extraction"
+
+
+class ResultCache:
+    """
+    Extraction results (the dicts returned by ParserFormat.extract) stored as Parquet files, one per PDF content
+    and parser version, so a file that failed after parsing (Impala timeout, HDFS error) is not sent through
+    tabula again on the next run. Bumping a parser's version makes its old entries unreachable; they are
+    evicted with the rest: entries older than max_age, then the least recently used ones while the folder
+    is larger than max_size bytes.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, max_size=MAX_SIZE, max_age=MAX_AGE):
+        self.folder = pathlib.Path(folder)
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+
+    def entry_path(self, file_hash, parser):
+        return self.folder / f"{file_hash}_{parser.name}_v{parser.version}.parquet"
+
+
+    def get(self, file_hash, parser):
+        """
+        Cached extraction result of the PDF, or None.
+        """
+        path = self.entry_path(file_hash, parser)
+        try:
+            if not path.exists() or time.time() - path.stat().st_mtime > self.max_age: return None
+            table = pq.read_table(path)
+            path.touch()
+        except Exception as error:
+            log.warning(f"unreadable cache entry {path.name}: {error}")
+            return None
+
+        metadata = json.loads(table.schema.metadata[METADATA_KEY])
+        price_list = table.replace_schema_metadata(None).to_pandas()
+        # back to the object columns the parsers return
+        price_list = price_list.astype({x: object for x in price_list.columns if pd.api.types.is_string_dtype(price_list[x])})
+        return {"price_list": price_list, **metadata}
+
+
+    def put(self, file_hash, parser, result):
+        """
+        Stores an extraction result. Price lists that can't be written as Parquet (mixed types in a column)
+        are not cached. Returns True if the result was stored.
+        """
+        path = self.entry_path(file_hash, parser)
+        metadata = {x: result[x] for x in result if x != "price_list"}
+        try:
+            table = pa.Table.from_pandas(result["price_list"], preserve_index=False)
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), METADATA_KEY: json.dumps(metadata, default=str)})
+
+            self.folder.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(".tmp")
+            pq.write_table(table, temp_path)
+            temp_path.replace(path)
+        except Exception as error:
+            log.warning(f"extraction result not cached: {error}")
+            return False
+
+        self.evict()
+        return True
+
+
+    def extract(self, parser, source, file_hash, pool=None):
+        """
+        parser.extract(source), served from the cache when the same content was already extracted with the
+        same parser version. With a pool the extraction runs in its worker processes.
+        """
+        result = self.get(file_hash, parser)
+        if result is not None:
+            count("result_cache_hits")
+            return result
+
+        count("result_cache_misses")
+        result = parser.extract(source) if pool is None else pool.extract(parser.extract, source)
+        if result is not None: self.put(file_hash, parser, result)
+        return result
+
+
+    def evict(self):
+        """
+        Drops entries older than max_age, then the least recently used ones until the folder fits in max_size.
+        """
+        with self._lock:
+            if not self.folder.exists(): return
+            now = time.time()
+            entries = []
+            for path in self.folder.glob("*.parquet"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.max_age: path.unlink(missing_ok=True)
+                else: entries.append((stat.st_mtime, stat.st_size, path))
+
+            size = sum(x[1] for x in entries)
+            for last_used, file_size, path in sorted(entries):
+                if size <= self.max_size: break
+                path.unlink(missing_ok=True)
+                size -= file_size
+
+
+    def clear(self):
+        with self._lock:
+            for path in self.folder.glob("*.parquet"): path.unlink(missing_ok=True)
@@ -0,0 +1,141 @@
+import pandas as pd
+import pyarrow as pa
+
+PANDAS_TYPES = {
+    "STRING": "string",
+    "DOUBLE": "float64"
+}
+
+ARROW_TYPES = {
+    "STRING": pa.string(),
+    "DOUBLE": pa.float64()
+}
+
+
+class TableSchema:
+    """
+    Columns and Impala types of one target table, in table order.
+    Everything that needs the column list (parsers, casting, Parquet export, temp table DDL, selects) reads it from here.
+    """
+
+    def __init__(self, table_name, columns):
+        self.table_name = table_name
+        self.columns = columns
+
+
+    @property
+    def names(self):
+        return [name for name, _ in self.columns]
+
+
+    def dtypes(self):
+        return {name: PANDAS_TYPES[column_type] for name, column_type in self.columns}
+
+
+    def impala_types(self):
+        return dict(self.columns)
+
+
+    def arrow_schema(self, partition_columns=None):
+        columns = self.ordered_columns(partition_columns)
+        return pa.schema([(name, ARROW_TYPES[column_type]) for name, column_type in columns])
+
+
+    def ordered_columns(self, partition_columns=None):
+        """
+        Table columns with the partition columns moved to the end, the order Impala uses for partitioned tables.
+        """
+        partition_columns = partition_columns or []
+        return (
+            [x for x in self.columns if x[0] not in partition_columns] +
+            [x for x in self.columns if x[0] in partition_columns]
+        )
+
+
+    def cast(self, df, coerce_numeric=False):
+        """
+        Keeps the table columns in table order and casts them in one astype call.
+        Columns that already have the right dtype are left alone, so they are not copied.
+        coerce_numeric turns text that is not a number into NaN instead of raising.
+        """
+        df = df[self.names]
+        pending = {col: dtype for col, dtype in self.dtypes().items() if df[col].dtype != dtype}
+        if not pending: return df
+
+        if coerce_numeric:
+            numeric = [col for col, dtype in pending.items() if dtype == "float64" and not pd.api.types.is_numeric_dtype(df[col])]
+            if numeric: df = df.assign(**{col: pd.to_numeric(df[col], errors="coerce") for col in numeric})
+
+        return df.astype(pending)
+
+
+    def select_list(self):
+        return ",\n    ".join(self.names)
+
+
+    def ddl(self, table_name="@temp_table", partition_columns=None, location="@hdfs_root_folder/@temp_table"):
+        """
+        CREATE TABLE statement for a Parquet table with this schema (the temp tables used by DataUpload by default).
+        """
+        partition_columns = partition_columns or []
+        columns = [x for x in self.columns if x[0] not in partition_columns]
+        partitions = [x for x in self.columns if x[0] in partition_columns]
+
+        query = f"CREATE TABLE IF NOT EXISTS @schema.{table_name} (\n"
+        query += ",\n".join(f"    {name} {column_type}" for name, column_type in columns)
+        query += "\n)\n"
+        if partitions:
+            query += "PARTITIONED BY (\n"
+            query += ",\n".join(f"    {name} {column_type}" for name, column_type in partitions)
+            query += "\n)\n"
+        query += "STORED AS PARQUET\n"
+        query += f'LOCATION "{location}"'
+        return query
+
+
+COMP_PRICE_GRID = TableSchema("comp_price_grid", [
+    ("product_number", "STRING"),
+    ("formula_code", "STRING"),
+    ("product_name", "STRING"),
+    ("ref_col", "STRING"),
+    ("unit_weight", "STRING"),
+    ("product_form", "STRING"),
+    ("fob_or_dlv", "STRING"),
+    ("price_change", "DOUBLE"),
+    ("single_unit_list_price", "DOUBLE"),
+    ("full_pallet_list_price", "DOUBLE"),
+    ("pkg_bulk_discount", "DOUBLE"),
+    ("best_net_list_price", "DOUBLE"),
+    ("species", "STRING"),
+    ("plant_location", "STRING"),
+    ("date_inserted", "STRING")
+])
+
+COMP_PRICE_HORIZONTAL_FILES = TableSchema("comp_price_horizontal_files", [
+    ("product_number", "STRING"),
+    ("formula_code", "STRING"),
+    ("product_name", "STRING"),
+    ("product_form", "STRING"),
+    ("unit_weight", "STRING"),
+    ("pallet_quantity", "DOUBLE"),
+    ("stocking_status", "STRING"),
+    ("min_order_quantity", "DOUBLE"),
+    ("days_lead_time", "DOUBLE"),
+    ("fob_or_dlv", "STRING"),
+    ("price_change", "DOUBLE"),
+    ("list_price", "DOUBLE"),
+    ("full_pallet_price", "DOUBLE"),
+    ("half_load_full_pallet_price", "DOUBLE"),
+    ("full_load_full_pallet_price", "DOUBLE"),
+    ("full_load_best_price", "DOUBLE"),
+    ("species", "STRING"),
+    ("plant_location", "STRING"),
+    ("date_inserted", "STRING"),
+    ("source", "STRING")
+])
+
+SCHEMAS = {x.table_name: x for x in (COMP_PRICE_GRID, COMP_PRICE_HORIZONTAL_FILES)}
+
+
+def get_schema(table_name):
+    return SCHEMAS.get(table_name)
@@ -0,0 +1,8 @@
+SELECT 
+    @columns
+    
+FROM 
+    @schema.comp_price_grid
+    
+WHERE
+    @conditions
\ No newline at end of file
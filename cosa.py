@@ -1,4 +1,6 @@
 import competitor_data.purina_file_horizontal as pfh
+from competitor_data.extraction_pool import ExtractionPool
+from competitor_data.schemas import COMP_PRICE_HORIZONTAL_FILES
 import os
 import pathlib
 import re
@@ -13,6 +15,11 @@ import credentials as crd
 import environments as env
 from cdp_interface import CDPInterface
 
+# Logs y métricas
+from instrumentation import METRICS, get_logger, configure_logging, timed
+
+log = get_logger("horizontal")
+
 REPOSITORY  = "/sites/RetailPricing/Shared%20Documents/General/Competitive%20Intel/Competitor%20PDF%20new%20format%20(horizontal%20file)/"
 LOCAL_REPOSITORY = "sharepoint_interface/local_repository/"
 
@@ -42,158 +49,100 @@ def correct_file_name(val: str) -> str:
 
 def set_column_types(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Asegura que no existan columnas obsoletas como 'ref_col' y
-    convierte tipos a float/string.
+    Deja solo las columnas de comp_price_horizontal_files (sin 'ref_col' u otras
+    columnas obsoletas) y convierte tipos a float/string segun el esquema registrado.
+    'species' es opcional en el archivo: si no viene, se sube vacia.
     """
-    # Columnas string
-    string_cols = [
-        "product_number",
-        "formula_code",
-        "product_name",
-        "product_form",
-        "unit_weight",
-        "stocking_status",
-        "fob_or_dlv",
-        "species",
-        "plant_location",
-        "date_inserted",
-        "source"
-    ]
-    for col in string_cols:
-        if col in df.columns:
-            df[col] = df[col].astype("string")
-
-    # Columnas float
-    float_cols = [
-        "pallet_quantity",
-        "min_order_quantity",
-        "days_lead_time",
-        "price_change",
-        "list_price",
-        "full_pallet_price",
-        "half_load_full_pallet_price",
-        "full_load_full_pallet_price",
-        "full_load_best_price"
-    ]
-    for col in float_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-
-    # Opcional: si existiera 'ref_col', lo quitamos en caso de que
-    # todavía aparezca por error:
-    if "ref_col" in df.columns:
-        df.drop(columns=["ref_col"], inplace=True)
-
-    return df
+    if "species" not in df.columns: df = df.assign(species=None)
+    return COMP_PRICE_HORIZONTAL_FILES.cast(df, coerce_numeric=True)
 
 
 def excecute_process():
+    METRICS.reset()
     sp = get_sharepoint_interface("retailpricing")
     if not sp:
-        print("[ERROR] No se pudo obtener la interfaz de SharePoint.")
+        log.error("No se pudo obtener la interfaz de SharePoint.")
         return
 
     files = sp.files_in_folder(REPOSITORY)
     if not files:
-        print(f"[INFO] No hay archivos en {REPOSITORY}")
+        log.info(f"No hay archivos en {REPOSITORY}")
         return
 
     # Filtrar PDFs
     pdf_files = [f for f in files if f["file_name"].lower().endswith(".pdf")]
     if not pdf_files:
-        print(f"[INFO] No se encontraron PDFs en {REPOSITORY}")
+        log.info(f"No se encontraron PDFs en {REPOSITORY}")
         return
 
     # Conexión a CDP
-    cdp = CDPInterface(env.production, crd.process_account)
+    cdp = CDPInterface(env.get(), crd.process_account)
 
     total = len(pdf_files)
-    for idx, pdf_info in enumerate(pdf_files, start=1):
-        pdf_filename = pdf_info["file_name"]
-        pdf_sharepoint_path = pdf_info["file_path"]
-        print(f"\n[{idx}/{total}] Procesando: {pdf_filename}")
-
-        if not os.path.exists(LOCAL_REPOSITORY):
-            os.makedirs(LOCAL_REPOSITORY, exist_ok=True)
-
-        # Descargar
-        local_pdf_path = sp.download_file(pdf_sharepoint_path, LOCAL_REPOSITORY)
-        if not local_pdf_path:
-            print("[ERROR] No se pudo descargar el PDF.")
-            continue
-
-        # Parsear horizontal
-        df = pfh.read_file(str(local_pdf_path))
-
-        # Observa columnas
-        print("[DEBUG] Columnas del DF tras parsear:\n", df.columns.tolist())
-        if "ref_col" in df.columns:
-            print("[WARN] Se detectó ref_col en el DF... se eliminará.")
-        print(df.head(5))
-
-        # Forzar tipos
-        df = set_column_types(df)
-        print("[DEBUG] Columnas tras set_column_types:\n", df.columns.tolist())
-
-        # Revisar shape
-        print("[INFO] DataFrame shape:", df.shape)
-        print(df.head(10))
-
-        if df.shape[0] > 0:
-            # Nombre base sin extension
-            raw_name = pathlib.Path(pdf_filename).stem
-            # Aplica la logica "original" de correct_file_name
-            base_name = correct_file_name(raw_name)
-            print("[DEBUG] Nombre base para la tabla temporal:", base_name)
-
-            # Subir a la tabla final
-            if cdp.upload_data(df, "comp_price_horizontal_files", base_name):
-                print(f"[INFO] '{pdf_filename}' subido correctamente a 'comp_price_horizontal_files'.")
-            else:
-                print("[ERROR] Falló la subida a CDP.")
-        else:
-            print("[INFO] DF vacío, no se suben datos.")
-
-        # Eliminar de SharePoint
-        try:
-            if sp.delete_file(pdf_sharepoint_path):
-                print(f"[INFO] Archivo '{pdf_filename}' eliminado de SharePoint.")
+    with ExtractionPool() as pool:
+        for idx, pdf_info in enumerate(pdf_files, start=1):
+            pdf_filename = pdf_info["file_name"]
+            pdf_sharepoint_path = pdf_info["file_path"]
+            log.info(f"[{idx}/{total}] Procesando: {pdf_filename}")
+
+            if not os.path.exists(LOCAL_REPOSITORY):
+                os.makedirs(LOCAL_REPOSITORY, exist_ok=True)
+
+            # Descargar
+            with timed("horizontal.download", file=pdf_filename):
+                local_pdf_path = sp.download_file(pdf_sharepoint_path, LOCAL_REPOSITORY)
+            if not local_pdf_path:
+                log.error("No se pudo descargar el PDF.")
+                continue
+
+            # Parsear horizontal
+            with timed("horizontal.parse", file=pdf_filename):
+                df = pool.extract(pfh.read_file, str(local_pdf_path))
+
+            # Observa columnas
+            log.debug(f"Columnas del DF tras parsear: {df.columns.tolist()}")
+            if "ref_col" in df.columns:
+                log.warning("Se detectó ref_col en el DF... se eliminará.")
+            log.debug(df.head(5))
+
+            # Forzar tipos
+            df = set_column_types(df)
+            log.debug(f"Columnas tras set_column_types: {df.columns.tolist()}")
+
+            # Revisar shape
+            log.info(f"DataFrame shape: {df.shape}")
+            log.debug(df.head(10))
+
+            if df.shape[0] > 0:
+                # Nombre base sin extension
+                raw_name = pathlib.Path(pdf_filename).stem
+                # Aplica la logica "original" de correct_file_name
+                base_name = correct_file_name(raw_name)
+                log.debug(f"Nombre base para la tabla temporal: {base_name}")
+
+                # Subir a la tabla final
+                with timed("horizontal.upload", file=pdf_filename):
+                    uploaded = cdp.upload_data(df, "comp_price_horizontal_files", base_name, schema=COMP_PRICE_HORIZONTAL_FILES)
+                if uploaded:
+                    log.info(f"'{pdf_filename}' subido correctamente a 'comp_price_horizontal_files'.")
+                else:
+                    log.error("Falló la subida a CDP.")
             else:
-                print(f"[WARN] No se pudo eliminar '{pdf_filename}' de SharePoint.")
-        except Exception as e:
-            print(f"[ERROR] Al intentar eliminar en SharePoint: {e}")
+                log.info("DF vacío, no se suben datos.")
 
-    print("\n[INFO] Proceso completado para todos los PDFs.")
+            # Eliminar de SharePoint
+            try:
+                if sp.delete_file(pdf_sharepoint_path):
+                    log.info(f"Archivo '{pdf_filename}' eliminado de SharePoint.")
+                else:
+                    log.warning(f"No se pudo eliminar '{pdf_filename}' de SharePoint.")
+            except Exception as e:
+                log.error(f"Al intentar eliminar en SharePoint: {e}")
+
+    log.info("Proceso completado para todos los PDFs.")
+    METRICS.log_summary()
 
 
 if __name__ == "__main__":
+    configure_logging()
     excecute_process()
-
-
-    
-#------------------------------------------------------------
-
-
-CREATE TABLE IF NOT EXISTS @schema.@temp_table (
-    product_number STRING,
-    formula_code STRING,
-    product_name STRING,
-    product_form STRING,
-    unit_weight STRING,
-    pallet_quantity DOUBLE,
-    stocking_status STRING,
-    min_order_quantity DOUBLE,
-    days_lead_time DOUBLE,
-    fob_or_dlv STRING,
-    price_change DOUBLE,
-    list_price DOUBLE,
-    full_pallet_price DOUBLE,
-    half_load_full_pallet_price DOUBLE,
-    full_load_full_pallet_price DOUBLE,
-    full_load_best_price DOUBLE,
-    plant_location STRING,
-    date_inserted STRING,
-    source STRING
-)
-STORED AS PARQUET
-LOCATION "@hdfs_root_folder/@temp_table"
@@ -1,8 +1,10 @@
 import json
+import pathlib
 
 def credentials(name):
     if name == "process_account":
-        file_path = r"credentials/process_account.json"
+        # next to this file, so importing the module doesn't depend on the working directory
+        file_path = pathlib.Path(__file__).parent / "process_account.json"
 
     with open(file_path) as f: return json.load(f)
 
@@ -1,11 +1,21 @@
 import json
+import os
+import pathlib
 
 def __environment(name):
-    file_path = fr"environments/{name}.json"
+    # next to this file, so importing the module doesn't depend on the working directory
+    file_path = pathlib.Path(__file__).parent / f"{name}.json"
 
     with open(file_path) as f: 
         return json.load(f)
 
 dev = __environment("dev")
 production = __environment("production")
-staging = __environment("staging")
\ No newline at end of file
+staging = __environment("staging")
+local = __environment("local")
+
+def get(name=None):
+    """
+    Environment by name, by default the one in the CDP_ENVIRONMENT variable (production if not set).
+    """
+    return __environment(name or os.environ.get("CDP_ENVIRONMENT", "production"))
\ No newline at end of file
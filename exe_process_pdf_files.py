@@ -1,52 +1,61 @@
 from cdp_interface import CDPInterface
+import contextlib
 import datetime
+from functools import partial
 import credentials as crd
 import environments as env
 import competitor_data as comp
 import pandas as pd
 import pathlib
 import re
+import sys
 
+from competitor_data.extraction_pool import ExtractionPool, DEFAULT_WORKERS
+from competitor_data.schemas import COMP_PRICE_GRID
+from competitor_data.registry import detect_format, get_format
+from competitor_data.result_cache import ResultCache
+from pipeline import Stage, SkipItem, run_pipeline, print_summary
+from pipeline.manifest import FileManifest, content_hash
+from pipeline.journal import RunJournal
+from pipeline.sweep import sweep
+from pipeline.watcher import FolderScanner, watch, results_for
+from pipeline.reconciliation import ReconciliationCache, row_keys
 from sharepoint_interface import get_sharepoint_interface
+from instrumentation import METRICS, get_logger, configure_logging, count
+
+log = get_logger("ingest")
 
 
 REPOSITORY = "/sites/RetailPricing/Shared%20Documents/General/Competitive%20Intel/Competitor%20PDF%20Upload/"
-LOCAL_REPOSITORY = "sharepoint_interface/local_repository/"
+HORIZONTAL_REPOSITORY = "/sites/RetailPricing/Shared%20Documents/General/Competitive%20Intel/Competitor%20PDF%20new%20format%20(horizontal%20file)/"
+# every format is detected per file, so all folders go through the same pipeline
+# (the horizontal folder only once its parser is registered)
+REPOSITORIES = [REPOSITORY] + ([HORIZONTAL_REPOSITORY] if get_format("purina_horizontal") else [])
+# Prometheus textfile with the summary of the last run
+METRICS_FILE = "logs/ingest.prom"
+# batch loads are named batch_<timestamp>, single file loads after the file
+BATCH_PREFIX = "batch_"
 
 def set_column_types(df):
-    df["product_number"] = df["product_number"].astype("string")
-    df["formula_code"] = df["formula_code"].astype("string")
-    df["product_name"] = df["product_name"].astype("string")
-    df["ref_col"] = df["ref_col"].astype("string")
-    df["unit_weight"] = df["unit_weight"].astype("string")
-    df["product_form"] = df["product_form"].astype("string")
-    df["fob_or_dlv"] = df["fob_or_dlv"].astype("string")
-    df["price_change"] = df["price_change"].astype("float64")
-    df["single_unit_list_price"] = df["single_unit_list_price"].astype("float64")
-    df["full_pallet_list_price"] = df["full_pallet_list_price"].astype("float64")
-    df["pkg_bulk_discount"] = df["pkg_bulk_discount"].astype("float64")
-    df["best_net_list_price"] = df["best_net_list_price"].astype("float64")
-    df["species"] = df["species"].astype("string")
-    df["plant_location"] = df["plant_location"].astype("string")
-    df["date_inserted"] = df["date_inserted"].astype("string")
-    return df
-
-
-def get_price_list_in_db(location, effective_date):
-    cdp = CDPInterface(env.production, crd.process_account)
+    return COMP_PRICE_GRID.cast(df)
+
+
+def get_price_list_in_db(location, effective_date, cdp=None):
+    if cdp is None: cdp = CDPInterface(env.get(), crd.process_account)
     query = pathlib.Path("competitor_data/sql_queries/price_list.sql").read_text()
     query = query.replace("@location", location)
     query = query.replace("@effective_date", effective_date) ## effective_date.strftime("%Y-%m-%d")
-    current_data = cdp.select(query)
+    query = query.replace("@columns", COMP_PRICE_GRID.select_list())
+    # typed at fetch time, no recast needed
+    current_data = cdp.select(query, schema=COMP_PRICE_GRID.arrow_schema())
     current_data["source"] = "db"
-    current_data = set_column_types(current_data)
     return current_data
 
 
-def check_if_data_exists_and_reconciliate(price_list, location, effective_date):
-    cdp = CDPInterface(env.production, crd.process_account)
+def check_if_data_exists_and_reconciliate(price_list, location, effective_date, cdp=None, cache=None):
+    if cache is not None: return cache.new_records(price_list, location, effective_date)
     
-    current_data = get_price_list_in_db(location, effective_date)
+    current_data = get_price_list_in_db(location, effective_date, cdp)
     merged_data = pd.concat([price_list, current_data])
     
     only_new_records = merged_data.drop_duplicates(subset=["product_number", 
@@ -69,21 +78,19 @@ def check_if_data_exists_and_reconciliate(price_list, location, effective_date):
     return only_new_records
 
 
-def get_competitor_data(file_path):
-    price_list = comp.get_purina_price_list(file_path)
-    location = comp.get_purina_location(file_path)
-    effective_date = comp.get_purina_effective_date(file_path)
-    
-    return {
-        "price_list": price_list,
-        "location": location,
-        "effective_date": effective_date
-    }
+def get_competitor_data(file_path, pool=None, parser=None, result_cache=None, file_hash=None):
+    if parser is None: return comp.get_competitor_data(file_path) if pool is None else pool.extract(comp.get_competitor_data, file_path)
+    if result_cache is not None and file_hash is not None: return result_cache.extract(parser, file_path, file_hash, pool)
+    if pool is None: return parser.extract(file_path)
+    return pool.extract(parser.extract, file_path)
 
 
-def get_pending_files(sp_interface):
-    files = sp_interface.files_in_folder(REPOSITORY)
-    print(f"Archivos en la carpeta {REPOSITORY}: {files}")
+def get_pending_files(sp_interface, folders=REPOSITORIES):
+    files = []
+    for folder in folders:
+        folder_files = sp_interface.files_in_folder(folder)
+        log.info(f"Archivos en la carpeta {folder}: {[x['file_name'] for x in folder_files]}")
+        files += folder_files
     return files
     
 def correct_file_name(val):
@@ -99,45 +106,327 @@ def correct_file_name(val):
     return val
     
 
-def process_pending_files():
-    cdp = CDPInterface(env.production, crd.process_account)
-    sp = get_sharepoint_interface("retailpricing")
-    pending_files = get_pending_files(sp)
-    total_file_count = len(pending_files)
-    for counter, file in enumerate(pending_files, 1):
-        file_name = correct_file_name( pathlib.Path(file["file_name"]).stem )
-        print(f"file name: {file_name}")
-        print(f"{counter}/{total_file_count} {file}")
-        
-        print("downloading file...")
-        file_local_path = sp.download_file(file["file_path"], LOCAL_REPOSITORY)
-        print(f"file downloaded: {file_local_path}")
-        
-        print("processing file...")
-        comp_data_dict = get_competitor_data(file_local_path)
-        
-        print(comp_data_dict["price_list"])
+def load_name(file_name, file_hash):
+    """
+    Name of the temp table, HDFS folder and journal load of a file. Names of different files can normalize to
+    the same value, and their uploads run at the same time, so part of the content hash is added.
+    """
+    return f"{file_name}_{file_hash[:8]}"
+
+
+def skip_known_file(sp, file, reason, recycle_known):
+    if recycle_known: sp.delete_file(file["file_path"])
+    raise SkipItem(reason)
+
+
+def download_pending_file(sp, manifest, journal, run_id, recycle_known, file):
+    file_name = correct_file_name( pathlib.Path(file["file_name"]).stem )
+    if manifest.is_known_file(file): skip_known_file(sp, file, "already processed", recycle_known)
+    
+    log.info(f"downloading file: {file_name}")
+    pdf = sp.open_file(file["file_path"])
+    if pdf is None: raise Exception(f"could not download {file['file_path']}")
+    
+    file_hash = content_hash(pdf)
+    if manifest.is_known_content(file_hash):
+        pdf.close()
+        skip_known_file(sp, file, "same content as an already processed file", recycle_known)
+    
+    parser = detect_format(pdf)
+    if parser is None:
+        pdf.close()
+        raise Exception(f"unknown price list format: {file['file_name']}")
+    
+    # a file that finished before and shows up again starts over, anything else resumes where it stopped
+    entry = journal.file(file_hash)
+    if entry is not None and entry["stage"] == "done":
+        journal.restart(file_hash)
+        entry = None
+    if entry is not None: log.info(f"resuming {file_name}: reached {entry['stage']} in an earlier run")
+    journal.record(file, file_hash, "downloaded", run_id)
+    
+    return {
+        "file": file,
+        "file_name": file_name,
+        "load_name": load_name(file_name, file_hash),
+        "content_hash": file_hash,
+        "parser": parser,
+        "journal": entry,
+        "pdf": pdf
+    }
+
+
+def loaded_by_earlier_run(cdp, journal, job):
+    """
+    True when an earlier run already got the file's rows into the table: the file reached "uploaded", or its
+    load (single file or batch) got past the INSERT. An unfinished load is finished here (REFRESH and
+    dropping the temp table) without inserting anything again.
+    """
+    entry = job["journal"]
+    if entry is None or entry["stage"] not in ("uploading", "uploaded"): return False
+    if entry["stage"] == "uploaded": return True
+    
+    batch = entry["load_name"].startswith(BATCH_PREFIX)
+    load = journal.load(entry["table_name"], entry["load_name"])
+    # the load name was taken over by another file since (single file loads are owned by their content hash)
+    if load is not None and load["content_hash"] != (None if batch else job["content_hash"]): return False
+    if load is None or "insert" not in load["steps"]:
+        # the files of a batch that died before its INSERT go into this run's batch, the old one is given up
+        # (sweep removes what it left behind)
+        if load is not None and batch: journal.finish_load(load["load_key"])
+        return False
+    if load["finished_at"] is None:
+        checkpoint = journal.checkpoint(entry["table_name"], entry["load_name"], load["content_hash"])
+        if batch: cdp.upload_batch({}, entry["table_name"], entry["load_name"], checkpoint=checkpoint)
+        else: cdp.upload_data(None, entry["table_name"], entry["load_name"], direct=False, checkpoint=checkpoint)
+        if not checkpoint.completed("refresh"): raise Exception(f"could not finish the interrupted load {load['load_key']}")
+    return True
+
+
+def parse_pending_file(pool, result_cache, journal, job):
+    log.info(f"processing file: {job['file_name']} ({job['parser'].name})")
+    try:
+        comp_data_dict = get_competitor_data(job["pdf"], pool, job["parser"], result_cache, job["content_hash"])
+    finally:
+        job.pop("pdf").close()
+    if comp_data_dict is None: raise Exception(f"could not read file: {job['file_name']}")
+    
+    for x in comp_data_dict["diagnostics"]:
+        if not x["kept"]: log.warning(f"{job['file_name']}: table {x['table']} rejected ({x['reason']})", extra={"fields": {"event": "table_rejected", "file": job["file_name"], **x}})
+    
+    job["data"] = comp_data_dict
+    journal.record(job["file"], job["content_hash"], "parsed", location=comp_data_dict["location"], effective_date=comp_data_dict["effective_date"])
+    return job
+
+
+def reconcile_pending_file(cdp, cache, job):
+    comp_data_dict = job["data"]
+    price_list = check_if_data_exists_and_reconciliate(comp_data_dict["price_list"], comp_data_dict["location"], comp_data_dict["effective_date"], cdp, cache)
+    price_list = price_list.drop("source", axis=1)
+    job["price_list"] = job["parser"].schema.cast(price_list)
+    return job
+
+
+def delete_processed_file(sp, manifest, journal, job, status):
+    journal.record(job["file"], job["content_hash"], "uploaded")
+    manifest.record(job["file"], job["content_hash"], status)
+    sp.delete_file(job["file"]["file_path"])
+    journal.record(job["file"], job["content_hash"], "done")
+    log.info(f"file deleted from SharePoint folder: {job['file_name']}")
+
+
+def finish_resumed_file(cdp, cache, manifest, sp, journal, job):
+    """
+    Deletes a file whose rows an earlier run loaded. The reconciliation keys of its price list are dropped,
+    they don't include the rows of the interrupted run.
+    """
+    entry = job["journal"]
+    if job["parser"].reconcile and entry["location"] is not None: cache.invalidate([(entry["location"], entry["effective_date"])])
+    status = "rows uploaded by an earlier run"
+    log.info(f"{job['file_name']}: {status}.")
+    delete_processed_file(sp, manifest, journal, job, status)
+    return status
+
+
+def upload_pending_file(cdp, cache, manifest, sp, journal, job):
+    if loaded_by_earlier_run(cdp, journal, job): return finish_resumed_file(cdp, cache, manifest, sp, journal, job)
+    
+    parser = job["parser"]
+    # files of the same price list are reconciled and uploaded one at a time
+    lock = cache.pair_lock(job["data"]["location"], job["data"]["effective_date"]) if parser.reconcile else contextlib.nullcontext()
+    with lock:
+        if parser.reconcile: job = reconcile_pending_file(cdp, cache, job)
+        else: job["price_list"] = parser.schema.cast(job["data"]["price_list"], coerce_numeric=True)
+        file_name = job["file_name"]
+        price_list = job["price_list"]
         
-        price_list = check_if_data_exists_and_reconciliate(comp_data_dict["price_list"], comp_data_dict["location"], comp_data_dict["effective_date"])
-        print("price list after check if data exists")
-        print(price_list)
-        price_list = price_list.drop("source", axis=1)
-        price_list = set_column_types(price_list)
         if price_list.shape[0] > 0:
-            print(price_list)
-            if cdp.upload_data(price_list, "comp_price_grid", file_name):
-                print(f"{file} uploaded successfully to database.")
+            # a load of the same file that failed earlier resumes at the step that failed
+            checkpoint = journal.checkpoint(parser.schema.table_name, job["load_name"], job["content_hash"])
+            journal.record(job["file"], job["content_hash"], "uploading", table_name=parser.schema.table_name, load_name=job["load_name"])
+            if not cdp.upload_data(price_list, parser.schema.table_name, job["load_name"], schema=parser.schema, checkpoint=checkpoint): raise Exception("upload to database failed")
+            if parser.reconcile: cache.record_upload(job["data"]["location"], job["data"]["effective_date"], price_list)
+            log.info(f"{file_name} uploaded successfully to database.")
+            status = f"{price_list.shape[0]} rows uploaded"
+        else:
+            log.info(f"{file_name}: empty dataframe. Data already in database.")
+            status = "data already in database"
+    
+    delete_processed_file(sp, manifest, journal, job, status)
+    return status
+
+
+def upload_pending_files_in_batch(cdp, cache, manifest, sp, journal, results):
+    """
+    Reconciles every parsed file of the run against one prefetch of the existing rows, uploads them with 
+    one temp table, INSERT and REFRESH, then deletes the files that made it into the database from SharePoint.
+    Formats that are not reconciled (horizontal files) are uploaded one by one.
+    """
+    parsed = [x for x in results if x["error"] is None and isinstance(x["result"], dict)]
+    for x in parsed:
+        try:
+            if not x["result"]["parser"].reconcile:
+                x["result"] = upload_pending_file(cdp, cache, manifest, sp, journal, x["result"])
+            elif loaded_by_earlier_run(cdp, journal, x["result"]):
+                x["result"] = finish_resumed_file(cdp, cache, manifest, sp, journal, x["result"])
+        except Exception as error:
+            x["error"] = error
+            x["stage"] = "upload"
+    parsed = [x for x in parsed if x["error"] is None and isinstance(x["result"], dict)]
+    
+    try:
+        cache.prefetch([(x["result"]["data"]["location"], x["result"]["data"]["effective_date"]) for x in parsed])
+    except Exception as error:
+        for x in parsed:
+            x["error"] = error
+            x["stage"] = "reconcile"
+        return results
+    
+    jobs = {}
+    staged_keys = {}
+    for x in parsed:
+        try:
+            job = reconcile_pending_file(cdp, cache, x["result"])
+        except Exception as error:
+            x["error"] = error
+            x["stage"] = "reconcile"
+            continue
         
-                sp.delete_file(file["file_path"])
-                print(f"file deleted from SharePoint folder: {file_name}")
+        # rows already staged by another file of the same batch
+        pair_keys = staged_keys.setdefault((job["data"]["location"], job["data"]["effective_date"]), set())
+        keys = pd.Series(row_keys(job["price_list"]), index=job["price_list"].index)
+        job["price_list"] = job["price_list"][~keys.isin(pair_keys)]
+        pair_keys.update(keys)
+        
+        batch_key = job["file_name"]
+        while batch_key in jobs: batch_key += "_"
+        jobs[batch_key] = x
+    
+    to_upload = {key: x["result"]["price_list"] for key, x in jobs.items() if x["result"]["price_list"].shape[0] > 0}
+    uploaded = {}
+    if to_upload:
+        batch_name = BATCH_PREFIX + datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        checkpoint = journal.checkpoint("comp_price_grid", batch_name)
+        for key in to_upload:
+            job = jobs[key]["result"]
+            journal.record(job["file"], job["content_hash"], "uploading", table_name="comp_price_grid", load_name=batch_name)
+        uploaded = cdp.upload_batch(to_upload, "comp_price_grid", batch_name, schema=COMP_PRICE_GRID, checkpoint=checkpoint)
+    
+    for key, x in jobs.items():
+        job = x["result"]
+        if key in to_upload:
+            if not uploaded.get(key):
+                x["error"] = Exception("upload to database failed")
+                x["stage"] = "upload"
+                continue
+            cache.record_upload(job["data"]["location"], job["data"]["effective_date"], job["price_list"])
+            x["result"] = f"{job['price_list'].shape[0]} rows uploaded"
         else:
-            print("empty dataframe. Data already in database.")
-            sp.delete_file(file["file_path"])
-            print(f"file deleted from SharePoint folder: {file_name}")
+            x["result"] = "data already in database"
+        delete_processed_file(sp, manifest, journal, job, x["result"])
+    
+    return results
 
-    print("Done.")
 
+def process_pending_files(download_workers=4, parse_workers=DEFAULT_WORKERS, upload_workers=2, batch_upload=False, recycle_known=False, files=None, sp=None, metrics_file=METRICS_FILE, result_cache=None, journal=None):
+    """
+    Runs download -> parse -> reconcile/upload/delete as a pipeline so downloads, tabula and 
+    the Impala/HDFS uploads of different files overlap. Parsing runs in the extraction worker pool.
+    With batch_upload the files are parsed in the pipeline and then reconciled and loaded together.
+    Existing rows are looked up through the local reconciliation cache.
+    Files already in the processed files manifest are skipped (and recycled with recycle_known) 
+    before they are downloaded or parsed.
+    files limits the run to those listing entries instead of the whole folders.
+    Extraction results are kept in the result cache by content hash, so files left in SharePoint by a failed
+    load are not parsed again on the next run.
+    Progress is kept in the run journal: a file whose load was interrupted resumes at the step that failed
+    (a load that got past its INSERT only gets its REFRESH and temp table drop), see pipeline.journal.
+    Each file is routed to its parser by the format registry, so vertical and horizontal files share one run.
+    The run ends with a summary of every stage and remote call (p50/p95, bytes moved, rows loaded) in the log,
+    also written to metrics_file in the Prometheus text format.
+    """
+    METRICS.reset()
+    if sp is None: sp = get_sharepoint_interface("retailpricing")
+    pending_files = get_pending_files(sp) if files is None else files
+    log.info(f"{len(pending_files)} pending files")
+    if not pending_files: return []
+    
+    cdp = CDPInterface(env.get(), crd.process_account)
+    cache = ReconciliationCache(cdp)
+    manifest = FileManifest()
+    if result_cache is None: result_cache = ResultCache()
+    if journal is None: journal = RunJournal()
+    unfinished = journal.unfinished_files()
+    if unfinished: log.info(f"{len(unfinished)} files unfinished by earlier runs")
+    run_id = journal.start_run()
+    
+    try:
+        with ExtractionPool(parse_workers) as pool:
+            stages = [
+                Stage("download", partial(download_pending_file, sp, manifest, journal, run_id, recycle_known), download_workers),
+                Stage("parse", partial(parse_pending_file, pool, result_cache, journal), parse_workers)
+            ]
+            if not batch_upload: stages.append(Stage("upload", partial(upload_pending_file, cdp, cache, manifest, sp, journal), upload_workers))
+            results = run_pipeline(pending_files, stages)
+        
+        if batch_upload: results = upload_pending_files_in_batch(cdp, cache, manifest, sp, journal, results)
+    finally:
+        cdp.close()
+        journal.finish_run(run_id)
+    
+    for x in results:
+        if x["error"] is not None: journal.record_error(x["item"]["file_path"], x["error"])
+    
+    print_summary(results, label=lambda file: file["file_name"])
+    count("files_processed", len([x for x in results if x["error"] is None]))
+    count("files_failed", len([x for x in results if x["error"] is not None]))
+    METRICS.log_summary()
+    if metrics_file: METRICS.write_prometheus(metrics_file)
+    log.info("Done.")
+    return results
+
+    
+
+def process_new_files(**kwargs):
+    """
+    Incremental run: only the files that are new or changed since the last run are processed.
+    """
+    sp = get_sharepoint_interface("retailpricing")
+    pending = {scanner: scanner.pending_files() for scanner in [FolderScanner(sp, x) for x in REPOSITORIES]}
+    files = [x for scanner_files in pending.values() for x in scanner_files]
+    if not files:
+        log.info("No new files.")
+        return []
+    
+    results = process_pending_files(files=files, sp=sp, **kwargs)
+    for scanner, scanner_files in pending.items():
+        if scanner_files: scanner.commit(results_for(results, scanner_files))
+    return results
+
+
+def watch_pending_files(interval=300, polls=None, **kwargs):
+    """
+    Long running entry point: polls the folders every interval seconds and runs the pipeline when files arrive.
+    """
+    sp = get_sharepoint_interface("retailpricing")
+    scanners = [FolderScanner(sp, x) for x in REPOSITORIES]
+    watch(scanners, partial(process_pending_files, sp=sp, **kwargs), interval, polls)
+    
+
+def sweep_leftovers(dry_run=False, force=False, include=()):
+    """
+    Cleans up the temp tables, HDFS staging folders and exported Parquet files left by interrupted loads
+    (see pipeline.sweep.sweep; include names leftovers the journal doesn't know, reviewed in a dry run).
+    """
+    with CDPInterface(env.get(), crd.process_account) as cdp:
+        return sweep(cdp, RunJournal(), dry_run, force, include)
     
 
 if __name__ == "__main__":
-    process_pending_files()
\ No newline at end of file
+    configure_logging()
+    if "--sweep" in sys.argv:
+        include = [x.split("=", 1)[1] for x in sys.argv if x.startswith("--include=")]
+        sweep_leftovers(dry_run="--dry-run" in sys.argv, force="--force" in sys.argv, include=",".join(include).split(",") if include else ())
+    elif "--watch" in sys.argv: watch_pending_files()
+    elif "--incremental" in sys.argv: process_new_files()
+    else: process_pending_files()
\ No newline at end of file
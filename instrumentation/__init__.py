@@ -0,0 +1,2 @@
+from instrumentation.logs import get_logger, configure_logging, tabula_log_file
+from instrumentation.metrics import METRICS, timed, count
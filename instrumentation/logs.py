@@ -0,0 +1,95 @@
+import json
+import logging
+import pathlib
+import sys
+
+LOGGER_NAME = "ingest"
+LOG_FILE = "logs/ingest.log"
+TABULA_LOG_FILE = "logs/tabula.log"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message and the fields passed with extra={"fields": {...}}.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info: entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ConsoleFilter(logging.Filter):
+    """
+    Keeps the per call stage events out of the console, they only go to the log file and the run summary.
+    """
+
+    def filter(self, record):
+        return getattr(record, "fields", {}).get("event") != "stage"
+
+
+def root_logger():
+    logger = logging.getLogger(LOGGER_NAME)
+    if not logger.handlers:
+        # plain progress lines on stdout, like the prints they replace, until configure_logging is called
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(logging.Formatter("%(message)s"))
+        console.addFilter(ConsoleFilter())
+        logger.addHandler(console)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def get_logger(name):
+    root_logger()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def set_file_handler(logger, log_file, formatter):
+    """
+    Replaces the file handler an earlier configure_logging call put on the logger (if any) with one for log_file.
+    """
+    for handler in [x for x in logger.handlers if getattr(x, "configured_file", False)]:
+        logger.removeHandler(handler)
+        handler.close()
+    if not log_file: return
+
+    pathlib.Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(formatter)
+    handler.configured_file = True
+    logger.addHandler(handler)
+
+
+def tabula_log_file():
+    """
+    File tabula's messages go to since the last configure_logging call, None when they are not sent to a file.
+    """
+    handlers = [x for x in logging.getLogger("tabula").handlers if getattr(x, "configured_file", False)]
+    return handlers[0].baseFilename if handlers else None
+
+
+def configure_logging(log_file=LOG_FILE, tabula_log_file=TABULA_LOG_FILE, level=logging.INFO):
+    """
+    Adds the structured JSON log file to the console output and sends tabula's JVM messages
+    (font fallbacks, pdfbox warnings) to their own file instead of the console. Extraction workers started
+    afterwards write their stderr, where the in-process JVM prints, to the same file.
+    Calling it again (watch mode, tests, the benchmark) replaces the files instead of adding handlers.
+    """
+    logger = root_logger()
+    logger.setLevel(level)
+    set_file_handler(logger, log_file, JsonFormatter())
+
+    tabula_logger = logging.getLogger("tabula")
+    set_file_handler(tabula_logger, tabula_log_file, logging.Formatter("%(asctime)s %(message)s"))
+    # without a file of their own tabula's messages go back to the console
+    tabula_logger.propagate = not tabula_log_file
+
+    return logger
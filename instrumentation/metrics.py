@@ -0,0 +1,153 @@
+import contextlib
+import pathlib
+import threading
+import time
+
+from instrumentation.logs import get_logger
+
+log = get_logger("metrics")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values: return None
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+class Metrics:
+    """
+    Durations per stage and counters (bytes moved, rows loaded, ...) of one run, shared by every thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        with self._lock:
+            self.durations = {}
+            self.errors = {}
+            self.counters = {}
+            self.started_at = time.time()
+
+
+    def observe(self, stage, seconds, error=False):
+        with self._lock:
+            self.durations.setdefault(stage, []).append(seconds)
+            if error: self.errors[stage] = self.errors.get(stage, 0) + 1
+
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def summary(self):
+        with self._lock:
+            return {
+                "seconds": time.time() - self.started_at,
+                "stages": {
+                    stage: {
+                        "count": len(values),
+                        "errors": self.errors.get(stage, 0),
+                        "total": sum(values),
+                        "p50": percentile(values, 0.5),
+                        "p95": percentile(values, 0.95)
+                    }
+                    for stage, values in self.durations.items()
+                },
+                "counters": dict(self.counters)
+            }
+
+
+    def log_summary(self):
+        summary = self.summary()
+        log.info(f"run finished in {summary['seconds']:.1f}s", extra={"fields": {"event": "run_summary", **summary}})
+        for stage, x in summary["stages"].items():
+            log.info(f"  {stage}: {x['count']} calls, {x['errors']} errors, p50 {x['p50']:.2f}s, p95 {x['p95']:.2f}s, total {x['total']:.1f}s")
+        for name, value in summary["counters"].items():
+            log.info(f"  {name}: {value}")
+        return summary
+
+
+    def write_prometheus(self, path):
+        """
+        Writes the summary in the Prometheus text format, for the node exporter textfile collector.
+        The file is replaced atomically so the collector never reads half of it.
+        """
+        summary = self.summary()
+        lines = [
+            "# TYPE ingest_stage_seconds summary",
+        ]
+        for stage, x in summary["stages"].items():
+            lines.append(f'ingest_stage_seconds{{stage="{stage}",quantile="0.5"}} {x["p50"]}')
+            lines.append(f'ingest_stage_seconds{{stage="{stage}",quantile="0.95"}} {x["p95"]}')
+            lines.append(f'ingest_stage_seconds_sum{{stage="{stage}"}} {x["total"]}')
+            lines.append(f'ingest_stage_seconds_count{{stage="{stage}"}} {x["count"]}')
+        lines.append("# TYPE ingest_stage_errors_total counter")
+        for stage, x in summary["stages"].items():
+            lines.append(f'ingest_stage_errors_total{{stage="{stage}"}} {x["errors"]}')
+        for name, value in summary["counters"].items():
+            lines.append(f"# TYPE ingest_{name}_total counter")
+            lines.append(f"ingest_{name}_total {value}")
+        lines.append("# TYPE ingest_run_seconds gauge")
+        lines.append(f"ingest_run_seconds {summary['seconds']}")
+        lines.append("# TYPE ingest_last_run_timestamp_seconds gauge")
+        lines.append(f"ingest_last_run_timestamp_seconds {time.time()}")
+
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(path.suffix + ".tmp")
+        temp_path.write_text("\n".join(lines) + "\n")
+        temp_path.replace(path)
+
+
+METRICS = Metrics()
+
+
+class timed(contextlib.ContextDecorator):
+    """
+    Times a block or a function as one stage of the current run and logs it as a structured event:
+
+        with timed("hdfs.upload_file", path=file_path): ...
+
+        @timed("impala.execute")
+        def execute(...): ...
+
+    A block that raises counts as an error of the stage. Functions that report failure by returning False or None
+    (the convention of the interfaces) are not errors here; their callers decide.
+    """
+
+    def __init__(self, stage, **fields):
+        self.stage = stage
+        self.fields = fields
+        self.start = None
+
+
+    def _recreate_cm(self):
+        # a fresh timer per decorated call, so concurrent calls don't share a start time
+        return timed(self.stage, **self.fields)
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        METRICS.observe(self.stage, seconds, error=exc_type is not None)
+        log.info(self.stage, extra={"fields": {
+            "event": "stage",
+            "stage": self.stage,
+            "seconds": round(seconds, 4),
+            "status": "error" if exc_type else "ok",
+            **self.fields
+        }})
+        return False
+
+
+def count(name, value=1):
+    METRICS.count(name, value)
@@ -0,0 +1 @@
+from pipeline.stages import Stage, SkipItem, run_pipeline, print_summary
\ No newline at end of file
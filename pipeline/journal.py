@@ -0,0 +1,282 @@
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import socket
+import sqlite3
+import threading
+import uuid
+
+from cdp_interface.upload_data import UploadCheckpoint
+
+JOURNAL_PATH = "pipeline/cache/run_journal.sqlite"
+# entries of finished files and loads are kept this long, for the record
+KEEP_DAYS = 30
+# a run takes minutes: one still unfinished after this many hours crashed, wherever it ran
+RUN_MAX_AGE_HOURS = 12
+
+# progress of a file through a run, in order
+STAGES = ["downloaded", "parsed", "uploading", "uploaded", "done"]
+
+
+def now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class JournalCheckpoint(UploadCheckpoint):
+    """
+    UploadCheckpoint stored in the run journal: the finished steps of one load survive a crash,
+    so the next run skips them.
+    """
+
+    def __init__(self, journal, load_key, load_id, steps, restarted=False):
+        self.journal = journal
+        self.load_key = load_key
+        self.load_id = load_id
+        self.steps = set(steps)
+        self.restarted = restarted
+
+    def done(self, step):
+        self.steps.add(step)
+        self.journal.record_step(self.load_key, step)
+
+    def finish(self):
+        self.journal.finish_load(self.load_key)
+
+    def reset(self):
+        self.steps = set()
+        self.journal.reset_load(self.load_key)
+
+
+class RunJournal:
+    """
+    Persistent progress of every file (by content hash) through download, parse, upload and the SharePoint delete,
+    plus the finished steps of every load (temp table name -> export, hdfs, temp_table, insert, refresh, drop).
+    A run that dies halfway leaves the journal pointing at what was finished, so the next run resumes there
+    instead of starting over, and sweep (pipeline.sweep) knows which leftovers still belong to an unfinished load.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    host TEXT,
+                    pid INTEGER,
+                    started_at TEXT,
+                    finished_at TEXT
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    content_hash TEXT PRIMARY KEY,
+                    file_name TEXT,
+                    file_path TEXT,
+                    stage TEXT,
+                    table_name TEXT,
+                    load_name TEXT,
+                    location TEXT,
+                    effective_date TEXT,
+                    run_id TEXT,
+                    error TEXT,
+                    updated_at TEXT
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS loads (
+                    load_key TEXT PRIMARY KEY,
+                    table_name TEXT,
+                    load_name TEXT,
+                    load_id TEXT,
+                    steps TEXT,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    content_hash TEXT
+                )
+            """)
+            # journals written before loads had an owner
+            if "content_hash" not in [x["name"] for x in db.execute("PRAGMA table_info(loads)")]:
+                db.execute("ALTER TABLE loads ADD COLUMN content_hash TEXT")
+
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Connection in a transaction (committed on success, rolled back on error), closed on exit.
+        """
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db: yield db
+        finally:
+            db.close()
+
+
+    def query(self, query, parameters=()):
+        with self._lock, self.connect() as db:
+            return [dict(x) for x in db.execute(query, parameters).fetchall()]
+
+
+    def write(self, query, parameters=()):
+        with self._lock, self.connect() as db:
+            db.execute(query, parameters)
+
+
+    ####################################################### runs
+
+
+    def start_run(self):
+        run_id = uuid.uuid4().hex
+        self.write("INSERT INTO runs VALUES (?, ?, ?, ?, NULL)", (run_id, socket.gethostname(), os.getpid(), now()))
+        return run_id
+
+
+    def finish_run(self, run_id):
+        self.write("UPDATE runs SET finished_at = ? WHERE run_id = ?", (now(), run_id))
+
+
+    def active_runs(self, max_age_hours=RUN_MAX_AGE_HOURS):
+        """
+        Unfinished runs younger than max_age_hours whose process is still alive on this host (runs on other hosts,
+        e.g. another CDSW session, can't be checked and are assumed alive until they are that old).
+        """
+        oldest = (datetime.datetime.now() - datetime.timedelta(hours=max_age_hours)).isoformat(timespec="seconds")
+        active = []
+        for run in self.query("SELECT * FROM runs WHERE finished_at IS NULL AND started_at >= ?", (oldest,)):
+            if run["host"] == socket.gethostname():
+                try:
+                    os.kill(run["pid"], 0)
+                except ProcessLookupError:
+                    continue
+                except PermissionError:
+                    pass
+            active.append(run)
+        return active
+
+
+    ####################################################### files
+
+
+    def file(self, content_hash):
+        rows = self.query("SELECT * FROM files WHERE content_hash = ?", (content_hash,))
+        return rows[0] if rows else None
+
+
+    def record(self, file, content_hash, stage, run_id=None, **fields):
+        """
+        Moves a file forward to a stage of STAGES (never back: a resumed file keeps the stage it reached).
+        fields (table_name, load_name, location, effective_date) are kept from the previous record unless given.
+        """
+        previous = self.file(content_hash) or {}
+        if previous.get("stage") in STAGES and STAGES.index(previous["stage"]) > STAGES.index(stage): stage = previous["stage"]
+        values = {
+            "content_hash": content_hash,
+            "file_name": file["file_name"],
+            "file_path": file["file_path"],
+            "stage": stage,
+            "table_name": previous.get("table_name"),
+            "load_name": previous.get("load_name"),
+            "location": previous.get("location"),
+            "effective_date": previous.get("effective_date"),
+            "run_id": run_id or previous.get("run_id"),
+            "error": None,
+            "updated_at": now()
+        }
+        values.update(fields)
+        self.write(
+            f"INSERT OR REPLACE INTO files ({', '.join(values)}) VALUES ({', '.join('?' for _ in values)})",
+            tuple(values.values())
+        )
+
+
+    def restart(self, content_hash):
+        """
+        Forgets the progress of a file, e.g. a finished file that shows up again and has to be processed from scratch.
+        """
+        self.write("DELETE FROM files WHERE content_hash = ?", (content_hash,))
+
+
+    def record_error(self, file_path, error):
+        self.write(
+            "UPDATE files SET error = ?, updated_at = ? WHERE file_path = ? AND stage != 'done'",
+            (str(error), now(), file_path)
+        )
+
+
+    def unfinished_files(self):
+        return self.query("SELECT * FROM files WHERE stage != 'done' ORDER BY updated_at")
+
+
+    ####################################################### loads
+
+
+    def checkpoint(self, table_name, load_name, content_hash=None):
+        """
+        Checkpoint of the load of load_name into table_name, created on first use.
+        The load key is the name of the load's temp table, staging folder and exported files.
+        content_hash is the file the load belongs to: an unfinished load of another file under the same name
+        (a corrected PDF re-uploaded with the old name) is not resumed but replaced, and the checkpoint comes back
+        restarted so DataUpload discards that load's leftovers first.
+        """
+        load_key = f"{table_name}_{load_name}"
+        restarted = False
+        with self._lock, self.connect() as db:
+            row = db.execute("SELECT * FROM loads WHERE load_key = ?", (load_key,)).fetchone()
+            if row is not None and row["finished_at"] is None and row["content_hash"] != content_hash:
+                restarted = True
+            if row is None or row["finished_at"] is not None or restarted:
+                row = {"load_id": uuid.uuid4().hex, "steps": "[]"}
+                db.execute(
+                    "INSERT OR REPLACE INTO loads VALUES (?, ?, ?, ?, ?, ?, NULL, ?)",
+                    (load_key, table_name, load_name, row["load_id"], row["steps"], now(), content_hash)
+                )
+        return JournalCheckpoint(self, load_key, row["load_id"], json.loads(row["steps"]), restarted)
+
+
+    def record_step(self, load_key, step):
+        with self._lock, self.connect() as db:
+            row = db.execute("SELECT steps FROM loads WHERE load_key = ?", (load_key,)).fetchone()
+            steps = json.loads(row["steps"]) if row else []
+            if step not in steps: steps.append(step)
+            db.execute("UPDATE loads SET steps = ? WHERE load_key = ?", (json.dumps(steps), load_key))
+
+
+    def finish_load(self, load_key):
+        self.write("UPDATE loads SET finished_at = ? WHERE load_key = ?", (now(), load_key))
+
+
+    def reset_load(self, load_key):
+        self.write("UPDATE loads SET steps = '[]' WHERE load_key = ?", (load_key,))
+
+
+    def load(self, table_name, load_name):
+        rows = self.query("SELECT * FROM loads WHERE load_key = ?", (f"{table_name}_{load_name}",))
+        if not rows: return None
+        return {**rows[0], "steps": json.loads(rows[0]["steps"])}
+
+
+    def load_keys(self):
+        return {x["load_key"] for x in self.query("SELECT load_key FROM loads")}
+
+
+    def unfinished_loads(self):
+        rows = self.query("SELECT * FROM loads WHERE finished_at IS NULL ORDER BY started_at")
+        return [{**x, "steps": json.loads(x["steps"])} for x in rows]
+
+
+    def prune(self, days=KEEP_DAYS):
+        """
+        Forgets finished runs, files and loads older than days, and runs that crashed (unfinished after
+        RUN_MAX_AGE_HOURS).
+        """
+        oldest = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat(timespec="seconds")
+        crashed = (datetime.datetime.now() - datetime.timedelta(hours=RUN_MAX_AGE_HOURS)).isoformat(timespec="seconds")
+        with self._lock, self.connect() as db:
+            db.execute("DELETE FROM runs WHERE finished_at IS NOT NULL AND finished_at < ?", (oldest,))
+            db.execute("DELETE FROM runs WHERE finished_at IS NULL AND started_at < ?", (crashed,))
+            db.execute("DELETE FROM files WHERE stage = 'done' AND updated_at < ?", (oldest,))
+            db.execute("DELETE FROM loads WHERE finished_at IS NOT NULL AND finished_at < ?", (oldest,))
@@ -0,0 +1,100 @@
+import contextlib
+import datetime
+import hashlib
+import pathlib
+import sqlite3
+import threading
+
+MANIFEST_PATH = "pipeline/cache/processed_files.sqlite"
+
+
+def content_hash(source):
+    """
+    sha256 of a PDF given as bytes or as a file object (which is left positioned at the start).
+    """
+    if isinstance(source, bytes): return hashlib.sha256(source).hexdigest()
+
+    digest = hashlib.sha256()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(1024 * 1024), b""): digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """
+    Persistent record of the PDFs that have already been processed.
+    A file is known by its SharePoint identity (ETag, or path + size + last modified time when the listing has
+    no ETag) before it is downloaded,
+    and by the hash of its content before it is parsed, which catches the same price list re-uploaded under another name.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS processed_files (
+                    content_hash TEXT,
+                    etag TEXT,
+                    size INTEGER,
+                    last_modified TEXT,
+                    file_name TEXT,
+                    file_path TEXT,
+                    status TEXT,
+                    processed_at TEXT
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS processed_files_hash ON processed_files (content_hash)")
+            db.execute("CREATE INDEX IF NOT EXISTS processed_files_etag ON processed_files (etag)")
+
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Connection in a transaction (committed on success, rolled back on error), closed on exit.
+        """
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db: yield db
+        finally:
+            db.close()
+
+
+    def find(self, query, parameters):
+        with self._lock, self.connect() as db:
+            return db.execute(query, parameters).fetchone()
+
+
+    def is_known_file(self, file):
+        """
+        Checks a SharePoint listing entry (see SharePointFunctions.file_details) without downloading it.
+        """
+        if file.get("etag"):
+            return self.find("SELECT 1 FROM processed_files WHERE etag = ?", (file["etag"],)) is not None
+
+        # no ETag in the listing: same path, size and last modified time
+        if file.get("size") is None or file.get("last_modified") is None: return False
+        return self.find(
+            "SELECT 1 FROM processed_files WHERE file_path = ? AND size = ? AND last_modified = ?",
+            (file.get("file_path"), file["size"], str(file["last_modified"]))
+        ) is not None
+
+
+    def is_known_content(self, file_hash):
+        return self.find("SELECT 1 FROM processed_files WHERE content_hash = ?", (file_hash,)) is not None
+
+
+    def record(self, file, file_hash, status):
+        with self._lock, self.connect() as db:
+            db.execute("INSERT INTO processed_files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+                file_hash,
+                file.get("etag"),
+                file.get("size"),
+                None if file.get("last_modified") is None else str(file["last_modified"]),
+                file.get("file_name"),
+                file.get("file_path"),
+                status,
+                datetime.datetime.now().isoformat(timespec="seconds")
+            ))
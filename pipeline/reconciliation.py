@@ -0,0 +1,185 @@
+import contextlib
+import pathlib
+import sqlite3
+import threading
+import time
+import pandas as pd
+
+from competitor_data.schemas import COMP_PRICE_GRID
+
+KEY_COLUMNS = [
+    "product_number",
+    "formula_code",
+    "product_name",
+    "unit_weight",
+    "product_form",
+    "fob_or_dlv",
+    "price_change",
+    "single_unit_list_price",
+    "full_pallet_list_price",
+    "pkg_bulk_discount",
+    "best_net_list_price",
+    "species",
+    "plant_location",
+    "date_inserted"
+]
+
+PRICE_COLUMNS = [
+    "price_change",
+    "single_unit_list_price",
+    "full_pallet_list_price",
+    "pkg_bulk_discount",
+    "best_net_list_price"
+]
+
+CACHE_PATH = "pipeline/cache/price_list_keys.sqlite"
+CACHE_TTL = 24 * 60 * 60
+PAIRS_PER_QUERY = 100
+MISSING = "\x00"
+
+
+def row_keys(df):
+    """
+    64 bit hash of the reconciliation columns of every row.
+    Values are normalized first so PDF rows (object columns) and warehouse rows (string dtype) hash the same:
+    prices as float64 with -0.0 folded into 0.0, text as str with one marker for missing values.
+    """
+    key_frame = pd.DataFrame(index=df.index)
+    for col in KEY_COLUMNS:
+        if col in PRICE_COLUMNS:
+            key_frame[col] = pd.to_numeric(df[col], errors="coerce").astype("float64") + 0.0
+        else:
+            key_frame[col] = df[col].astype(object).where(df[col].notna(), MISSING).astype(str).astype(object)
+
+    return pd.util.hash_pandas_object(key_frame, index=False).to_numpy().view("int64")
+
+
+def quote(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+class ReconciliationCache:
+    """
+    Local SQLite copy of the row keys already in comp_price_grid, per (location, effective date).
+    Keys for a whole batch are fetched with one query, reused until they are older than ttl seconds,
+    and updated with the rows we upload ourselves so a re-run never queries for data it just wrote.
+    Uploads of the same pair must hold pair_lock from reconciliation to record_upload, otherwise two files
+    reconciled against the same keys in parallel both insert their common rows.
+    """
+
+    def __init__(self, cdp, path=CACHE_PATH, ttl=CACHE_TTL):
+        self.cdp = cdp
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pair_locks = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS fetched (location TEXT, effective_date TEXT, fetched_at REAL, PRIMARY KEY (location, effective_date))")
+            db.execute("CREATE TABLE IF NOT EXISTS row_keys (location TEXT, effective_date TEXT, row_key INTEGER)")
+            db.execute("CREATE INDEX IF NOT EXISTS row_keys_pair ON row_keys (location, effective_date)")
+
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Connection in a transaction (committed on success, rolled back on error), closed on exit.
+        """
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db: yield db
+        finally:
+            db.close()
+
+
+    def pair_lock(self, location, effective_date):
+        with self._lock:
+            return self._pair_locks.setdefault((location, effective_date), threading.Lock())
+
+
+    def stale_pairs(self, pairs):
+        oldest = time.time() - self.ttl
+        with self._lock, self.connect() as db:
+            fresh = set(db.execute("SELECT location, effective_date FROM fetched WHERE fetched_at >= ?", (oldest,)).fetchall())
+        return [x for x in dict.fromkeys(pairs) if x not in fresh]
+
+
+    def prefetch(self, pairs):
+        """
+        Loads the keys of every (location, effective_date) pair that is not cached yet, in one query per
+        PAIRS_PER_QUERY pairs.
+        """
+        pairs = self.stale_pairs(pairs)
+        for start in range(0, len(pairs), PAIRS_PER_QUERY):
+            chunk = pairs[start:start + PAIRS_PER_QUERY]
+            current_data = self.fetch(chunk)
+            self.store(chunk, current_data)
+
+
+    def fetch(self, pairs):
+        conditions = " OR ".join(
+            f'(plant_location = "{quote(location)}" AND date_inserted = "{quote(effective_date)}")'
+            for location, effective_date in pairs
+        )
+        query = pathlib.Path("competitor_data/sql_queries/price_list_batch.sql").read_text()
+        query = query.replace("@conditions", conditions)
+        query = query.replace("@columns", COMP_PRICE_GRID.select_list())
+
+        current_data = self.cdp.select(query, schema=COMP_PRICE_GRID.arrow_schema())
+        if current_data.shape[1] == 0: raise Exception("could not read current price lists from database")
+        return current_data
+
+
+    def store(self, pairs, current_data):
+        keys = pd.DataFrame({
+            "location": current_data["plant_location"].astype(str),
+            "effective_date": current_data["date_inserted"].astype(str),
+            "row_key": row_keys(current_data)
+        })
+        now = time.time()
+        with self._lock, self.connect() as db:
+            for location, effective_date in pairs:
+                db.execute("DELETE FROM row_keys WHERE location = ? AND effective_date = ?", (location, effective_date))
+                db.execute("INSERT OR REPLACE INTO fetched VALUES (?, ?, ?)", (location, effective_date, now))
+            db.executemany("INSERT INTO row_keys VALUES (?, ?, ?)", keys.itertuples(index=False, name=None))
+
+
+    def existing_keys(self, location, effective_date):
+        self.prefetch([(location, effective_date)])
+        with self._lock, self.connect() as db:
+            rows = db.execute(
+                "SELECT row_key FROM row_keys WHERE location = ? AND effective_date = ?",
+                (location, effective_date)
+            ).fetchall()
+        return {x[0] for x in rows}
+
+
+    def new_records(self, price_list, location, effective_date):
+        """
+        Rows of the price list that are not in the database yet.
+        Same result as the old concat + drop_duplicates(keep=False): rows repeated inside the PDF are dropped too.
+        """
+        keys = pd.Series(row_keys(price_list), index=price_list.index)
+        existing = self.existing_keys(location, effective_date)
+        is_new = ~keys.isin(existing) & ~keys.duplicated(keep=False)
+        return price_list[is_new]
+
+
+    def record_upload(self, location, effective_date, price_list):
+        """
+        Adds rows we just loaded to the cached keys instead of invalidating the pair.
+        """
+        rows = [(location, effective_date, int(x)) for x in row_keys(price_list)]
+        with self._lock, self.connect() as db:
+            db.executemany("INSERT INTO row_keys VALUES (?, ?, ?)", rows)
+
+
+    def invalidate(self, pairs=None):
+        with self._lock, self.connect() as db:
+            if pairs is None:
+                db.execute("DELETE FROM fetched")
+                db.execute("DELETE FROM row_keys")
+                return
+            for location, effective_date in pairs:
+                db.execute("DELETE FROM fetched WHERE location = ? AND effective_date = ?", (location, effective_date))
+                db.execute("DELETE FROM row_keys WHERE location = ? AND effective_date = ?", (location, effective_date))
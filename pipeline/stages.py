@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+
+from instrumentation import METRICS, get_logger
+
+log = get_logger("pipeline")
+
+DONE = object()
+
+
+class SkipItem(Exception):
+    """
+    Raised by a stage to stop an item early without counting it as a failure.
+    The message becomes the item's result.
+    """
+
+
+class Stage:
+    """
+    One step of a pipeline. func receives the value returned by the previous stage (the item itself
+    for the first stage) and returns the value for the next one. Raising an exception fails the item.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+def run_pipeline(items, stages, queue_size=4):
+    """
+    Runs every item through the stages. Each stage has its own worker threads and a bounded inbound queue,
+    so a slow stage applies back pressure instead of letting finished work pile up in memory.
+    CPU heavy stages should hand the work to a process pool from inside func.
+
+    Returns one dict per item with the last stage's result or the error and the stage that failed.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    remaining = [stage.workers for stage in stages]
+    lock = threading.Lock()
+    results = []
+
+    def finish(item, timings, result=None, error=None, failed_stage=None):
+        with lock:
+            results.append({
+                "item": item,
+                "result": result,
+                "error": error,
+                "stage": failed_stage,
+                "timings": timings
+            })
+
+    def worker(index):
+        stage = stages[index]
+        is_last = index == len(stages) - 1
+
+        while True:
+            task = queues[index].get()
+
+            if task is DONE:
+                with lock:
+                    remaining[index] -= 1
+                    last_worker = remaining[index] == 0
+                if last_worker and not is_last:
+                    for _ in range(stages[index + 1].workers): queues[index + 1].put(DONE)
+                return
+
+            item, value, timings = task
+            start = time.perf_counter()
+            try:
+                value = stage.func(value)
+            except SkipItem as skip:
+                timings[stage.name] = time.perf_counter() - start
+                METRICS.observe(f"pipeline.{stage.name}", timings[stage.name])
+                finish(item, timings, result=f"skipped: {skip}")
+                continue
+            except Exception as error:
+                timings[stage.name] = time.perf_counter() - start
+                METRICS.observe(f"pipeline.{stage.name}", timings[stage.name], error=True)
+                finish(item, timings, error=error, failed_stage=stage.name)
+                continue
+            timings[stage.name] = time.perf_counter() - start
+            METRICS.observe(f"pipeline.{stage.name}", timings[stage.name])
+
+            if is_last: finish(item, timings, result=value)
+            else: queues[index + 1].put((item, value, timings))
+
+    threads = []
+    for index, stage in enumerate(stages):
+        for _ in range(stage.workers):
+            thread = threading.Thread(target=worker, args=(index,), name=f"{stage.name}-worker", daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    for item in items: queues[0].put((item, item, {}))
+    for _ in range(stages[0].workers): queues[0].put(DONE)
+
+    for thread in threads: thread.join()
+    return results
+
+
+def print_summary(results, label=str):
+    succeeded = [x for x in results if x["error"] is None]
+    failed = [x for x in results if x["error"] is not None]
+
+    log.info(f"{len(succeeded)} of {len(results)} files processed successfully.")
+    for x in succeeded:
+        log.info(f"  OK      {label(x['item'])}: {x['result']}", extra={"fields": {"event": "file_done", "file": label(x["item"]), "result": x["result"]}})
+    for x in failed:
+        log.error(f"  FAILED  {label(x['item'])} at {x['stage']}: {x['error']}", extra={"fields": {"event": "file_failed", "file": label(x["item"]), "stage": x["stage"], "error": str(x["error"])}})
+
+    totals = {}
+    for x in results:
+        for stage, seconds in x["timings"].items():
+            totals[stage] = totals.get(stage, 0) + seconds
+    for stage, seconds in totals.items():
+        log.info(f"  {stage}: {seconds:.1f}s total")
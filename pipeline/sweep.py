@@ -0,0 +1,101 @@
+import pathlib
+import shutil
+from urllib.parse import urlparse
+
+from cdp_interface.upload_data import DataUpload
+from competitor_data.schemas import SCHEMAS
+from instrumentation import get_logger
+
+log = get_logger("sweep")
+
+
+def is_temp_name(name, tables=SCHEMAS):
+    """
+    Temp tables, staging folders and exported files of a load are named <table>_<file or batch name>.
+    """
+    name = pathlib.PurePosixPath(name).name.removesuffix(".parquet")
+    return any(name.startswith(f"{x}_") for x in tables)
+
+
+def table_locations(impala):
+    """
+    {table name: HDFS path of its location} for every table of the schema.
+    """
+    locations = {}
+    for name in impala.load_table_list():
+        details = impala.load_table_details(name)
+        if details and details["location"]: locations[name] = urlparse(details["location"]).path.rstrip("/")
+    return locations
+
+
+def leftovers(cdp, known):
+    """
+    Temp tables and HDFS staging folders named after a load in known (load keys), as {"temp_tables", "hdfs_folders"}.
+    A temp table only counts if it is located in its own staging folder under hdfs_root_folder, which is where
+    DataUpload creates it, and no folder is returned that holds the data of any other table.
+    """
+    root = cdp.env["hdfs_root_folder"].rstrip("/")
+    locations = table_locations(cdp.impala())
+    tables = [name for name, location in locations.items() if name in known and location == f"{root}/{name}"]
+    protected = [location for name, location in locations.items() if name not in tables]
+
+    folders = []
+    for name in cdp.list_files("."):
+        path = f"{root}/{name}"
+        if name not in known: continue
+        if any(x == path or x.startswith(f"{path}/") or path.startswith(f"{x}/") for x in protected): continue
+        folders.append(name)
+    return {"temp_tables": sorted(tables), "hdfs_folders": sorted(folders)}
+
+
+def sweep(cdp, journal, dry_run=False, force=False, include=()):
+    """
+    Removes what interrupted loads left behind, in bulk: temp tables, their HDFS staging folders and the
+    Parquet files or folders in DataUpload.PARQUET_FOLDER_PATH.
+    Temp tables and HDFS folders are only removed for loads the journal knows about, plus the names in include
+    (leftovers older than the journal, reviewed in a dry run, which lists them as "unknown"). Local exported
+    files are matched by name, only DataUpload writes into that folder.
+    Leftovers of loads the journal still expects to resume are kept, unless force: then they are removed too
+    and those loads start over on the next run (loads already past their INSERT only have the REFRESH left,
+    which doesn't need them). Nothing is touched while a run is active, unless force (for a run the journal
+    can't check, e.g. one started in another session that has not reached RUN_MAX_AGE_HOURS yet).
+    Returns {"temp_tables": [...], "hdfs_folders": [...], "local_files": [...], "unknown": [...]} with what was
+    (or would be) removed, and the temp-like names left alone because the journal doesn't know them.
+    """
+    active = journal.active_runs()
+    if active and not force:
+        log.error(f"{len(active)} run(s) still active, nothing swept (--force to sweep anyway).")
+        return None
+    if active: log.warning(f"{len(active)} run(s) still active, swept anyway.")
+
+    unfinished = journal.unfinished_loads()
+    keep = set() if force else {x["load_key"] for x in unfinished}
+    known = (journal.load_keys() | set(include)) - keep
+
+    removed = leftovers(cdp, known)
+    local_folder = pathlib.Path(DataUpload.PARQUET_FOLDER_PATH)
+    local_files = [
+        x for x in sorted(local_folder.iterdir()) if is_temp_name(x.name) and x.name.removesuffix(".parquet") not in keep
+    ] if local_folder.exists() else []
+    removed["local_files"] = [str(x) for x in local_files]
+
+    candidates = set(cdp.list_files(".")) | set(cdp.impala().load_table_list())
+    removed["unknown"] = sorted(x for x in candidates if is_temp_name(x) and x not in known and x not in keep)
+
+    for kind, items in removed.items():
+        if kind == "unknown": log.info(f"{kind}: {len(items)} not in the journal, left alone (--include to remove them)")
+        else: log.info(f"{kind}: {len(items)} {'to remove' if dry_run else 'removed'}")
+        for x in items: log.info(f"  {x}")
+    if dry_run: return removed
+
+    impala = cdp.impala()
+    for name in removed["temp_tables"]: impala.drop_table(name)
+    for name in removed["hdfs_folders"]: cdp.delete_dir(name)
+    for path in local_files:
+        if path.is_dir(): shutil.rmtree(path)
+        else: path.unlink()
+
+    for load in unfinished:
+        if force and "insert" not in load["steps"]: journal.reset_load(load["load_key"])
+    journal.prune()
+    return removed
@@ -0,0 +1,111 @@
+import json
+import pathlib
+import threading
+import time
+
+from instrumentation import get_logger
+
+log = get_logger("watcher")
+
+STATE_PATH = "pipeline/cache/scan_state.json"
+PAGE_SIZE = 500
+
+
+class FolderScanner:
+    """
+    Remembers the state of a SharePoint folder between runs so only new or changed files are returned.
+    If the folder's item count and last modified time have not moved since the last scan, nothing is listed at all.
+    Otherwise the folder is listed and files already handled with the same ETag are left out. Files that
+    failed stay pending, and the folder is listed on every scan until they went through.
+    """
+
+    def __init__(self, sp, folder_path, state_path=STATE_PATH):
+        self.sp = sp
+        self.folder_path = folder_path
+        self.state_path = pathlib.Path(state_path)
+        self._lock = threading.Lock()
+        self._listed = None
+        self._signature = None
+
+
+    def load_state(self):
+        if not self.state_path.exists(): return {}
+        return json.loads(self.state_path.read_text()).get(self.folder_path, {})
+
+
+    def save_state(self, state):
+        with self._lock:
+            all_states = json.loads(self.state_path.read_text()) if self.state_path.exists() else {}
+            all_states[self.folder_path] = state
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            self.state_path.write_text(json.dumps(all_states, indent=4))
+
+
+    def pending_files(self, full_scan=False):
+        state = self.load_state()
+        signature = self.sp.folder_signature(self.folder_path)
+        if not full_scan and not state.get("failed") and state.get("signature") == signature: return []
+
+        # taken before the listing, so a file arriving after it changes the signature on the next scan
+        self._signature = signature
+        handled = state.get("handled", {})
+        files = self.sp.files_in_folder(self.folder_path, page_size=PAGE_SIZE)
+        self._listed = {x["file_path"] for x in files}
+        pending = [x for x in files if handled.get(x["file_path"]) != x.get("etag")]
+        if not pending: self.commit([])
+        return pending
+
+
+    def commit(self, results):
+        """
+        Stores the outcome of a run: files that were processed or skipped count as handled, failed files are
+        kept so the next scan lists the folder again even if its signature did not move.
+        The signature stored is the one taken before the folder was listed. Files the run removed from the folder
+        make the next scan list it once more, but a file that arrived during the run is never taken as seen.
+        """
+        state = self.load_state()
+        handled = state.get("handled", {})
+        failed = set(state.get("failed", []))
+        # forget files that were no longer in the folder
+        if self._listed is not None:
+            handled = {path: etag for path, etag in handled.items() if path in self._listed}
+            failed &= self._listed
+        for x in results:
+            if x["error"] is None:
+                handled[x["item"]["file_path"]] = x["item"].get("etag")
+                failed.discard(x["item"]["file_path"])
+            else: failed.add(x["item"]["file_path"])
+
+        state["handled"] = handled
+        state["failed"] = sorted(failed)
+        state["signature"] = self._signature
+        state["last_run"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.save_state(state)
+
+
+def watch(scanners, process, interval=300, polls=None):
+    """
+    Polling loop: one folder signature request per folder and interval, process(files=files) only when something arrived.
+    Files from every folder go through one process call; each scanner then commits the results of its own files.
+    polls limits the number of polls (runs forever by default).
+    """
+    if isinstance(scanners, FolderScanner): scanners = [scanners]
+    poll = 0
+    while polls is None or poll < polls:
+        poll += 1
+        try:
+            pending = {scanner: scanner.pending_files() for scanner in scanners}
+            files = [x for scanner_files in pending.values() for x in scanner_files]
+            if files:
+                log.info(f"{len(files)} new or changed files in {', '.join(x.folder_path for x in scanners if pending[x])}")
+                results = process(files=files)
+                for scanner, scanner_files in pending.items():
+                    if scanner_files: scanner.commit(results_for(results, scanner_files))
+        except Exception as error:
+            log.error(error)
+        if polls is None or poll < polls: time.sleep(interval)
+
+
+def results_for(results, files):
+    paths = {x["file_path"] for x in files}
+    return [x for x in results if x["item"]["file_path"] in paths]
@@ -5,61 +5,164 @@ from office365.sharepoint.files.move_operations import MoveOperations
 import io
 import pandas as pd
 import pathlib
+import tempfile
+import threading
+import time
+
+from instrumentation import get_logger, timed, count
+
+log = get_logger("sharepoint")
 
 class SharePointFunctions():
+    """
+    The app token is acquired once per instance and renewed shortly before the expiry the token response gives.
+    A request rejected with 401 (token revoked or expired early) drops the token and is retried once with a new one.
+    ClientContext objects keep a queue of pending requests and are not safe to share between threads,
+    so every thread gets its own context on top of the shared authentication.
+    """
+    # used when the token response has no expiry
+    TOKEN_LIFETIME = 3600
+    TOKEN_REFRESH_MARGIN = 300
+    SPOOL_THRESHOLD = 20 * 1024 * 1024
+    
     def __init__(self, credentials):
         self.client_id = credentials["client_id"]
         self.client_secret = credentials["client_secret"]
         self.sharepoint_url = credentials["sharepoint_url"]
+        self._auth = None
+        self._auth_expires_at = 0
+        self._auth_generation = 0
+        self._auth_lock = threading.Lock()
+        self._local = threading.local()
         
     
+    def get_auth(self):
+        with self._auth_lock:
+            if self._auth is None or time.monotonic() > self._auth_expires_at - self.TOKEN_REFRESH_MARGIN:
+                ctx_auth = AuthenticationContext(self.sharepoint_url)
+                token = ctx_auth.acquire_token_for_app( 
+                    client_id = self.client_id, 
+                    client_secret = self.client_secret 
+                )
+                if not token: raise Exception(f"authentication error: {ctx_auth.get_last_error()}") 
+                
+                ctx = ClientContext(self.sharepoint_url, ctx_auth)
+                web = ctx.web
+                ctx.load(web)
+                ctx.execute_query()
+                
+                self._auth = ctx_auth
+                self._auth_expires_at = time.monotonic() + self.token_expires_in(ctx_auth)
+                self._auth_generation += 1
+            return self._auth, self._auth_generation
+    
+    
+    def token_expires_in(self, ctx_auth):
+        """
+        Seconds the token just acquired by ctx_auth stays valid: expires_in of the token response, or expires_on
+        (epoch seconds) when only that is given, or TOKEN_LIFETIME when the response has neither.
+        """
+        provider = getattr(ctx_auth, "_provider", None) or getattr(getattr(ctx_auth, "_authenticate", None), "__self__", None)
+        token = getattr(provider, "_cached_token", None)
+        try:
+            expires_in = getattr(token, "expiresIn", None)
+            if expires_in: return float(expires_in)
+            expires_on = getattr(token, "expiresOn", None)
+            if expires_on: return float(expires_on) - time.time()
+        except (TypeError, ValueError):
+            pass
+        return self.TOKEN_LIFETIME
+    
+    
+    def invalidate_context(self, generation=None):
+        """
+        Drops the token so the next request acquires a new one. With a generation, only if that token is still
+        the current one: threads rejected with the same token renew it once.
+        """
+        with self._auth_lock:
+            if generation is None or generation == self._auth_generation: self._auth = None
+    
+    
     def get_context(self):
-        ctx_auth = AuthenticationContext(self.sharepoint_url)
-        token = ctx_auth.acquire_token_for_app( 
-            client_id = self.client_id, 
-            client_secret = self.client_secret 
-        )
-        if not token: raise Exception(f"authentication error: {ctx_auth.get_last_error()}") 
-        
-        ctx = ClientContext(self.sharepoint_url, ctx_auth)
-        web = ctx.web
-        ctx.load(web)
-        ctx.execute_query()
-        return ctx
+        ctx_auth, generation = self.get_auth()
+        if getattr(self._local, "generation", None) != generation:
+            self._local.context = ClientContext(self.sharepoint_url, ctx_auth)
+            self._local.generation = generation
+        return self._local.context
     
     
-    def files_in_folder(self, folder_path):
+    def run(self, request):
+        """
+        Runs request(ctx) with the thread's context. A 401 response means the token was revoked or expired
+        before its time: the token is dropped and request runs once more with a new one.
+        """
         ctx = self.get_context()
-        folder = ctx.web.get_folder_by_server_relative_url(folder_path)
-        files = folder.files
-        ctx.load(files)
-        ctx.execute_query()
-        
-        file_list = []
-        for f in files:
-            file = (
-                ctx.web.get_file_by_server_relative_url(f.properties["ServerRelativeUrl"])
-                .expand(["ModifiedBy", "Author", "TimeCreated", "TimeLastModified"])
-                .get()
-                .execute_query()
+        try:
+            return request(ctx)
+        except Exception as error:
+            if getattr(getattr(error, "response", None), "status_code", None) != 401: raise
+            log.warning(f"SharePoint token rejected, renewing it: {error}")
+            self.invalidate_context(self._local.generation)
+            return request(self.get_context())
+    
+    
+    def files_in_folder(self, folder_path, page_size=None):
+        """
+        Lists the files in a folder together with their ModifiedBy/Author details in a single expanded query.
+        With page_size the listing is loaded page by page, for folders holding hundreds of files.
+        """
+        def request(ctx):
+            files = (
+                ctx.web.get_folder_by_server_relative_url(folder_path).files
+                .expand(["ModifiedBy", "Author"])
             )
-            
-            file_details = {
-                "file_path": f.properties["ServerRelativeUrl"],
-                "file_name": file.name,
-                "modified_by": str(file.modified_by),
-                "modified_by_email": file.modified_by.email,
-                "last_modified": file.time_last_modified
-            }
-            
-            file_list.append(file_details)
-            
-        return file_list
+            if page_size: files.get_all(page_size)
+            else: files.get()
+            ctx.execute_query()
+            return files
+        
+        with timed("sharepoint.files_in_folder"):
+            files = self.run(request)
+        
+        return [self.file_details(f) for f in files]
+    
+    
+    def folder_signature(self, folder_path):
+        """
+        Item count and last modified time of a folder in one small request. 
+        Used to tell whether anything was added, changed or removed since the last scan without listing the files.
+        """
+        folder = self.run(lambda ctx: (
+            ctx.web.get_folder_by_server_relative_url(folder_path)
+            .select(["ItemCount", "TimeLastModified"])
+            .get()
+            .execute_query()
+        ))
+        return {
+            "item_count": folder.properties.get("ItemCount"),
+            "last_modified": str(folder.properties.get("TimeLastModified"))
+        }
+    
+    
+    def file_details(self, file):
+        return {
+            "file_path": file.properties["ServerRelativeUrl"],
+            "file_name": file.name,
+            "modified_by": str(file.modified_by),
+            "modified_by_email": file.modified_by.email,
+            "last_modified": file.time_last_modified,
+            "etag": file.properties.get("ETag"),
+            "size": file.length
+        }
     
     
     def read_excel_file(self, file_path, sheet_name=None):
-        ctx = self.get_context()
-        response = File.open_binary(ctx, file_path)
+        def request(ctx):
+            response = File.open_binary(ctx, file_path)
+            response.raise_for_status()
+            return response
+        
+        response = self.run(request)
         bytes_file_obj = io.BytesIO()
         bytes_file_obj.write(response.content)
         bytes_file_obj.seek(0)
@@ -73,46 +176,70 @@ class SharePointFunctions():
     
     def move_file(self, file_path, destination_path):
         try:
-            ctx = self.get_context()
-            file = ctx.web.get_file_by_server_relative_url( file_path )
-
             folder_to = "Shared Documents/Archive"
 
-            file_to = file.move_to_using_path( destination_path, MoveOperations.overwrite ).execute_query()
+            file_to = self.run(lambda ctx: 
+                ctx.web.get_file_by_server_relative_url( file_path )
+                .move_to_using_path( destination_path, MoveOperations.overwrite ).execute_query()
+            )
             return True
         except Exception as e:
-            print(e)
+            log.error(e)
     
     
     def delete_file(self, file_path):
         try:
-            ctx = self.get_context()
-            file = ctx.web.get_file_by_server_relative_url( file_path )
-            file.recycle().execute_query()
+            with timed("sharepoint.delete_file"):
+                self.run(lambda ctx: ctx.web.get_file_by_server_relative_url( file_path ).recycle().execute_query())
             return True
         except Exception as e:
-            print(e)
+            log.error(e)
             
     
     def download_file(self, file_path, destination_folder):
         file_name = pathlib.Path(file_path).name
         destination_file_path = pathlib.Path(destination_folder) / file_name
         destination = str(destination_file_path)
-        print(destination)
+        log.info(destination)
         
         try:
-            ctx = self.get_context()
+            def request(ctx):
+                with open(destination, "wb") as local_file:
+                    return (
+                        ctx.web.get_file_by_server_relative_url(file_path)
+                        .download(local_file)
+                        .execute_query()
+                    )
             
-            with open(destination, "wb") as local_file:
-                file = (
-                    ctx.web.get_file_by_server_relative_url(file_path)
-                    .download(local_file)
-                    .execute_query()
-                )
+            with timed("sharepoint.download_file"):
+                file = self.run(request)
+            count("sharepoint_bytes_downloaded", destination_file_path.stat().st_size)
                 
             return destination_file_path
             
         except Exception as e:
-            print(e)
+            log.error(e)
+    
+    
+    def open_file(self, file_path, spool_threshold=None):
+        """
+        Downloads a file without saving it in the local repository.
+        Returns a file object positioned at the start: in memory, or in a temporary file once it grows past 
+        spool_threshold bytes. The temporary file is deleted as soon as the object is closed.
+        """
+        buffer = tempfile.SpooledTemporaryFile(max_size=spool_threshold or self.SPOOL_THRESHOLD)
+        try:
+            def request(ctx):
+                # a retried download starts over
+                buffer.seek(0)
+                buffer.truncate()
+                ctx.web.get_file_by_server_relative_url(file_path).download(buffer).execute_query()
             
-        
\ No newline at end of file
+            with timed("sharepoint.download_file"):
+                self.run(request)
+            count("sharepoint_bytes_downloaded", buffer.tell())
+            buffer.seek(0)
+            return buffer
+        except Exception as e:
+            buffer.close()
+            log.error(e)
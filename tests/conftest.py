@@ -0,0 +1,20 @@
+import os
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path: sys.path.append(str(ROOT))
+
+
+@pytest.fixture(scope="class")
+def repository_root():
+    """
+    Runs a test class from the repository root, where the SQL templates are read from,
+    and restores the previous working directory afterwards.
+    """
+    previous = os.getcwd()
+    os.chdir(ROOT)
+    yield ROOT
+    os.chdir(previous)
@@ -0,0 +1,50 @@
+import os
+import pathlib
+import tempfile
+import unittest
+from competitor_data.extraction_pool import ExtractionPool
+from instrumentation import configure_logging
+
+
+def print_to_stderr(source):
+    # what the JVM does with a pdfbox warning: a write to fd 2, not through Python logging
+    os.write(2, b"WARNING: pdfbox font fallback\n")
+    return source.read()
+
+
+def read_pdf(source):
+    return source.read()
+
+
+class TestExtractionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.tabula_log = pathlib.Path(self.folder.name) / "tabula.log"
+
+    def tearDown(self):
+        configure_logging(log_file=None, tabula_log_file=None)
+        self.folder.cleanup()
+
+    def test_worker_stderr_goes_to_the_tabula_log(self):
+        configure_logging(log_file=None, tabula_log_file=self.tabula_log)
+        with ExtractionPool(max_workers=1) as pool:
+            self.assertEqual(pool.extract(print_to_stderr, b"%PDF"), b"%PDF")
+        self.assertIn("pdfbox font fallback", self.tabula_log.read_text())
+
+    def test_extract_all_sends_file_objects_as_bytes(self):
+        spooled = tempfile.SpooledTemporaryFile()
+        spooled.write(b"%PDF spooled")
+        sources = ["missing.pdf", spooled, b"%PDF bytes"]
+        with ExtractionPool(max_workers=2) as pool:
+            results = pool.extract_all(read_pdf, sources)
+        self.assertEqual([x[0] for x in results], sources)
+        self.assertEqual([x[1] for x in results], [None, b"%PDF spooled", b"%PDF bytes"])
+        self.assertIsInstance(results[0][2], AttributeError)
+        # left at the start for whoever reads it next
+        self.assertEqual(spooled.tell(), 0)
+        spooled.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
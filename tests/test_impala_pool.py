@@ -0,0 +1,77 @@
+import decimal
+import unittest
+from unittest import mock
+import pyarrow as pa
+from cdp_interface import impala
+from cdp_interface.impala import Impala, ImpalaConnectionPool
+
+
+class StubCursor:
+
+    description = [("a", "INT", None, None, None, None, None)]
+
+    def __init__(self):
+        self.rows = [[(1,), (2,)], [(3,)]]
+        self.closed = False
+
+    def execute(self, query):
+        pass
+
+    def fetchmany(self, size):
+        return self.rows.pop(0) if self.rows else []
+
+    def ping(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.cursors = []
+        def open_session(env):
+            self.cursors.append(StubCursor())
+            return mock.Mock(), self.cursors[-1]
+        patcher = mock.patch.object(impala, "open_session", open_session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = ImpalaConnectionPool({"impala_pool_size": 1})
+        self.impala = Impala({}, self.pool)
+
+    def test_session_is_returned_after_a_full_read(self):
+        self.assertEqual(sum(x.num_rows for x in self.impala.select_batches("SELECT a FROM t")), 3)
+        self.assertEqual(len(self.pool._idle), 1)
+
+    def test_abandoned_generator_releases_its_session(self):
+        batches = self.impala.select_batches("SELECT a FROM t")
+        next(batches)
+        batches.close()
+        # the half read session is closed, not pooled, and its slot is free again
+        self.assertTrue(self.cursors[0].closed)
+        self.assertEqual(self.pool._idle, [])
+        self.assertTrue(self.pool._slots.acquire(blocking=False))
+
+
+class TestDecimalColumns(unittest.TestCase):
+
+    def test_decimal_column_keeps_its_rows(self):
+        cursor = StubCursor()
+        # impyla: a bare DECIMAL type code, precision and scale in the description entry
+        cursor.description = [("price", "DECIMAL", None, None, 10, 2, None)]
+        cursor.rows = [[(decimal.Decimal("12.50"),), (decimal.Decimal("3.25"),)]]
+        with mock.patch.object(impala, "open_session", return_value=(mock.Mock(), cursor)):
+            result = Impala({}).select("SELECT price FROM t")
+        self.assertEqual(result["price"].tolist(), [decimal.Decimal("12.50"), decimal.Decimal("3.25")])
+
+    def test_conversion_failure_raises(self):
+        cursor = StubCursor()
+        cursor.rows = [[("not a number",)]]
+        with mock.patch.object(impala, "open_session", return_value=(mock.Mock(), cursor)):
+            with self.assertRaises(pa.ArrowException):
+                Impala({}).select("SELECT a FROM t")
+
+
+if __name__ == "__main__":
+    unittest.main()
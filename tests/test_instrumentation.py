@@ -0,0 +1,67 @@
+import pathlib
+import json
+import logging
+import tempfile
+import unittest
+from instrumentation import METRICS, timed, count, get_logger, configure_logging
+from instrumentation.metrics import percentile
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        METRICS.reset()
+
+    def test_timed_decorator_and_block(self):
+        @timed("test.double")
+        def double(x): return x * 2
+
+        self.assertEqual([double(x) for x in range(3)], [0, 2, 4])
+        with self.assertRaises(ValueError):
+            with timed("test.block", file="a.pdf"): raise ValueError()
+
+        stages = METRICS.summary()["stages"]
+        self.assertEqual(stages["test.double"]["count"], 3)
+        self.assertEqual(stages["test.double"]["errors"], 0)
+        self.assertEqual(stages["test.block"]["errors"], 1)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 51)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_prometheus_file(self):
+        with timed("hdfs.upload_file"): pass
+        count("rows_loaded", 120)
+        with tempfile.TemporaryDirectory() as folder:
+            path = pathlib.Path(folder) / "ingest.prom"
+            METRICS.write_prometheus(path)
+            text = path.read_text()
+        self.assertIn('ingest_stage_seconds_count{stage="hdfs.upload_file"} 1', text)
+        self.assertIn("ingest_rows_loaded_total 120", text)
+
+
+class TestLogging(unittest.TestCase):
+
+    def tearDown(self):
+        configure_logging(log_file=None, tabula_log_file=None)
+
+    def test_configure_logging_twice_writes_each_line_once(self):
+        with tempfile.TemporaryDirectory() as folder:
+            log_file = pathlib.Path(folder) / "ingest.log"
+            configure_logging(log_file, pathlib.Path(folder) / "tabula.log")
+            configure_logging(log_file, pathlib.Path(folder) / "tabula.log")
+            get_logger("test").info("once")
+            logging.getLogger("tabula").info("once")
+
+            lines = log_file.read_text().splitlines()
+            configure_logging(log_file=None, tabula_log_file=None)
+        self.assertEqual([json.loads(x)["message"] for x in lines], ["once"])
+        tabula_logger = logging.getLogger("tabula")
+        self.assertEqual([x for x in tabula_logger.handlers if getattr(x, "configured_file", False)], [])
+        self.assertTrue(tabula_logger.propagate)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import pathlib
+import tempfile
+import unittest
+import pytest
+from unittest import mock
+import environments as env
+from cdp_interface import CDPInterface
+from cdp_interface.upload_data import DataUpload
+from competitor_data.schemas import COMP_PRICE_GRID
+from pipeline.journal import RunJournal
+from pipeline.sweep import sweep
+from test_local_backend import price_list
+
+FILE = {"file_name": "camp_hill.pdf", "file_path": "/sites/retailpricing/camp_hill.pdf"}
+
+
+# the SQL templates are read relative to the repository root
+@pytest.mark.usefixtures("repository_root")
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.journal = RunJournal(pathlib.Path(self.folder.name) / "journal.sqlite")
+        self.cdp = CDPInterface({**env.local, "local_root": self.folder.name}, None)
+        self.cdp.execute(COMP_PRICE_GRID.ddl(
+            "comp_price_grid",
+            partition_columns=["plant_location", "date_inserted"],
+            location="@hdfs_root_folder/comp_price_grid"
+        ))
+        self.parquet_folder = mock.patch.object(DataUpload, "PARQUET_FOLDER_PATH", str(pathlib.Path(self.folder.name) / "exported"))
+        self.parquet_folder.start()
+
+    def tearDown(self):
+        self.parquet_folder.stop()
+        self.cdp.close()
+        self.folder.cleanup()
+
+    def count_rows(self):
+        return int(self.cdp.select("SELECT count(*) AS n FROM @schema.comp_price_grid")["n"].iloc[0])
+
+    def table_names(self):
+        return self.cdp.select("SHOW TABLES IN @schema")["name"].tolist()
+
+    def test_stage_never_moves_back(self):
+        self.journal.record(FILE, "hash1", "uploading", table_name="comp_price_grid", load_name="camp_hill")
+        self.journal.record(FILE, "hash1", "downloaded")
+        entry = self.journal.file("hash1")
+        self.assertEqual(entry["stage"], "uploading")
+        self.assertEqual(entry["load_name"], "camp_hill")
+
+    def test_load_interrupted_after_insert_resumes_at_refresh(self):
+        checkpoint = self.journal.checkpoint("comp_price_grid", "camp_hill")
+        with mock.patch.object(DataUpload, "main_table_refresh_metadata", return_value=False):
+            self.assertFalse(self.cdp.upload_data(price_list("CAMP HILL", "2024-10-07"), "comp_price_grid", "camp_hill", direct=False, checkpoint=checkpoint))
+        self.assertEqual(self.journal.load("comp_price_grid", "camp_hill")["steps"], ["export", "hdfs", "temp_table", "insert"])
+
+        # next run: a new checkpoint from the journal, no data
+        checkpoint = self.journal.checkpoint("comp_price_grid", "camp_hill")
+        self.assertTrue(self.cdp.upload_data(None, "comp_price_grid", "camp_hill", direct=False, checkpoint=checkpoint))
+        self.assertEqual(self.count_rows(), 3)
+        self.assertEqual(self.table_names(), ["comp_price_grid"])
+        self.assertEqual(self.journal.unfinished_loads(), [])
+
+    def test_load_of_another_file_under_the_same_name_starts_over(self):
+        checkpoint = self.journal.checkpoint("comp_price_grid", "camp_hill", "hash1")
+        with mock.patch.object(DataUpload, "main_table_refresh_metadata", return_value=False):
+            self.cdp.upload_data(price_list("CAMP HILL", "2024-10-07"), "comp_price_grid", "camp_hill", direct=False, checkpoint=checkpoint)
+
+        # a corrected PDF with the same name: its rows are loaded, not skipped as already inserted
+        checkpoint = self.journal.checkpoint("comp_price_grid", "camp_hill", "hash2")
+        self.assertTrue(checkpoint.restarted)
+        self.assertTrue(self.cdp.upload_data(price_list("CAMP HILL", "2024-10-08", rows=5), "comp_price_grid", "camp_hill", direct=False, checkpoint=checkpoint))
+        result = self.cdp.select("SELECT date_inserted, count(*) AS n FROM @schema.comp_price_grid GROUP BY date_inserted ORDER BY date_inserted")
+        self.assertEqual(result["n"].tolist(), [3, 5])
+        self.assertEqual(self.table_names(), ["comp_price_grid"])
+
+    def test_sweep_keeps_leftovers_of_unfinished_loads(self):
+        for name in ("orphan", "pending"):
+            checkpoint = self.journal.checkpoint("comp_price_grid", name)
+            with mock.patch.object(DataUpload, "main_table_data_upload", return_value=False):
+                self.cdp.upload_data(price_list("CAMP HILL", "2024-10-07"), "comp_price_grid", name, direct=False, checkpoint=checkpoint)
+        self.journal.finish_load("comp_price_grid_orphan")
+
+        removed = sweep(self.cdp, self.journal)
+        self.assertEqual(removed["temp_tables"], ["comp_price_grid_orphan"])
+        self.assertEqual([pathlib.Path(x).name for x in removed["local_files"]], ["comp_price_grid_orphan.parquet"])
+        self.assertEqual(sorted(self.table_names()), ["comp_price_grid", "comp_price_grid_pending"])
+
+        removed = sweep(self.cdp, self.journal, force=True)
+        self.assertEqual(removed["temp_tables"], ["comp_price_grid_pending"])
+        self.assertEqual(self.table_names(), ["comp_price_grid"])
+        self.assertEqual(self.journal.load("comp_price_grid", "pending")["steps"], [])
+
+    def test_sweep_leaves_tables_the_journal_does_not_know(self):
+        # a real table that happens to share the temp table prefix, and a load from before the journal
+        self.cdp.execute(COMP_PRICE_GRID.ddl("comp_price_grid_history", location="@hdfs_root_folder/comp_price_grid_history"))
+        with mock.patch.object(DataUpload, "main_table_data_upload", return_value=False):
+            self.cdp.upload_data(price_list("CAMP HILL", "2024-10-07"), "comp_price_grid", "old", direct=False)
+
+        removed = sweep(self.cdp, self.journal)
+        self.assertEqual(removed["temp_tables"] + removed["hdfs_folders"], [])
+        self.assertEqual(removed["unknown"], ["comp_price_grid_history", "comp_price_grid_old"])
+
+        removed = sweep(self.cdp, self.journal, include=["comp_price_grid_old"])
+        self.assertEqual(removed["temp_tables"], ["comp_price_grid_old"])
+        self.assertEqual(removed["hdfs_folders"], ["comp_price_grid_old"])
+        self.assertEqual(sorted(self.table_names()), ["comp_price_grid", "comp_price_grid_history"])
+        self.assertIn("comp_price_grid_history", self.cdp.list_files("."))
+
+    def test_sweep_refuses_while_a_run_is_active(self):
+        self.journal.start_run()
+        self.assertIsNone(sweep(self.cdp, self.journal))
+        self.assertIsNotNone(sweep(self.cdp, self.journal, force=True))
+
+    def test_crashed_run_on_another_host_expires(self):
+        run_id = self.journal.start_run()
+        self.journal.write("UPDATE runs SET host = 'other-session', started_at = '2000-01-01T00:00:00' WHERE run_id = ?", (run_id,))
+        self.assertEqual(self.journal.active_runs(), [])
+        self.assertIsNotNone(sweep(self.cdp, self.journal))
+        self.assertEqual(self.journal.query("SELECT * FROM runs"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
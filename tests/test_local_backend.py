@@ -0,0 +1,101 @@
+import pathlib
+import tempfile
+import unittest
+import pytest
+from unittest import mock
+import pandas as pd
+import environments as env
+from cdp_interface import CDPInterface
+from cdp_interface.impala import Impala
+from cdp_interface.local_backend import translate_sql
+from competitor_data.schemas import COMP_PRICE_GRID
+
+PRICE_COLUMNS = ["price_change", "single_unit_list_price", "full_pallet_list_price", "pkg_bulk_discount", "best_net_list_price"]
+
+
+def price_list(location, effective_date, rows=3):
+    data = pd.DataFrame({name: [f"{name}_{i}" for i in range(rows)] for name in COMP_PRICE_GRID.names})
+    for name in PRICE_COLUMNS: data[name] = [float(i) for i in range(rows)]
+    data["plant_location"] = location
+    data["date_inserted"] = effective_date
+    return data
+
+
+# the SQL templates are read relative to the repository root
+@pytest.mark.usefixtures("repository_root")
+class TestLocalBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.env = {**env.local, "local_root": self.folder.name}
+        self.cdp = CDPInterface(self.env, None)
+        self.cdp.execute(COMP_PRICE_GRID.ddl(
+            "comp_price_grid",
+            partition_columns=["plant_location", "date_inserted"],
+            location="@hdfs_root_folder/comp_price_grid"
+        ))
+
+    def tearDown(self):
+        self.cdp.close()
+        self.folder.cleanup()
+
+    def count_rows(self, cdp=None):
+        result = (cdp or self.cdp).select("SELECT count(*) AS n FROM @schema.comp_price_grid")
+        return int(result["n"].iloc[0])
+
+    def test_temp_table_and_direct_loads(self):
+        self.assertTrue(self.cdp.upload_data(price_list("STATESVILLE", "2024-10-07"), "comp_price_grid", "f1", direct=False, schema=COMP_PRICE_GRID))
+        self.assertTrue(self.cdp.upload_data(price_list("DENVER", "2024-10-07"), "comp_price_grid", "f2", direct=True, schema=COMP_PRICE_GRID))
+        self.assertEqual(self.count_rows(), 6)
+        # temp tables are dropped together with their folder
+        self.assertEqual(self.cdp.select("SHOW TABLES IN @schema")["name"].tolist(), ["comp_price_grid"])
+
+    def test_temp_table_load_writes_the_partitions_of_the_main_table(self):
+        execute = mock.Mock(side_effect=Impala.execute, autospec=True)
+        with mock.patch.object(Impala, "execute", lambda *args: execute(*args)):
+            for partitioned in (False, True):
+                self.cdp.env["parquet_partitioned"] = str(partitioned).lower()
+                self.assertTrue(self.cdp.upload_data(price_list("STATESVILLE", f"2024-10-0{int(partitioned) + 1}"), "comp_price_grid", f"f{partitioned}", direct=False, schema=COMP_PRICE_GRID))
+        inserts = [x.args[1] for x in execute.call_args_list if x.args[1].lstrip().startswith("INSERT")]
+        self.assertEqual(len(inserts), 2)
+        self.assertTrue(all("PARTITION (plant_location, date_inserted)" in x for x in inserts))
+        table_folder = pathlib.Path(self.folder.name) / self.env["hdfs_root_folder"].strip("/") / "comp_price_grid"
+        partitions = sorted(x.relative_to(table_folder).as_posix() for x in table_folder.glob("*/*") if x.is_dir())
+        self.assertEqual(partitions, ["plant_location=STATESVILLE/date_inserted=2024-10-01", "plant_location=STATESVILLE/date_inserted=2024-10-02"])
+        self.assertEqual(self.count_rows(), 6)
+
+    def test_direct_load_matches_columns_by_name(self):
+        data = price_list("DENVER", "2024-10-07")
+        self.assertTrue(self.cdp.upload_data(data[data.columns[::-1]], "comp_price_grid", "f1", direct=True))
+        result = self.cdp.select("SELECT product_number, best_net_list_price FROM @schema.comp_price_grid ORDER BY best_net_list_price")
+        self.assertEqual(result["product_number"].tolist(), data["product_number"].tolist())
+
+        self.assertFalse(self.cdp.upload_data(data.assign(extra=1), "comp_price_grid", "f2", direct=True))
+        self.assertFalse(self.cdp.upload_data(data.drop(columns="species"), "comp_price_grid", "f3", direct=True))
+        self.assertEqual(self.count_rows(), 3)
+
+    def test_price_list_query(self):
+        location = 'O\'BRIEN "NORTH"'
+        self.cdp.upload_data(price_list(location, "2024-10-07"), "comp_price_grid", "f1", schema=COMP_PRICE_GRID)
+        query = pathlib.Path("competitor_data/sql_queries/price_list.sql").read_text()
+        query = query.replace("@columns", COMP_PRICE_GRID.select_list())
+        query = query.replace("@location", location.replace('"', '\\"'))
+        query = query.replace("@effective_date", "2024-10-07")
+
+        result = self.cdp.select(query, schema=COMP_PRICE_GRID.arrow_schema())
+        self.assertEqual(result.shape, (3, len(COMP_PRICE_GRID.names)))
+        self.assertEqual(result["best_net_list_price"].tolist(), [0.0, 1.0, 2.0])
+
+    def test_metastore_is_kept_between_runs(self):
+        self.cdp.upload_data(price_list("STATESVILLE", "2024-10-07"), "comp_price_grid", "f1", schema=COMP_PRICE_GRID)
+        with CDPInterface(self.env, None) as cdp:
+            self.assertEqual(self.count_rows(cdp), 3)
+            details = cdp.impala().load_table_details("comp_price_grid")
+        self.assertEqual(details["partition_columns"], ["plant_location", "date_inserted"])
+
+    def test_translate_sql(self):
+        self.assertEqual(translate_sql('SELECT `a` FROM t WHERE b = "x\\"y" AND c = \'it\\\'s\''), "SELECT \"a\" FROM t WHERE b = 'x\"y' AND c = 'it''s'")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import pathlib
+import tempfile
+import unittest
+from pipeline.manifest import FileManifest
+
+FILE = {"file_name": "camp_hill.pdf", "file_path": "/sites/retailpricing/camp_hill.pdf", "etag": "1", "size": 100, "last_modified": "2024-10-07T08:00:00Z"}
+
+
+class TestFileManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.manifest = FileManifest(pathlib.Path(self.folder.name) / "manifest.sqlite")
+        self.manifest.record(FILE, "hash1", "1 rows uploaded")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_known_by_etag(self):
+        self.assertTrue(self.manifest.is_known_file(FILE))
+        # same size and timestamp, but another ETag: a different file
+        self.assertFalse(self.manifest.is_known_file({**FILE, "etag": "2"}))
+
+    def test_known_by_path_size_and_timestamp_without_etag(self):
+        self.assertTrue(self.manifest.is_known_file({**FILE, "etag": None}))
+        self.assertFalse(self.manifest.is_known_file({**FILE, "etag": None, "file_path": "/sites/retailpricing/denver.pdf"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import pathlib
+import re
+import unittest
+import numpy as np
+import pandas as pd
+import competitor_data.purina_file as pur
+from tools.benchmark import raw_tables
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+PRICE_LISTS = sorted((ROOT / "tests/support_files/price_lists").glob("*.parquet"))
+
+
+# Row by row implementations the vectorized versions replaced, kept as the reference output.
+
+def legacy_find_unit_weight(df):
+    for index, row in df.iterrows():
+        if not re.search("LB", row["unit_weight"]):
+            search_result = re.findall(r"\d*\s*LB", str(row["product_name"]))
+            if len(search_result) > 0:
+                df.at[index, "unit_weight"] = search_result[0]
+    return df
+
+
+def legacy_correct_negative_value_in_price_list(df):
+    for col in df.columns[7:12]:
+        df[col] = df[col].apply(pur.correct_negative_value)
+    return df
+
+
+def legacy_add_species_column(df):
+    species = None
+    df["species"] = None
+    for index, row in df.iterrows():
+        if re.match(r"\d", row.iloc[0]) is None:
+            species = str(row.iloc[0]).replace(",", "").upper()
+            df = df.drop(index, axis=0)
+        else:
+            df.loc[index, "species"] = species
+
+    df = df.reset_index(drop=True)
+    return df
+
+
+def transform(df, add_species_column, correct_negative_value_in_price_list, find_unit_weight):
+    df = add_species_column(df)
+    df = correct_negative_value_in_price_list(df)
+    df = find_unit_weight(df)
+    return df
+
+
+class TestPurinaTransforms(unittest.TestCase):
+
+    def test_fixtures_exist(self):
+        self.assertTrue(len(PRICE_LISTS) > 0)
+
+    def test_vectorized_transforms_match_legacy_output(self):
+        for file_path in PRICE_LISTS:
+            with self.subTest(file=file_path.name):
+                raw = raw_tables(pd.read_parquet(file_path))
+
+                expected = transform(
+                    raw.copy(),
+                    legacy_add_species_column,
+                    legacy_correct_negative_value_in_price_list,
+                    legacy_find_unit_weight
+                )
+                result = transform(
+                    raw.copy(),
+                    pur.add_species_column,
+                    pur.correct_negative_value_in_price_list,
+                    pur.find_unit_weight
+                )
+
+                pd.testing.assert_frame_equal(result, expected, check_exact=True)
+
+    def test_unit_weight_taken_from_product_name(self):
+        df = pd.DataFrame({
+            "product_name": ["AR BLOCK 200LB PLASTIC", "HORSE FEED", "MINERAL 50 LB BAG"],
+            "unit_weight": ["Each", "Bale", "50 LB"]
+        }, dtype=object)
+        result = pur.find_unit_weight(df.copy())
+        self.assertEqual(result["unit_weight"].tolist(), ["200LB", "Bale", "50 LB"])
+
+    def test_negative_values(self):
+        result = pur.correct_negative_values(pd.Series(["1.20-", "3.5", "0.00-", "-2"], dtype=object))
+        self.assertEqual(result.tolist(), [-1.2, 3.5, -0.0, -2.0])
+
+    def test_species_header_rows_are_dropped(self):
+        df = pd.DataFrame([
+            ["CATTLE, MINERAL", np.nan],
+            ["0001", "A"],
+            ["0002", "B"],
+            ["Horse", np.nan],
+            ["0003", "C"]
+        ], columns=["product_number", "formula_code"], dtype=object)
+        result = pur.add_species_column(df)
+        self.assertEqual(result["product_number"].tolist(), ["0001", "0002", "0003"])
+        self.assertEqual(result["species"].tolist(), ["CATTLE MINERAL", "CATTLE MINERAL", "HORSE"])
+
+
+if __name__ == "__main__":
+    unittest.main()
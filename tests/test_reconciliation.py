@@ -0,0 +1,97 @@
+import pathlib
+import tempfile
+import threading
+import time
+import unittest
+import pandas as pd
+import pytest
+import exe_process_pdf_files as exe
+from competitor_data.registry import ParserFormat
+from competitor_data.schemas import COMP_PRICE_GRID
+from pipeline.journal import RunJournal
+from pipeline.manifest import FileManifest
+from pipeline.reconciliation import ReconciliationCache
+from test_local_backend import price_list
+
+
+class StubCDP:
+    """
+    Empty comp_price_grid; uploads are slow, so parallel uploads overlap.
+    """
+
+    def __init__(self):
+        self.uploaded = []
+        self.load_names = []
+        self.restarted = []
+
+    def select(self, query, schema=None):
+        return pd.DataFrame(columns=COMP_PRICE_GRID.names)
+
+    def upload_data(self, data, table_name, file_name, schema=None, checkpoint=None):
+        self.load_names.append(file_name)
+        self.restarted.append(checkpoint.restarted)
+        time.sleep(0.1)
+        self.uploaded.append(data)
+        return True
+
+
+class StubSharePoint:
+
+    def delete_file(self, file_path):
+        return True
+
+
+# the SQL templates are read relative to the repository root
+@pytest.mark.usefixtures("repository_root")
+class TestReconciliation(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        folder = pathlib.Path(self.folder.name)
+        self.cdp = StubCDP()
+        self.cache = ReconciliationCache(self.cdp, folder / "keys.sqlite")
+        self.manifest = FileManifest(folder / "manifest.sqlite")
+        self.journal = RunJournal(folder / "journal.sqlite")
+        self.parser = ParserFormat("test_format", lambda x: True, None, COMP_PRICE_GRID, reconcile=True)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def job(self, name, location="CAMP HILL", file_name=None):
+        data = price_list(location, "2024-10-07").assign(source="pdf")
+        file_name = file_name or name
+        return {
+            "file": {"file_name": f"{file_name}.pdf", "file_path": f"/sites/retailpricing/{name}/{file_name}.pdf"},
+            "file_name": file_name,
+            "load_name": exe.load_name(file_name, name),
+            "content_hash": name,
+            "parser": self.parser,
+            "journal": None,
+            "data": {"price_list": data, "location": location, "effective_date": "2024-10-07"}
+        }
+
+    def upload_in_parallel(self, jobs):
+        statuses = []
+        threads = [
+            threading.Thread(target=lambda x: statuses.append(exe.upload_pending_file(self.cdp, self.cache, self.manifest, StubSharePoint(), self.journal, x)), args=(x,))
+            for x in jobs
+        ]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        return statuses
+
+    def test_parallel_uploads_of_the_same_price_list_insert_rows_once(self):
+        statuses = self.upload_in_parallel([self.job("first"), self.job("second")])
+        self.assertEqual(sum(x.shape[0] for x in self.cdp.uploaded), 3)
+        self.assertEqual(sorted(statuses), ["3 rows uploaded", "data already in database"])
+
+    def test_files_with_the_same_normalized_name_load_apart(self):
+        statuses = self.upload_in_parallel([self.job("hash1111aaaa", "CAMP HILL", "price_list"), self.job("hash2222bbbb", "DENVER", "price_list")])
+        self.assertEqual(statuses, ["3 rows uploaded", "3 rows uploaded"])
+        self.assertEqual(len(set(self.cdp.load_names)), 2)
+        # neither load took over the checkpoint of the other
+        self.assertEqual(self.cdp.restarted, [False, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import pathlib
+import unittest
+import competitor_data.registry as registry
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+HORIZONTAL_FILE = ROOT / "2024.10.07 Statesville.pdf"
+
+
+class TestRegistry(unittest.TestCase):
+
+    @unittest.skipUnless(registry.HORIZONTAL_AVAILABLE, "horizontal parser not in the tree")
+    def test_horizontal_file_is_detected(self):
+        parser = registry.detect_format(str(HORIZONTAL_FILE))
+        self.assertEqual(parser.name, "purina_horizontal")
+        self.assertEqual(parser.schema.table_name, "comp_price_horizontal_files")
+
+    def test_file_object_is_rewound(self):
+        with open(HORIZONTAL_FILE, "rb") as pdf:
+            registry.detect_format(pdf)
+            self.assertEqual(pdf.tell(), 0)
+
+    def test_portrait_purina_file_is_vertical(self):
+        fingerprint = {"pages": 2, "landscape": False, "text": "PURINA ANIMAL NUTRITION LLC PRICE LIST"}
+        parser = next(x for x in registry.FORMATS if x.matches(fingerprint))
+        self.assertEqual(parser.name, "purina_vertical")
+        self.assertTrue(parser.reconcile)
+
+    def test_horizontal_file_is_never_vertical(self):
+        parser = registry.detect_format(str(HORIZONTAL_FILE))
+        self.assertTrue(parser is None or parser.name == "purina_horizontal")
+        fingerprint = {"pages": 2, "landscape": False, "text": "PURINA ANIMAL NUTRITION LLC STOCKING STATUS"}
+        self.assertNotIn("purina_vertical", [x.name for x in registry.FORMATS if x.matches(fingerprint)])
+
+    def test_unknown_file(self):
+        self.assertIsNone(registry.detect_format(b"not a pdf"))
+
+
+if __name__ == "__main__":
+    unittest.main()
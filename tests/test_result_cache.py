@@ -0,0 +1,74 @@
+import pathlib
+import os
+import tempfile
+import time
+import unittest
+import pandas as pd
+from competitor_data.registry import ParserFormat
+from competitor_data.result_cache import ResultCache
+from competitor_data.schemas import COMP_PRICE_GRID
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+PRICE_LIST = ROOT / "tests/support_files/price_lists/comp_price_grid_2024.10.07_camp_hill.parquet"
+
+
+class CountingParser(ParserFormat):
+
+    def __init__(self, version="1"):
+        super().__init__("test_format", lambda x: True, self.read, COMP_PRICE_GRID, version=version)
+        self.calls = 0
+
+    def read(self, source):
+        self.calls += 1
+        price_list = pd.read_parquet(PRICE_LIST).astype(object)
+        return {
+            "price_list": price_list,
+            "location": "CAMP HILL PA",
+            "effective_date": "2024-10-07",
+            "diagnostics": [{"table": 0, "rows": price_list.shape[0], "kept": True, "reason": None}]
+        }
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_second_extraction_is_served_from_cache(self):
+        parser = CountingParser()
+        first = self.cache.extract(parser, b"pdf", "hash1")
+        second = self.cache.extract(parser, b"pdf", "hash1")
+
+        self.assertEqual(parser.calls, 1)
+        self.assertEqual(second["location"], "CAMP HILL PA")
+        self.assertEqual(second["diagnostics"], first["diagnostics"])
+        pd.testing.assert_frame_equal(COMP_PRICE_GRID.cast(second["price_list"]), COMP_PRICE_GRID.cast(first["price_list"]))
+
+    def test_new_parser_version_extracts_again(self):
+        self.cache.extract(CountingParser("1"), b"pdf", "hash1")
+        parser = CountingParser("2")
+        self.cache.extract(parser, b"pdf", "hash1")
+        self.assertEqual(parser.calls, 1)
+
+    def test_eviction(self):
+        parser = CountingParser()
+        for file_hash in ("old", "a", "b"): self.cache.extract(parser, b"pdf", file_hash)
+        old_entry = self.cache.entry_path("old", parser)
+        expired = time.time() - self.cache.max_age - 1
+        os.utime(old_entry, (expired, expired))
+
+        self.cache.max_size = self.cache.entry_path("b", parser).stat().st_size
+        self.cache.evict()
+
+        self.assertFalse(old_entry.exists())
+        self.assertFalse(self.cache.entry_path("a", parser).exists())
+        self.assertTrue(self.cache.entry_path("b", parser).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
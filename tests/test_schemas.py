@@ -0,0 +1,51 @@
+import pathlib
+import unittest
+import numpy as np
+import pandas as pd
+from competitor_data.schemas import COMP_PRICE_GRID, COMP_PRICE_HORIZONTAL_FILES
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+PRICE_LISTS = sorted((ROOT / "tests/support_files/price_lists").glob("*.parquet"))
+
+
+class TestSchemas(unittest.TestCase):
+
+    def test_ddl_matches_temp_table_file(self):
+        expected = (ROOT / "cdp_interface/sql_queries/temp_table.sql").read_text()
+        self.assertEqual(COMP_PRICE_GRID.ddl(), expected)
+
+    def test_partitioned_ddl_matches_temp_table_file(self):
+        expected = (ROOT / "cdp_interface/sql_queries/temp_table_partitioned.sql").read_text()
+        ddl = COMP_PRICE_GRID.ddl(partition_columns=["plant_location", "date_inserted"])
+        self.assertEqual(ddl, expected)
+
+    def test_cast_matches_fixture_types(self):
+        price_list = pd.read_parquet(PRICE_LISTS[0])
+        raw = price_list.astype(object)
+        raw["source"] = "pdf"
+
+        result = COMP_PRICE_GRID.cast(raw)
+        self.assertEqual(result.columns.tolist(), COMP_PRICE_GRID.names)
+        self.assertEqual({col: str(dtype) for col, dtype in result.dtypes.items()}, COMP_PRICE_GRID.dtypes())
+        pd.testing.assert_frame_equal(result, price_list.astype(COMP_PRICE_GRID.dtypes()))
+
+    def test_cast_leaves_typed_frame_alone(self):
+        price_list = COMP_PRICE_GRID.cast(pd.read_parquet(PRICE_LISTS[0]))
+        result = COMP_PRICE_GRID.cast(price_list)
+        for col, dtype in COMP_PRICE_GRID.dtypes().items():
+            if dtype != "float64": continue
+            self.assertTrue(np.shares_memory(result[col].to_numpy(), price_list[col].to_numpy()))
+
+    def test_cast_coerces_numeric_text(self):
+        df = pd.DataFrame({name: ["x"] for name in COMP_PRICE_HORIZONTAL_FILES.names + ["ref_col"]}, dtype=object)
+        df["list_price"] = ["12.5"]
+        result = COMP_PRICE_HORIZONTAL_FILES.cast(df, coerce_numeric=True)
+        self.assertNotIn("ref_col", result.columns)
+        self.assertEqual(result["list_price"].tolist(), [12.5])
+        self.assertTrue(pd.isna(result["pallet_quantity"].iloc[0]))
+        self.assertEqual(result["species"].tolist(), ["x"])
+
+
+if __name__ == "__main__":
+    unittest.main()
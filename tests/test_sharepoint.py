@@ -0,0 +1,76 @@
+import time
+import unittest
+from unittest import mock
+import requests
+from office365.runtime.auth.token_response import TokenResponse
+from sharepoint_interface import sharepoint
+from sharepoint_interface.sharepoint import SharePointFunctions
+
+CREDENTIALS = {"client_id": "id", "client_secret": "secret", "sharepoint_url": "https://example.sharepoint.com/sites/retailpricing"}
+
+
+class StubProvider:
+
+    def __init__(self, token):
+        self._cached_token = token
+
+    def authenticate_request(self, request):
+        pass
+
+
+class StubAuthenticationContext:
+    """
+    AuthenticationContext whose app token response is set by the test.
+    """
+    token = None
+    acquired = 0
+
+    def __init__(self, url):
+        self._authenticate = None
+
+    def acquire_token_for_app(self, client_id, client_secret):
+        StubAuthenticationContext.acquired += 1
+        self._authenticate = StubProvider(self.token).authenticate_request
+        return self
+
+
+def unauthorized():
+    response = requests.Response()
+    response.status_code = 401
+    return requests.HTTPError("401 Client Error: Unauthorized", response=response)
+
+
+class TestSharePointAuth(unittest.TestCase):
+
+    def setUp(self):
+        StubAuthenticationContext.acquired = 0
+        for name, stub in (("AuthenticationContext", StubAuthenticationContext), ("ClientContext", mock.MagicMock())):
+            patcher = mock.patch.object(sharepoint, name, stub)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.sp = SharePointFunctions(CREDENTIALS)
+
+    def test_token_is_renewed_at_the_expiry_of_the_response(self):
+        StubAuthenticationContext.token = TokenResponse.from_json({"access_token": "a", "token_type": "Bearer", "expires_in": "900"})
+        self.sp.get_auth()
+        self.assertAlmostEqual(self.sp._auth_expires_at - time.monotonic(), 900, delta=5)
+
+        StubAuthenticationContext.token = TokenResponse.from_json({"access_token": "a", "token_type": "Bearer", "expires_on": str(int(time.time()) + 600)})
+        self.sp.invalidate_context()
+        self.sp.get_auth()
+        self.assertAlmostEqual(self.sp._auth_expires_at - time.monotonic(), 600, delta=5)
+
+    def test_rejected_token_is_renewed_and_the_request_retried_once(self):
+        StubAuthenticationContext.token = TokenResponse.from_json({"access_token": "a", "token_type": "Bearer", "expires_in": "3600"})
+        request = mock.Mock(side_effect=[unauthorized(), "done"])
+        self.assertEqual(self.sp.run(request), "done")
+        self.assertEqual(StubAuthenticationContext.acquired, 2)
+
+        request = mock.Mock(side_effect=[unauthorized(), unauthorized()])
+        with self.assertRaises(requests.HTTPError):
+            self.sp.run(request)
+        self.assertEqual(request.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import pathlib
+import tempfile
+import unittest
+from functools import partial
+from unittest import mock
+import exe_process_pdf_files as exe
+from pipeline.watcher import FolderScanner
+
+
+class StubSharePoint:
+
+    def __init__(self, files):
+        self.files = files
+
+    def folder_signature(self, folder_path):
+        files = self.files.get(folder_path, [])
+        return {"item_count": len(files), "last_modified": max((x["etag"] for x in files), default=None)}
+
+    def files_in_folder(self, folder_path, page_size=None):
+        return list(self.files.get(folder_path, []))
+
+
+def result(file, error=None):
+    return {"item": file, "result": None if error else "1 rows uploaded", "error": error, "stage": "upload" if error else None}
+
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.state_path = pathlib.Path(self.folder.name) / "scan_state.json"
+        self.file = {"file_name": "camp_hill.pdf", "file_path": f"{exe.REPOSITORY}camp_hill.pdf", "etag": "1"}
+        self.sp = StubSharePoint({exe.REPOSITORY: [self.file]})
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_watch_pending_files_processes_new_files(self):
+        process = mock.Mock(side_effect=lambda files, sp: [result(x) for x in files])
+        with mock.patch.object(exe, "get_sharepoint_interface", return_value=self.sp), \
+             mock.patch.object(exe, "FolderScanner", partial(FolderScanner, state_path=self.state_path)), \
+             mock.patch.object(exe, "process_pending_files", process):
+            exe.watch_pending_files(interval=0, polls=1)
+        process.assert_called_once_with(files=[self.file], sp=self.sp)
+
+    def test_failed_files_are_listed_again(self):
+        scanner = FolderScanner(self.sp, exe.REPOSITORY, self.state_path)
+        files = scanner.pending_files()
+        scanner.commit([result(x, Exception("upload to database failed")) for x in files])
+        # the folder did not change, but the failed file is still pending
+        self.assertEqual(scanner.pending_files(), [self.file])
+
+        scanner.commit([result(self.file)])
+        self.assertEqual(scanner.pending_files(), [])
+
+    def test_file_arriving_during_a_run_is_listed_next_time(self):
+        scanner = FolderScanner(self.sp, exe.REPOSITORY, self.state_path)
+        files = scanner.pending_files()
+        late = {"file_name": "denver.pdf", "file_path": f"{exe.REPOSITORY}denver.pdf", "etag": "2"}
+        self.sp.files[exe.REPOSITORY].append(late)
+        scanner.commit([result(x) for x in files])
+        self.assertEqual(scanner.pending_files(), [late])
+
+
+if __name__ == "__main__":
+    unittest.main()
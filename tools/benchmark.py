@@ -0,0 +1,333 @@
+"""
+Offline benchmark of the PDF -> Parquet path, no SharePoint, Impala or HDFS needed.
+
+    python tools/benchmark.py run --batch 10 --output before.json
+    python tools/benchmark.py run --files "2024.10.07 Statesville.pdf" --output pdf.json
+    python tools/benchmark.py compare before.json after.json --threshold 0.2
+
+Every fixture goes through the same stages as an ingest run: download (local SharePoint stand-in),
+fingerprint, tabula extraction, species/weight transforms, type casting, Parquet export and the
+DataUpload load sequence against the local DuckDB backend (CDPInterface with environments/local.json).
+PDFs are extracted with tabula even when no parser claims their format, so extraction can be timed on any
+PDF; the rest of such a file is skipped. Parquet fixtures (already parsed price lists) are turned back into
+the raw tables tabula hands over and timed from the transforms on. The default fixtures are the parsed price
+lists, which run anywhere; PDFs (which need Java for tabula) are benchmarked with --files. A single-file run
+and an N-file batch are measured with per-stage timings and peak memory.
+Stages that fail for a file (e.g. no Java for tabula, or a format without a parser) are recorded as errors
+and the remaining stages of that file are skipped.
+"""
+import sys
+import pathlib
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path: sys.path.append(str(ROOT))
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+import competitor_data.purina_file as purina
+import environments as env
+from cdp_interface import CDPInterface
+from cdp_interface.upload_data import DataUpload
+from competitor_data.registry import detect_format
+from competitor_data.schemas import COMP_PRICE_GRID, SCHEMAS
+from pipeline.manifest import content_hash
+
+DEFAULT_FILES = sorted((ROOT / "tests/support_files/price_lists").glob("*.parquet"))
+RESULTS_FOLDER = ROOT / "tools/benchmark_results"
+
+
+class LocalSharePoint:
+    """
+    Stand-in for SharePointFunctions serving files from local paths. delete_file leaves the fixtures in place.
+    """
+
+    def files_in_folder(self, folder_path, page_size=None):
+        return [self.file_details(x) for x in sorted(pathlib.Path(folder_path).glob("*.pdf"))]
+
+    def file_details(self, file_path):
+        file_path = pathlib.Path(file_path)
+        stat = file_path.stat()
+        return {
+            "file_path": str(file_path),
+            "file_name": file_path.name,
+            "modified_by": None,
+            "modified_by_email": None,
+            "last_modified": datetime.datetime.fromtimestamp(stat.st_mtime),
+            "etag": None,
+            "size": stat.st_size
+        }
+
+    def open_file(self, file_path, spool_threshold=None):
+        buffer = tempfile.SpooledTemporaryFile(max_size=spool_threshold or 20 * 1024 * 1024)
+        with open(file_path, "rb") as source: shutil.copyfileobj(source, buffer)
+        buffer.seek(0)
+        return buffer
+
+    def delete_file(self, file_path):
+        return True
+
+
+def local_cdp(root):
+    """
+    CDPInterface on the local backend (cdp_interface.local_backend) under root, with the price tables created,
+    so the load stage runs the real DataUpload sequence against DuckDB instead of Impala and HDFS.
+    """
+    cdp = CDPInterface({**env.local, "local_root": str(root)}, None)
+    for schema in SCHEMAS.values():
+        cdp.execute(schema.ddl(schema.table_name, location=f"@hdfs_root_folder/{schema.table_name}"))
+    return cdp
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.timings = {}
+
+    def run(self, stage, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.timings.setdefault(stage, []).append(time.perf_counter() - start)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values: return None
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def file_label(file_path):
+    return re.sub(r"\W+", "_", pathlib.Path(file_path).stem).strip("_").lower()
+
+
+def price_cell(value):
+    if value < 0: return f"{abs(value)}-"
+    return str(value)
+
+
+def raw_tables(price_list):
+    """
+    Rebuilds what tabula hands over for a parsed price list: object columns, prices as text with a trailing minus
+    for negatives and a species header row above each species block.
+    """
+    rows = []
+    for species, block in price_list.groupby("species", sort=False):
+        rows.append([species] + [np.nan] * (len(purina.PDF_COLUMNS) - 1))
+        for values in block[purina.PDF_COLUMNS].itertuples(index=False):
+            values = list(values)
+            values[7:12] = [price_cell(x) for x in values[7:12]]
+            rows.append([np.nan if pd.isna(x) else x for x in values])
+    return pd.DataFrame(rows, columns=purina.PDF_COLUMNS, dtype=object)
+
+
+def process_pdf(timer, sp, cdp, work_folder, file_path, index):
+    pdf = timer.run("download", sp.open_file, file_path)
+    try:
+        timer.run("download", content_hash, pdf)
+        parser = timer.run("fingerprint", detect_format, pdf)
+
+        if parser is None or parser.name == "purina_vertical":
+            # tabula is most of the cost of a file, so it is timed even when no parser claims the format
+            extraction = timer.run("extraction", purina.extract_pdf, pdf)
+            if extraction is None: raise Exception("extraction failed")
+            if parser is None: raise Exception("unknown price list format, only extraction was timed")
+            price_list = timer.run("transforms", lambda: purina.build_price_list(
+                purina.assemble_price_list(extraction["tables"])["price_list"],
+                extraction["location"],
+                extraction["effective_date"]
+            ))
+        else:
+            data = timer.run("extraction", parser.extract, pdf)
+            if data is None: raise Exception("extraction failed")
+            price_list = data["price_list"]
+    finally:
+        pdf.close()
+
+    load(timer, cdp, work_folder, price_list, parser.schema, file_path, index)
+    return price_list.shape[0]
+
+
+def process_parquet(timer, cdp, work_folder, file_path, index):
+    parsed = pd.read_parquet(file_path)
+    tables = raw_tables(parsed)
+    price_list = timer.run("transforms", purina.build_price_list, tables, parsed["plant_location"].iloc[0], parsed["date_inserted"].iloc[0])
+    load(timer, cdp, work_folder, price_list, COMP_PRICE_GRID, file_path, index)
+    return price_list.shape[0]
+
+
+def load(timer, cdp, work_folder, price_list, schema, file_path, index):
+    file_name = f"{file_label(file_path)}_{index}"
+    price_list = timer.run("cast", schema.cast, price_list, True)
+
+    uploader = DataUpload(None, None, schema=schema)
+    exported = timer.run("parquet_export", uploader.export_data_to_parquet_file, price_list, schema.table_name, file_name, work_folder)
+    if exported is None: raise Exception("parquet export failed")
+    pathlib.Path(exported).unlink()
+
+    if not timer.run("load", cdp.upload_data, price_list, schema.table_name, file_name, False, schema): raise Exception("load failed")
+
+
+def run_files(files):
+    timer = StageTimer()
+    sp = LocalSharePoint()
+    errors = []
+    rows = 0
+
+    work_folder = pathlib.Path(tempfile.mkdtemp(prefix="benchmark_"))
+    cdp = local_cdp(work_folder / "cluster")
+    try:
+        for index, file_path in enumerate(files):
+            try:
+                if file_path.suffix.lower() == ".parquet": rows += process_parquet(timer, cdp, work_folder, file_path, index)
+                else: rows += process_pdf(timer, sp, cdp, work_folder, file_path, index)
+            except Exception as error:
+                errors.append({"file": file_path.name, "error": str(error)})
+    finally:
+        cdp.close()
+        shutil.rmtree(work_folder, ignore_errors=True)
+    return timer, rows, errors
+
+
+def run_benchmark(label, files):
+    """
+    Runs the files one after the other and returns the per-stage statistics, errors and peak memory of the run.
+    tracemalloc slows allocation heavy code down several times over, so timings come from one pass and
+    the traced peak from a second pass over the same files.
+    """
+    start = time.perf_counter()
+    timer, rows, errors = run_files(files)
+    wall_time = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        run_files(files)
+        _, peak_traced = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "label": label,
+        "files": len(files),
+        "rows": rows,
+        "errors": errors,
+        "wall_time": wall_time,
+        "peak_traced_mb": peak_traced / 1024 / 1024,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "total": sum(values),
+                "mean": statistics.mean(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "max": max(values)
+            }
+            for stage, values in timer.timings.items()
+        }
+    }
+
+
+def run(args):
+    files = [pathlib.Path(x).resolve() for x in args.files] if args.files else DEFAULT_FILES
+    batch = [files[i % len(files)] for i in range(args.batch)]
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "fixtures": [x.name for x in files],
+        "runs": [
+            run_benchmark("single", files[:1]),
+            run_benchmark(f"batch_{args.batch}", batch)
+        ]
+    }
+
+    output = pathlib.Path(args.output or RESULTS_FOLDER / f"benchmark_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=4))
+
+    for x in report["runs"]:
+        print(f"\n{x['label']}: {x['files']} files, {x['rows']} rows, {x['wall_time']:.2f}s, peak {x['peak_traced_mb']:.1f} MB traced / {x['max_rss_mb']:.0f} MB rss")
+        for stage, stats in x["stages"].items():
+            print(f"  {stage:15} mean {stats['mean'] * 1000:9.1f} ms   p95 {stats['p95'] * 1000:9.1f} ms   total {stats['total']:.2f}s")
+        for error in x["errors"]: print(f"  ERROR {error['file']}: {error['error']}")
+    print(f"\nresults saved to {output}")
+    return 0
+
+
+def compare(args):
+    """
+    Flags every stage whose mean time, and every run whose peak memory, grew by more than threshold.
+    A run or stage found in only one of the files is flagged too, the two would not measure the same work.
+    Exits with 1 when something regressed.
+    """
+    before = {x["label"]: x for x in json.loads(pathlib.Path(args.before).read_text())["runs"]}
+    after = {x["label"]: x for x in json.loads(pathlib.Path(args.after).read_text())["runs"]}
+    regressions = 0
+
+    for label in sorted(before.keys() | after.keys()):
+        print(f"\n{label}")
+        if label not in before or label not in after:
+            regressions += 1
+            print(f"  run missing from {'before' if label not in before else 'after'}  MISSING")
+            continue
+
+        stages = list(before[label]["stages"]) + [x for x in after[label]["stages"] if x not in before[label]["stages"]]
+        metrics = [(f"stage {stage}", before[label]["stages"].get(stage, {}).get("mean"), after[label]["stages"].get(stage, {}).get("mean")) for stage in stages]
+        metrics += [(x, before[label][x], after[label][x]) for x in ("wall_time", "peak_traced_mb")]
+
+        for name, old, new in metrics:
+            if old is None or new is None:
+                regressions += 1
+                print(f"  {name:25} missing from {'before' if old is None else 'after'}  MISSING")
+                continue
+            if not old: continue
+            change = (new - old) / old
+            flag = "REGRESSION" if change > args.threshold else ""
+            if flag: regressions += 1
+            print(f"  {name:25} {old:10.4f} -> {new:10.4f}  {change:+7.1%}  {flag}")
+
+    print(f"\n{regressions} regressions above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark the fixtures and save the results as JSON")
+    run_parser.add_argument("--files", nargs="*", help="PDF or parsed price list (.parquet) fixtures")
+    run_parser.add_argument("--batch", type=int, default=10, help="number of files in the batch run")
+    run_parser.add_argument("--output", help="JSON file for the results")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown reported as a regression")
+
+    args = parser.parse_args()
+    for name in ("files", "output", "before", "after"):
+        value = getattr(args, name, None)
+        if value: setattr(args, name, [os.path.abspath(x) for x in value] if isinstance(value, list) else os.path.abspath(value))
+    # the SQL templates and default folders are relative to the repository root
+    os.chdir(ROOT)
+    if args.command == "run": return run(args)
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())